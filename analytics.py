@@ -0,0 +1,104 @@
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+from storage import ANALYTICS_MAX_DAYS, LOW_CONFIDENCE_THRESHOLD
+
+# Tableaux de bord globaux (/api/analytics, page statistiques de appST.py) calculés sur
+# les lignes de class_daily_rollups : (jour, classe, shard, nombre, somme des confiances,
+# nombre sous le seuil). Une période quelconque se réduit à quelques centaines de lignes
+# fusionnées en une passe pandas (somme des shards, regroupement par jour ou par semaine),
+# sans jamais relire predictions.
+
+BUCKETS = {'day': 'D', 'week': 'W-SUN'}
+DEFAULT_SPANS = {'day': 30, 'week': 12 * 7}
+COLUMNS = ['day', 'predicted_class', 'prediction_count', 'confidence_sum', 'low_confidence_count']
+
+
+def parse_range(start, end, bucket):
+    # Renvoie (début, fin) inclus ; défaut : les 30 derniers jours ou les 12 dernières semaines
+    if bucket not in BUCKETS:
+        raise ValueError(f"bucket inconnu: {bucket} (day, week)")
+    end = date.fromisoformat(end) if end else date.today()
+    start = date.fromisoformat(start) if start else end - timedelta(days=DEFAULT_SPANS[bucket] - 1)
+    if start > end:
+        raise ValueError("from postérieur à to")
+    if (end - start).days >= ANALYTICS_MAX_DAYS:
+        raise ValueError(f"Période limitée à {ANALYTICS_MAX_DAYS} jours")
+    return start, end
+
+
+def percent(numerator, denominator):
+    # Division vectorisée, 0 pour les cases vides
+    numerator = np.asarray(numerator, dtype=np.float64)
+    denominator = np.asarray(denominator, dtype=np.float64)
+    return np.round(np.divide(numerator * 100, denominator, out=np.zeros_like(numerator), where=denominator > 0), 2)
+
+
+def summarize(rows, start, end, bucket='day'):
+    frame = pd.DataFrame(rows, columns=COLUMNS)
+    frame['day'] = pd.to_datetime(frame['day'])
+    for column in COLUMNS[2:]:
+        frame[column] = pd.to_numeric(frame[column])
+    frame['bucket'] = frame['day'].dt.to_period(BUCKETS[bucket]).dt.start_time
+
+    # Shards et jours d'un même intervalle additionnés ensemble
+    cells = frame.groupby(['bucket', 'predicted_class'], sort=True)[COLUMNS[2:]].sum()
+    # Série continue : les intervalles sans prédiction valent 0
+    buckets = pd.period_range(start, end, freq=BUCKETS[bucket]).start_time
+    per_bucket = cells.groupby(level='bucket').sum().reindex(buckets, fill_value=0)
+    per_class = cells.groupby(level='predicted_class').sum().sort_values('prediction_count', ascending=False)
+
+    cells = cells.assign(
+        share=percent(cells['prediction_count'], per_bucket['prediction_count'].reindex(cells.index, level='bucket')),
+        mean_confidence=percent(cells['confidence_sum'], cells['prediction_count'])
+    )
+    per_bucket = per_bucket.assign(
+        low_confidence_rate=percent(per_bucket['low_confidence_count'], per_bucket['prediction_count']),
+        mean_confidence=percent(per_bucket['confidence_sum'], per_bucket['prediction_count'])
+    )
+    total = int(per_class['prediction_count'].sum())
+    per_class = per_class.assign(
+        share=percent(per_class['prediction_count'], total),
+        mean_confidence=percent(per_class['confidence_sum'], per_class['prediction_count']),
+        low_confidence_rate=percent(per_class['low_confidence_count'], per_class['prediction_count'])
+    )
+
+    series = []
+    filled = set(cells.index.get_level_values('bucket'))
+    for bucket_start, row in per_bucket.iterrows():
+        classes = cells.xs(bucket_start, level='bucket') if bucket_start in filled else cells.iloc[:0]
+        series.append({
+            'start': bucket_start.date().isoformat(),
+            'total': int(row['prediction_count']),
+            'mean_confidence': float(row['mean_confidence']),
+            'low_confidence_rate': float(row['low_confidence_rate']),
+            'classes': {
+                class_name: {
+                    'count': int(cell['prediction_count']),
+                    'share': float(cell['share']),
+                    'mean_confidence': float(cell['mean_confidence'])
+                }
+                for class_name, cell in classes.iterrows()
+            }
+        })
+
+    return {
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'bucket': bucket,
+        'low_confidence_threshold': round(LOW_CONFIDENCE_THRESHOLD * 100, 2),
+        'total_predictions': total,
+        'low_confidence_rate': float(percent(per_class['low_confidence_count'].sum(), total)),
+        'classes': {
+            class_name: {
+                'count': int(row['prediction_count']),
+                'share': float(row['share']),
+                'mean_confidence': float(row['mean_confidence']),
+                'low_confidence_rate': float(row['low_confidence_rate'])
+            }
+            for class_name, row in per_class.iterrows()
+        },
+        'series': series
+    }
@@ -1,24 +1,45 @@
-from flask import Flask, request, jsonify, session, send_from_directory, render_template
+import time
+APP_IMPORT_STARTED = time.perf_counter()
+
+from flask import Flask, Request, request, jsonify, session, send_from_directory, render_template, Response, stream_with_context, g
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
-from tensorflow.keras.models import load_model
-from tensorflow.keras.preprocessing import image
-from tensorflow.keras.applications.resnet50 import preprocess_input
 import numpy as np
 import os
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 import base64
 from io import BytesIO
 from PIL import Image
 import json
 from functools import wraps
 import string
-import mysql.connector
-from mysql.connector import Error
+import zipfile
+import tarfile
+import threading
+import atexit
+from concurrent.futures import ThreadPoolExecutor
 import secrets
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
+from stores import store_from_env, RowRejected, StorageError
+from storage import parse_limit, parse_day, UNCERTAINTY_DEFAULT_SCAN, UNCERTAINTY_MAX_SCAN
+from probabilities import encode_probabilities, describe_vector, annotate_rows, filter_uncertain, uncertainty_summary
+from inference_backends import default_model_path
+from embeddings import EmbeddingStore, load_heads
+from model_server import LocalModel, RemoteModel
+from similarity import VectorIndex
+from scene_tiling import SceneJob, file_digest, owned_job_dir
+from cascade import Cascade
+from write_behind import WriteBehindBuffer, BufferFull, merge_pending
+from read_cache import read_cache_from_env
+from analytics import parse_range, summarize
+from tta import dihedral_batch, average_predictions, should_use_tta
+from model_registry import ModelRegistry, ModelSlot, ServedModel, PREPROCESSING
+from prediction_cache import PredictionCache, image_cache_key
+from upload_store import upload_store_from_env
+
+APP_IMPORT_SECONDS = time.perf_counter() - APP_IMPORT_STARTED
 
 app = Flask(__name__)
 app.secret_key = 'votre_cle_secrete_super_securisee_12345'
@@ -39,29 +60,233 @@ FROM_EMAIL = os.getenv("FROM_EMAIL", SMTP_USERNAME)
 SMTP_USE_TLS = os.getenv("SMTP_USE_TLS", "true").lower() == "true"
 SMTP_USE_SSL = os.getenv("SMTP_USE_SSL", "false").lower() == "true"
 
-def get_db_connection():
+# STORAGE_BACKEND=mysql (DB_HOST, DB_USER, DB_PASSWORD, DB_NAME, DB_POOL_*) ou
+# sqlite (SQLITE_PATH), voir stores.py
+store = store_from_env("eurosat_db")
+
+# 'sync' : INSERT avant la réponse de /api/predict, 'write_behind' : file en mémoire +
+# journal local, insertion par lots en arrière-plan (voir write_behind.py)
+PREDICTION_WRITE_MODE = os.getenv("PREDICTION_WRITE_MODE", "sync").lower()
+WRITE_BEHIND_DIR = os.getenv("WRITE_BEHIND_DIR", "write_behind")
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "200"))
+WRITE_BEHIND_FLUSH_MS = float(os.getenv("WRITE_BEHIND_FLUSH_MS", "500"))
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "10000"))
+WRITE_BEHIND_FSYNC = os.getenv("WRITE_BEHIND_FSYNC", "false").lower() == "true"
+
+# Pages d'historique et statistiques par utilisateur (READ_CACHE_SIZE, READ_CACHE_TTL,
+# READ_CACHE_URL), invalidées après chaque insertion
+read_cache = read_cache_from_env(store.name)
+
+def invalidate_user_reads(rows):
+    for user_id in {row[0] for row in rows}:
+        read_cache.invalidate(user_id)
+
+def write_prediction_rows(rows):
+    # Appelée par le flusher : une erreur laisse le lot en file pour un nouvel essai,
+    # RowRejected met de côté les lignes refusées (voir write_behind.py)
+    store.insert_predictions(rows)
+    invalidate_user_reads(rows)
+
+write_behind = None
+if PREDICTION_WRITE_MODE == 'write_behind':
+    write_behind = WriteBehindBuffer(
+        write_prediction_rows, WRITE_BEHIND_DIR,
+        max_pending=WRITE_BEHIND_MAX_PENDING,
+        batch_size=WRITE_BEHIND_BATCH_SIZE,
+        flush_interval=WRITE_BEHIND_FLUSH_MS / 1000,
+        fsync=WRITE_BEHIND_FSYNC,
+        permanent_errors=(RowRejected,)
+    )
+    # Vidage à l'arrêt du processus
+    atexit.register(write_behind.close)
+
+def record_prediction(row):
+    # row : (user_id, image_name, predicted_class, confidence, model_version, probabilities)
+    if write_behind is not None:
+        try:
+            write_behind.submit(row)
+            return
+        except BufferFull as e:
+            # File saturée (base en panne prolongée) : retour à l'écriture directe
+            print(f"Écriture différée indisponible: {e}")
+    
     try:
-        connection = mysql.connector.connect(
-            host="localhost",
-            user="root",
-            password="1234567890",
-            database="eurosat_db",
-            autocommit=True
-        )
-        return connection
-    except Error as e:
-        print(f"Erreur de connexion à la base de données: {e}")
-        return None
+        store.insert_predictions([row])
+        invalidate_user_reads([row])
+    except StorageError as e:
+        print(f"Erreur enregistrement prédiction: {e}")
 
 MODEL_PATH = "resnet50_fast_model.h5"
 INPUT_SIZE = (128, 128)
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "keras").lower()
+INFERENCE_MODEL_PATH = os.getenv("INFERENCE_MODEL_PATH") or default_model_path(INFERENCE_BACKEND, MODEL_PATH)
+# Serveur d'inférence partagé (socket Unix ou host:port) ; vide = modèle chargé dans ce processus
+MODEL_SERVER_ADDRESS = os.getenv("MODEL_SERVER_ADDRESS", "")
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "16"))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "8"))
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "32"))
+WARM_UP_BATCH_SIZES = [int(size) for size in os.getenv("WARM_UP_BATCH_SIZES", f"1,{BATCH_MAX_SIZE},{BULK_BATCH_SIZE}").split(',')]
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.tif', '.tiff')
+# 'async' : écriture après la réponse, 'sync' : avant la réponse, 'none' : pas de stockage
+UPLOAD_PERSIST_MODE = os.getenv("UPLOAD_PERSIST_MODE", "async").lower()
+# Contenu adressé par hash : une URL /uploads ne change jamais de contenu
+UPLOAD_CACHE_MAX_AGE = int(os.getenv("UPLOAD_CACHE_MAX_AGE", str(365 * 24 * 3600)))
+
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", "10000"))
+PREDICTION_CACHE_PATH = os.getenv("PREDICTION_CACHE_PATH", "")
+# Backbone ResNet50 gelé : les embeddings restent valables d'un checkpoint de tête à l'autre
+SPLIT_SERVING = os.getenv("SPLIT_SERVING", "true").lower() == "true"
+EMBEDDING_VERSION = os.getenv("EMBEDDING_VERSION", "resnet50-imagenet-gap")
+EMBEDDING_STORE_PATH = os.getenv("EMBEDDING_STORE_PATH", "embeddings.sqlite")
+HEADS_DIR = os.getenv("HEADS_DIR", "heads")
+# Test-time augmentation : 'off', 'on' ou 'auto' (seulement sous le seuil de confiance)
+TTA_MODE = os.getenv("TTA_MODE", "auto").lower()
+TTA_CONFIDENCE_THRESHOLD = float(os.getenv("TTA_CONFIDENCE_THRESHOLD", "0.6"))
+# Cascade CNN léger -> ResNet50 (-> ensemble), seuils produits par calibrate_cascade.py
+CASCADE_CONFIG = os.getenv("CASCADE_CONFIG", "cascade.json")
+# Réponses de l'étage léger : embedding backbone calculé après la réponse, pour que l'image
+# reste trouvable par /api/similar (désactiver pour réserver le backbone aux requêtes)
+CASCADE_EMBED_LIGHT = os.getenv("CASCADE_EMBED_LIGHT", "true").lower() == "true"
+SCENE_DIR = os.getenv("SCENE_DIR", "scenes")
+SCENE_INPUT_DIR = os.getenv("SCENE_INPUT_DIR", "")
+SCENE_MAX_UPLOAD = int(os.getenv("SCENE_MAX_UPLOAD_MB", "1024")) * 1024 * 1024
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", "vector_index")
+SIMILARITY_IVF_THRESHOLD = int(os.getenv("SIMILARITY_IVF_THRESHOLD", "20000"))
+# Registre de versions (model_registry.py) ; sans version active, INFERENCE_MODEL_PATH est servi
+MODEL_REGISTRY_DIR = os.getenv("MODEL_REGISTRY_DIR", "models")
+REGISTRY_POLL_SECONDS = float(os.getenv("REGISTRY_POLL_SECONDS", "5"))
+ADMIN_USERS = set(os.getenv("ADMIN_USERS", "admin").split(','))
+
+class SceneUploadRequest(Request):
+    # Les scènes dépassent largement la limite des uploads d'images simples ; la limite
+    # se choisit ici car request.max_content_length n'est modifiable qu'à partir de Flask 3.1
+    @property
+    def max_content_length(self):
+        if self.path == '/api/scene':
+            return SCENE_MAX_UPLOAD
+        return super().max_content_length
+
+app.request_class = SceneUploadRequest
 
-try:
-    model = load_model(MODEL_PATH)
-    print("Modèle chargé avec succès")
-except Exception as e:
-    print(f"Erreur lors du chargement du modèle: {e}")
-    model = None
+upload_writer = ThreadPoolExecutor(max_workers=2, thread_name_prefix="upload-writer")
+embedding_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedding-writer")
+# Images adressées par contenu (UPLOAD_STORE_DIR, index UPLOAD_INDEX_PATH), voir upload_store.py
+upload_store = upload_store_from_env(app.config['UPLOAD_FOLDER'])
+
+prediction_cache = PredictionCache(PREDICTION_CACHE_SIZE, PREDICTION_CACHE_PATH or None)
+
+# Le modèle est chargé en arrière-plan : les routes d'authentification et d'historique
+# répondent immédiatement, /ready ne passe au vert qu'après le passage de chauffe.
+# La version servie vit dans un ModelSlot : /api/admin/models la remplace à chaud, les
+# requêtes en cours terminent sur l'ancienne version qui est libérée ensuite.
+serving = ModelSlot()
+registry = ModelRegistry(MODEL_REGISTRY_DIR)
+cascade = None
+embedding_store = None
+vector_index = None
+registry_checked_at = 0.0
+
+startup_state = {'phase': 'starting', 'error': None, 'timings': {}}
+
+def load_served_model(version=None):
+    # version=None : artefact historique (INFERENCE_MODEL_PATH) hors registre
+    if version is None:
+        backend, path = INFERENCE_BACKEND, INFERENCE_MODEL_PATH
+        metadata = {'class_names': CLASS_NAMES, 'input_size': list(INPUT_SIZE), 'preprocessing': 'resnet50'}
+    else:
+        metadata = registry.metadata(version)
+        backend, path = metadata['backend'], registry.artifact_path(version)
+        if tuple(metadata['input_size']) != INPUT_SIZE:
+            raise ValueError(f"Taille d'entrée {metadata['input_size']} incompatible avec {list(INPUT_SIZE)}")
+        if metadata['preprocessing'] not in PREPROCESSING:
+            raise ValueError(f"Prétraitement non supporté: {metadata['preprocessing']}")
+    
+    loaded = LocalModel(backend, path, split=SPLIT_SERVING,
+                        max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS)
+    print(f"Modèle chargé avec succès ({backend}: {path})")
+    try:
+        loaded.warm_up(WARM_UP_BATCH_SIZES, INPUT_SIZE)
+        probe = loaded.classify(np.zeros((1, INPUT_SIZE[0], INPUT_SIZE[1], 3), dtype=np.uint8))
+        if probe.shape[-1] != len(metadata['class_names']):
+            raise ValueError(f"{probe.shape[-1]} sorties pour {len(metadata['class_names'])} classes")
+    except Exception:
+        loaded.close()
+        raise
+    
+    served_heads = {}
+    if loaded.split:
+        # Les têtes de HEADS_DIR ne valent que pour le backbone avec lequel elles ont été entraînées
+        if metadata.get('embedding_version', EMBEDDING_VERSION) == EMBEDDING_VERSION:
+            served_heads = load_heads(HEADS_DIR)
+        served_heads['default'] = loaded.head
+    
+    if version is None:
+        version = os.getenv("MODEL_VERSION") or loaded.info()['model_version']
+    return ServedModel(version, loaded, metadata, served_heads)
+
+def init_model():
+    global cascade, embedding_store, vector_index
+    started = time.perf_counter()
+    loaded = None
+    try:
+        startup_state['phase'] = 'loading'
+        if MODEL_SERVER_ADDRESS:
+            loaded = RemoteModel(MODEL_SERVER_ADDRESS)
+            print(f"Connecté au serveur d'inférence {MODEL_SERVER_ADDRESS}")
+            startup_state['phase'] = 'warming_up'
+            loaded.warm_up(WARM_UP_BATCH_SIZES, INPUT_SIZE)
+            served = ServedModel(loaded.info()['model_version'], loaded,
+                                 {'class_names': CLASS_NAMES, 'input_size': list(INPUT_SIZE), 'preprocessing': 'resnet50'},
+                                 {'default': loaded.head} if loaded.split else {})
+        else:
+            startup_state['phase'] = 'warming_up'
+            served = load_served_model(registry.active_version())
+            loaded = served.model
+        
+        # En mode découpé, le modèle ne renvoie que les embeddings du backbone
+        if served.split:
+            embedding_store = EmbeddingStore(EMBEDDING_STORE_PATH)
+            vector_index = VectorIndex(VECTOR_INDEX_DIR, dim=loaded.embedding_size,
+                                       ivf_threshold=SIMILARITY_IVF_THRESHOLD)
+            print(f"Service backbone/tête activé ({len(served.heads)} tête(s))")
+        
+        if CASCADE_CONFIG and os.path.exists(CASCADE_CONFIG):
+            cascade = Cascade.from_file(CASCADE_CONFIG, lambda path: LocalModel(
+                'keras', path, split=False, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS))
+            cascade.light_model.warm_up([1], INPUT_SIZE)
+            print(f"Cascade activée ({cascade.light_name} -> {cascade.heavy_name}"
+                  f"{' -> ensemble' if cascade.ensemble_models else ''})")
+        
+        serving.activate(served)
+        startup_state['phase'] = 'ready'
+    except Exception as e:
+        print(f"Erreur lors du chargement du modèle: {e}")
+        startup_state['phase'] = 'failed'
+        startup_state['error'] = str(e)
+    finally:
+        timings = dict(loaded.timings) if loaded is not None else {}
+        timings['module_imports'] = APP_IMPORT_SECONDS
+        timings['total'] = time.perf_counter() - started
+        startup_state['timings'] = {phase: round(seconds, 3) for phase, seconds in timings.items()}
+        print("Démarrage: " + ", ".join(f"{phase}={seconds}s" for phase, seconds in startup_state['timings'].items()))
+
+def follow_registry():
+    # Les autres workers suivent models/ACTIVE, relu au plus toutes les REGISTRY_POLL_SECONDS
+    global registry_checked_at
+    now = time.monotonic()
+    if MODEL_SERVER_ADDRESS or now - registry_checked_at < REGISTRY_POLL_SECONDS:
+        return
+    registry_checked_at = now
+    active = registry.active_version()
+    current = serving.current
+    if serving.failed_version is not None:
+        if active == serving.failed_version:
+            # Échec déjà constaté pour cette version : on attend que ACTIVE change
+            return
+        serving.failed_version = None
+    if active and current is not None and active != current.version and serving.loading is None:
+        print(f"Nouvelle version active dans le registre: {active}")
+        serving.load_in_background(active, load_served_model)
 
 CLASS_NAMES = ['AnnualCrop', 'Forest', 'HerbaceousVegetation', 'Highway', 'Industrial', 
                'Pasture', 'PermanentCrop', 'Residential', 'River', 'SeaLake']
@@ -79,6 +304,8 @@ CLASS_DESCRIPTIONS = {
     'SeaLake': "🌊 Mers et lacs : Étendues d'eau statiques (mers, océans, lacs, réservoirs). Grandes surfaces d'eau immobiles."
 }
 
+threading.Thread(target=init_model, name="model-loader", daemon=True).start()
+
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -87,83 +314,328 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
-def predict_with_model(image_path):
-    if model is None:
-        return None, 0, None
-        
+def decode_image_bytes(data):
+    # Décodage unique des octets reçus en tableau uint8 (H, W, 3) à la taille du modèle
+    img = Image.open(BytesIO(data)).convert('RGB').resize(INPUT_SIZE, Image.NEAREST)
+    return np.asarray(img, dtype=np.uint8)
+
+def upload_name(data, original_name=None):
+    # Renvoie (image_name, hash du contenu) ; l'image_name préfixé du hash ne se réutilise
+    # jamais pour un autre contenu
+    if original_name and secure_filename(original_name):
+        return upload_store.name_for(data, original_name)
+    return upload_store.name_for(data, extension=image_extension(data))
+
+def write_upload(filename, digest, data):
+    try:
+        upload_store.put(filename, digest, data)
+    except Exception as e:
+        print(f"Erreur lors de l'enregistrement de l'image {filename}: {e}")
+
+def persist_upload(filename, digest, data):
+    if UPLOAD_PERSIST_MODE == 'none':
+        return
+    if UPLOAD_PERSIST_MODE == 'sync':
+        write_upload(filename, digest, data)
+    else:
+        upload_writer.submit(write_upload, filename, digest, data)
+
+def index_embedding(image_name, embedding):
+    try:
+        vector_index.add(image_name, embedding)
+    except Exception as e:
+        print(f"Erreur lors de l'indexation de {image_name}: {e}")
+
+def embedding_version(served):
+    # Une version dont le backbone a été ré-entraîné déclare son propre embedding_version
+    return served.metadata.get('embedding_version', EMBEDDING_VERSION)
+
+def probability_class_names():
+    # Ordre des classes des vecteurs stockés : celui du modèle servi (les lignes d'une autre
+    # largeur sont ignorées au décodage)
+    served = serving.current
+    return served.class_names if served is not None else CLASS_NAMES
+
+def lookup_embedding(served, img_array, image_name=None):
+    image_hash = image_cache_key(img_array, embedding_version(served))
+    embedding = embedding_store.get(image_hash)
+    if embedding is not None and image_name and embedding_store.link(image_name, image_hash):
+        if embedding_version(served) == EMBEDDING_VERSION:
+            index_embedding(image_name, embedding)
+    return image_hash, embedding
+
+def store_embedding(served, image_hash, embedding, image_name=None):
+    if embedding_store.put(image_hash, embedding, image_name) and embedding_version(served) == EMBEDDING_VERSION:
+        index_embedding(image_name, embedding)
+
+def model_required(f):
+    # La version servie est réservée pour toute la requête (réponses en flux comprises)
+    # et n'est rendue qu'à la fermeture de la réponse : un échange ne coupe rien en cours.
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if startup_state['phase'] == 'failed':
+            return jsonify({'error': 'Modèle non chargé'}), 503
+        follow_registry()
+        served = serving.acquire()
+        if served is None:
+            return jsonify({'error': 'Modèle en cours de chargement', 'phase': startup_state['phase']}), 503
+        g.served = served
+        try:
+            response = app.make_response(f(*args, **kwargs))
+        except Exception:
+            served.release()
+            raise
+        response.call_on_close(served.release)
+        return response
+    return decorated_function
+
+def admin_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if session.get('username') not in ADMIN_USERS:
+            return jsonify({'error': 'Accès réservé aux administrateurs'}), 403
+        return f(*args, **kwargs)
+    return decorated_function
+
+def is_known_head(served, head_name):
+    return head_name == 'default' or head_name in served.heads
+
+def predict_with_model(served, img_array, image_name=None, head_name='default'):
     try:
-        img = image.load_img(image_path, target_size=INPUT_SIZE)
-        img_array = image.img_to_array(img)
-        img_array = np.expand_dims(img_array, axis=0)
-        img_array = preprocess_input(img_array)
-        preds = model.predict(img_array, verbose=0)
-        pred_class = int(np.argmax(preds[0]))
-        confidence = float(np.max(preds[0]))
-        return pred_class, confidence, preds[0]
+        cache_key = image_cache_key(img_array, f"{served.version}:{head_name}")
+        cached = prediction_cache.get(cache_key)
+        if cached is not None:
+            if embedding_store is not None and image_name:
+                lookup_embedding(served, img_array, image_name)
+            return cached
+        
+        if served.split:
+            image_hash, embedding = lookup_embedding(served, img_array, image_name)
+            if embedding is None:
+                embedding = served.model.predict(img_array)
+                store_embedding(served, image_hash, embedding, image_name)
+            preds = served.heads[head_name].predict(embedding[np.newaxis])[0]
+        else:
+            preds = served.model.predict(img_array)
+        pred_class = int(np.argmax(preds))
+        confidence = float(np.max(preds))
+        prediction_cache.put(cache_key, pred_class, confidence, preds)
+        return pred_class, confidence, preds
     except Exception as e:
         print(f"Erreur lors de la prédiction: {e}")
         return None, 0, None
 
-def process_base64_image(base64_data, filename):
+def predict_with_tta(served, img_array, head_name='default'):
+    try:
+        cache_key = image_cache_key(img_array, f"{served.version}:{head_name}:tta")
+        cached = prediction_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        preds = average_predictions(predict_tensors(served, dihedral_batch(img_array), head_name))[0]
+        pred_class = int(np.argmax(preds))
+        confidence = float(np.max(preds))
+        prediction_cache.put(cache_key, pred_class, confidence, preds)
+        return pred_class, confidence, preds
+    except Exception as e:
+        print(f"Erreur lors de la prédiction TTA: {e}")
+        return None, 0, None
+
+def embed_in_background(img_array, image_name):
+    # Version servie réservée à part : la requête d'origine a pu rendre la sienne
+    served = serving.acquire()
+    if served is None:
+        return
+    try:
+        if served.split and embedding_store is not None:
+            image_hash, embedding = lookup_embedding(served, img_array, image_name)
+            if embedding is None:
+                store_embedding(served, image_hash, served.model.predict(img_array), image_name)
+    except Exception as e:
+        print(f"Erreur lors du calcul de l'embedding de {image_name}: {e}")
+    finally:
+        served.release()
+
+def predict_with_light_stage(img_array, image_name=None):
+    # Renvoie (classe, confiance, probabilités, version) si l'étage léger est assez sûr, sinon None.
+    # Seules les réponses acceptées sont mises en cache ; l'embedding backbone de l'image
+    # est calculé après la réponse (CASCADE_EMBED_LIGHT)
+    light_version = cascade.light_model.info()['model_version']
+    cache_key = image_cache_key(img_array, f"{light_version}:light")
+    cached = prediction_cache.get(cache_key)
+    if cached is None:
+        light_preds = cascade.light_predict(img_array)
+        if not cascade.light_accepts(light_preds):
+            return None
+        cached = (int(np.argmax(light_preds)), float(np.max(light_preds)), light_preds)
+        prediction_cache.put(cache_key, *cached)
+    if CASCADE_EMBED_LIGHT and image_name and embedding_store is not None:
+        embedding_writer.submit(embed_in_background, img_array, image_name)
+    return cached + (light_version,)
+
+def predict_with_cascade(served, img_array, image_name=None, head_name='default', tta_mode='off'):
+    # Renvoie (classe, confiance, probabilités, étage ayant répondu, TTA appliquée, version du modèle)
+    stage = cascade.heavy_name if cascade is not None else 'resnet50'
+    version = served.version
+    
+    # Le petit CNN ne connaît que les classes EuroSAT d'origine ; tta=on demande
+    # explicitement le modèle principal augmenté, l'étage léger est alors sauté
+    if cascade is not None and head_name == 'default' and served.class_names == CLASS_NAMES and tta_mode != 'on':
+        try:
+            light = predict_with_light_stage(img_array, image_name)
+            if light is not None:
+                pred_class, confidence, predictions, light_version = light
+                return pred_class, confidence, predictions, cascade.light_name, False, light_version
+        except Exception as e:
+            print(f"Erreur étage {cascade.light_name} de la cascade: {e}")
+    
+    pred_class, confidence, predictions = predict_with_model(served, img_array, image_name, head_name)
+    if pred_class is None:
+        return None, 0, None, stage, False, version
+    
+    used_tta = False
+    if should_use_tta(tta_mode, confidence, TTA_CONFIDENCE_THRESHOLD):
+        tta_class, tta_confidence, tta_predictions = predict_with_tta(served, img_array, head_name)
+        if tta_class is not None:
+            pred_class, confidence, predictions = tta_class, tta_confidence, tta_predictions
+            used_tta = True
+    
+    if cascade is not None and head_name == 'default' and served.class_names == CLASS_NAMES \
+            and cascade.needs_ensemble(predictions):
+        try:
+            predictions = cascade.ensemble_predict(img_array, predictions)
+            pred_class = int(np.argmax(predictions))
+            confidence = float(np.max(predictions))
+            stage = 'ensemble'
+            version = f"{served.version}+ensemble"
+        except Exception as e:
+            print(f"Erreur ensemble de la cascade: {e}")
+    
+    return pred_class, confidence, predictions, stage, used_tta, version
+
+def decode_base64_image(base64_data):
     try:
         if ',' in base64_data:
             base64_data = base64_data.split(',')[1]
         
-        image_data = base64.b64decode(base64_data)
-        image = Image.open(BytesIO(image_data))
-        
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        image.save(filepath)
-        
-        return filepath
+        return base64.b64decode(base64_data)
     except Exception as e:
         print(f"Erreur lors du traitement de l'image: {e}")
         return None
 
-def init_db():
-    conn = get_db_connection()
-    if conn:
+def image_extension(data):
+    try:
+        img_format = Image.open(BytesIO(data)).format
+    except Exception:
+        img_format = None
+    return {'JPEG': '.jpg', 'TIFF': '.tif'}.get(img_format, '.png')
+
+def iter_bulk_uploads(files):
+    # Parcours paresseux : chaque image n'est lue qu'au moment où son batch est traité
+    archive = files.get('archive')
+    if archive and archive.filename:
+        if archive.filename.lower().endswith('.zip'):
+            with zipfile.ZipFile(archive.stream) as zf:
+                for info in zf.infolist():
+                    if not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTENSIONS):
+                        yield os.path.basename(info.filename), zf.read(info)
+        else:
+            with tarfile.open(fileobj=archive.stream, mode='r:*') as tf:
+                for member in tf:
+                    if member.isfile() and member.name.lower().endswith(IMAGE_EXTENSIONS):
+                        yield os.path.basename(member.name), tf.extractfile(member).read()
+    
+    for file in files.getlist('images'):
+        if file.filename:
+            yield file.filename, file.read()
+
+def predict_tensors(served, batch, head_name='default'):
+    outputs = served.model.run_batch(batch)
+    if served.split:
+        outputs = served.heads[head_name].predict(outputs)
+    return outputs
+
+def classify_bulk_batch(served, items, user_id, head_name='default'):
+    # Renvoie (résultats JSON, lignes à insérer dans predictions)
+    results = []
+    rows = []
+    pending = []
+    
+    for original_name, data in items:
         try:
-            cursor = conn.cursor()
+            img_array = decode_image_bytes(data)
+            cache_key = image_cache_key(img_array, f"{served.version}:{head_name}")
+            cached = prediction_cache.get(cache_key)
+            filename, digest = upload_name(data, original_name)
+            persist_upload(filename, digest, data)
+            image_hash, embedding = None, None
+            if served.split:
+                image_hash, embedding = lookup_embedding(served, img_array, filename)
             
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    username VARCHAR(50) UNIQUE NOT NULL,
-                    password VARCHAR(255) NOT NULL,
-                    email VARCHAR(100),
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS predictions (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    user_id INT NOT NULL,
-                    image_name VARCHAR(255) NOT NULL,
-                    predicted_class VARCHAR(50) NOT NULL,
-                    confidence FLOAT NOT NULL,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-                )
-            """)
-            
-            cursor.execute("SELECT COUNT(*) FROM users WHERE username = 'admin'")
-            if cursor.fetchone()[0] == 0:
-                hashed_password = generate_password_hash('admin')
-                cursor.execute(
-                    "INSERT INTO users (username, password) VALUES (%s, %s)",
-                    ('admin', hashed_password)
-                )
-                print("Utilisateur admin créé avec le mot de passe 'admin'")
-            
-            conn.commit()
-            cursor.close()
-            conn.close()
-            print("Base de données initialisée avec succès")
-            
-        except Error as e:
-            print(f"Erreur lors de l'initialisation de la base de données: {e}")
+            if cached is not None:
+                rows.append([filename, cached[2]])
+            elif embedding is not None:
+                row = served.heads[head_name].predict(embedding[np.newaxis])[0]
+                prediction_cache.put(cache_key, int(np.argmax(row)), float(np.max(row)), row)
+                rows.append([filename, row])
+            else:
+                rows.append([filename, None])
+                pending.append((len(rows) - 1, cache_key, image_hash, img_array))
+        except Exception as e:
+            print(f"Erreur lors du traitement de l'image {original_name}: {e}")
+            results.append({'filename': original_name, 'error': "Erreur lors du traitement de l'image"})
+    
+    if not rows:
+        return results, []
+    
+    if pending:
+        outputs = served.model.run_batch(np.stack([tensor for _, _, _, tensor in pending]))
+        if served.split:
+            for (index, _, image_hash, _), embedding in zip(pending, outputs):
+                store_embedding(served, image_hash, embedding, rows[index][0])
+            outputs = served.heads[head_name].predict(outputs)
+        for (index, cache_key, _, _), row in zip(pending, outputs):
+            rows[index][1] = row
+            prediction_cache.put(cache_key, int(np.argmax(row)), float(np.max(row)), row)
+    
+    insert_rows = []
+    for filename, row in rows:
+        class_name = served.class_names[int(np.argmax(row))]
+        confidence = float(np.max(row))
+        insert_rows.append((user_id, filename, class_name, confidence, served.version, encode_probabilities(row)))
+        results.append({
+            'filename': filename,
+            'class': class_name,
+            'confidence': round(confidence * 100, 2),
+            'image_url': f'/uploads/{filename}'
+        })
+    
+    return results, insert_rows
+
+def predict_bulk_batch(served, items, user_id, head_name='default'):
+    results, insert_rows = classify_bulk_batch(served, items, user_id, head_name)
+    if insert_rows:
+        try:
+            # Un seul INSERT multi-lignes (MySQL) / executemany dans une transaction (SQLite)
+            store.insert_predictions(insert_rows)
+            invalidate_user_reads(insert_rows)
+        except StorageError as e:
+            print(f"Erreur enregistrement predict_batch: {e}")
+    
+    return results
+
+def init_db():
+    try:
+        store.init_schema()
+        
+        if store.get_user('admin') is None:
+            store.create_user('admin', None, generate_password_hash('admin'))
+            print("Utilisateur admin créé avec le mot de passe 'admin'")
+        
+        print("Base de données initialisée avec succès")
+        
+    except StorageError as e:
+        print(f"Erreur lors de l'initialisation de la base de données: {e}")
 
 # NOUVELLE ROUTE AJOUTÉE - CORRECTION DU PROBLÈME
 @app.route('/api/user-info', methods=['GET'])
@@ -191,36 +663,23 @@ def reset_password_by_username():
     if len(new_password) < 6:
         return jsonify({'error': 'Le mot de passe doit contenir au moins 6 caractères'}), 400
     
-    conn = get_db_connection()
-    if not conn:
-        return jsonify({'error': 'Erreur de connexion à la base de données'}), 500
-    
     try:
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT id FROM users WHERE username = %s", (username,))
-        user = cursor.fetchone()
+        user = store.get_user(username)
         
         if not user:
             return jsonify({'error': "Nom d'utilisateur introuvable"}), 404
         
         hashed_password = generate_password_hash(new_password)
-        
-        cursor.execute(
-            "UPDATE users SET password = %s WHERE id = %s",
-            (hashed_password, user['id'])
-        )
-        conn.commit()
+        store.update_password(user['id'], hashed_password)
         
         return jsonify({
             'message': 'Mot de passe réinitialisé avec succès',
             'username': username
         }), 200
         
-    except Error as e:
+    except StorageError as e:
         print(f"Erreur reset_password_by_username: {e}")
         return jsonify({'error': 'Erreur interne du serveur'}), 500
-    finally:
-        conn.close()
 
 @app.route('/api/register', methods=['POST'])
 def register():
@@ -240,36 +699,21 @@ def register():
     if not re.match(email_regex, email):
         return jsonify({'error': 'Adresse email invalide'}), 400
     
-    conn = get_db_connection()
-    if not conn:
-        return jsonify({'error': 'Erreur de connexion à la base de données'}), 500
-    
     try:
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT id FROM users WHERE username = %s", (username,))
-        if cursor.fetchone():
+        if store.get_user(username):
             return jsonify({'error': 'Nom d\'utilisateur déjà utilisé'}), 400
         
-        cursor.execute("SELECT id FROM users WHERE email = %s", (email,))
-        if cursor.fetchone():
+        if store.email_exists(email):
             return jsonify({'error': 'Adresse email déjà utilisée'}), 400
         
         hashed_password = generate_password_hash(password)
-        cursor.execute(
-            "INSERT INTO users (username, email, password) VALUES (%s, %s, %s)",
-            (username, email, hashed_password)
-        )
+        store.create_user(username, email, hashed_password)
         
-        conn.commit()
         return jsonify({'message': 'Compte créé avec succès'}), 201
         
-    except Error as e:
+    except StorageError as e:
         print(f"Erreur register: {e}")
         return jsonify({'error': 'Erreur interne du serveur'}), 500
-    finally:
-        if conn:
-            conn.close()
 
 @app.route('/api/login', methods=['POST'])
 def login():
@@ -280,15 +724,8 @@ def login():
     if not username or not password:
         return jsonify({'error': 'Nom d\'utilisateur et mot de passe requis'}), 400
     
-    conn = get_db_connection()
-    if not conn:
-        return jsonify({'error': 'Erreur de connexion à la base de données'}), 500
-    
     try:
-        cursor = conn.cursor(dictionary=True)
-        
-        cursor.execute("SELECT id, username, password FROM users WHERE username = %s", (username,))
-        user = cursor.fetchone()
+        user = store.get_user(username)
         
         if user and check_password_hash(user['password'], password):
             session['user_id'] = user['id']
@@ -297,12 +734,9 @@ def login():
         else:
             return jsonify({'error': 'Nom d\'utilisateur ou mot de passe incorrect'}), 401
             
-    except Error as e:
+    except StorageError as e:
         print(f"Erreur login: {e}")
         return jsonify({'error': 'Erreur interne du serveur'}), 500
-    finally:
-        if conn:
-            conn.close()
 
 @app.route('/api/logout', methods=['POST'])
 def logout():
@@ -311,51 +745,67 @@ def logout():
 
 @app.route('/api/predict', methods=['POST'])
 @login_required
+@model_required
 def predict():
     if 'image' not in request.files and 'image_data' not in request.json:
         return jsonify({'error': 'Aucune image fournie'}), 400
     
+    served = g.served
+    head_name = request.values.get('head', 'default')
+    if not is_known_head(served, head_name):
+        return jsonify({'error': f'Tête de classification inconnue: {head_name}'}), 400
+    
+    tta_mode = request.values.get('tta', TTA_MODE).lower()
+    if tta_mode not in ('off', 'on', 'auto'):
+        return jsonify({'error': 'Paramètre tta invalide (off, on, auto)'}), 400
+    
     try:
         if 'image' in request.files:
             file = request.files['image']
             if file.filename == '':
                 return jsonify({'error': 'Aucun fichier sélectionné'}), 400
             
-            filename = secure_filename(file.filename)
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
+            data = file.read()
+            filename, digest = upload_name(data, file.filename)
         else:
-            image_data = request.json['image_data']
-            filename = f"upload_{datetime.now().strftime('%Y%m%d_%H%M%S')}.png"
-            filepath = process_base64_image(image_data, filename)
-            if not filepath:
+            data = decode_base64_image(request.json['image_data'])
+            if not data:
                 return jsonify({'error': 'Erreur lors du traitement de l\'image'}), 400
+            filename, digest = upload_name(data)
         
-        pred_class, confidence, predictions = predict_with_model(filepath)
+        try:
+            img_array = decode_image_bytes(data)
+        except Exception as e:
+            print(f"Erreur lors du décodage de l'image: {e}")
+            return jsonify({'error': 'Erreur lors du traitement de l\'image'}), 400
+        
+        pred_class, confidence, predictions, stage, used_tta, model_version = predict_with_cascade(
+            served, img_array, filename, head_name, tta_mode)
         
         if pred_class is None:
             return jsonify({'error': 'Erreur lors de la prédiction'}), 500
         
-        class_name = CLASS_NAMES[pred_class]
+        persist_upload(filename, digest, data)
+        
+        class_name = served.class_names[pred_class]
         class_description = CLASS_DESCRIPTIONS.get(class_name, '')
         
-        conn = get_db_connection()
-        if conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT INTO predictions (user_id, image_name, predicted_class, confidence) VALUES (%s, %s, %s, %s)",
-                (session['user_id'], filename, class_name, confidence)
-            )
-            conn.commit()
-            conn.close()
+        record_prediction((session['user_id'], filename, class_name, confidence, model_version,
+                           encode_probabilities(predictions)))
         
         result = {
             'class': class_name,
             'description': class_description,
             'confidence': round(confidence * 100, 2),
             'image_url': f'/uploads/{filename}',
+            'head': head_name,
+            'tta': used_tta,
+            'stage': stage,
+            'model_version': model_version,
             'timestamp': datetime.now().isoformat()
         }
+        # top_k, margin (écart top1 - top2, en %) et entropy (normalisée 0-1)
+        result.update(describe_vector(predictions, served.class_names))
         
         return jsonify(result), 200
         
@@ -363,24 +813,257 @@ def predict():
         print(f"Erreur predict: {e}")
         return jsonify({'error': 'Erreur lors du traitement de l\'image'}), 500
 
+@app.route('/api/predict/batch', methods=['POST'])
+@login_required
+@model_required
+def predict_batch():
+    if 'archive' not in request.files and 'images' not in request.files:
+        return jsonify({'error': 'Aucune image fournie'}), 400
+    
+    served = g.served
+    head_name = request.values.get('head', 'default')
+    if not is_known_head(served, head_name):
+        return jsonify({'error': f'Tête de classification inconnue: {head_name}'}), 400
+    
+    user_id = session['user_id']
+    
+    def generate():
+        total = 0
+        errors = 0
+        try:
+            uploads = iter_bulk_uploads(request.files)
+            while True:
+                batch = [item for _, item in zip(range(BULK_BATCH_SIZE), uploads)]
+                if not batch:
+                    break
+                try:
+                    results = predict_bulk_batch(served, batch, user_id, head_name)
+                except Exception as e:
+                    print(f"Erreur predict_batch: {e}")
+                    results = [{'filename': name, 'error': 'Erreur lors de la prédiction'} for name, _ in batch]
+                for result in results:
+                    total += 1
+                    errors += 'error' in result
+                    yield json.dumps(result) + '\n'
+        except (zipfile.BadZipFile, tarfile.TarError) as e:
+            print(f"Erreur archive predict_batch: {e}")
+            errors += 1
+            yield json.dumps({'error': 'Archive invalide'}) + '\n'
+        
+        yield json.dumps({'done': True, 'total': total, 'errors': errors}) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/api/similar', methods=['POST'])
+@login_required
+@model_required
+def find_similar():
+    served = g.served
+    if vector_index is None or not served.split or embedding_version(served) != EMBEDDING_VERSION:
+        return jsonify({'error': 'Recherche par similarité indisponible (service backbone/tête désactivé)'}), 503
+    
+    try:
+        k = max(1, min(int(request.values.get('k', 10)), 100))
+    except ValueError:
+        return jsonify({'error': 'Paramètre k invalide'}), 400
+    
+    try:
+        if 'image' in request.files:
+            data = request.files['image'].read()
+            exclude = None
+        else:
+            payload = request.get_json(silent=True) or {}
+            image_name = payload.get('image_name') or request.values.get('image_name')
+            if not image_name:
+                return jsonify({'error': 'Aucune image fournie'}), 400
+            exclude = secure_filename(image_name)
+            data = upload_store.read(exclude)
+        
+        img_array = decode_image_bytes(data)
+        image_hash, embedding = lookup_embedding(served, img_array)
+        if embedding is None:
+            embedding = served.model.predict(img_array)
+            store_embedding(served, image_hash, embedding)
+    except FileNotFoundError:
+        return jsonify({'error': 'Image introuvable'}), 404
+    except Exception as e:
+        print(f"Erreur find_similar: {e}")
+        return jsonify({'error': 'Erreur lors du traitement de l\'image'}), 400
+    
+    matches = vector_index.search(embedding, k=k, exclude=exclude)
+    details = {}
+    try:
+        details = store.prediction_details([name for name, _ in matches])
+    except StorageError as e:
+        print(f"Erreur find_similar: {e}")
+    
+    results = []
+    for name, score in matches:
+        row = details.get(name, {})
+        results.append({
+            'image_name': name,
+            'image_url': f'/uploads/{name}',
+            'similarity': round(score, 4),
+            'predicted_class': row.get('predicted_class'),
+            'confidence': round(row['confidence'] * 100, 2) if 'confidence' in row else None
+        })
+    
+    return jsonify({'results': results, 'indexed': len(vector_index)}), 200
+
+def save_scene_upload(file):
+    # Nom dérivé du contenu : deux utilisateurs qui envoient « scene.tif » ne s'écrasent pas
+    upload_dir = os.path.join(SCENE_DIR, 'uploads')
+    os.makedirs(upload_dir, exist_ok=True)
+    ext = os.path.splitext(secure_filename(file.filename))[1].lower()
+    tmp_path = os.path.join(upload_dir, f'.{secrets.token_hex(8)}.tmp')
+    try:
+        file.save(tmp_path)
+        digest = file_digest(tmp_path)
+        scene_path = os.path.join(upload_dir, digest + ext)
+        os.replace(tmp_path, scene_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return scene_path, digest
+
+@app.route('/api/scene', methods=['POST'])
+@login_required
+@model_required
+def classify_scene():
+    
+    if request.content_length is not None and request.content_length > SCENE_MAX_UPLOAD:
+        return jsonify({'error': 'Scène trop volumineuse'}), 413
+    os.makedirs(SCENE_DIR, exist_ok=True)
+    
+    try:
+        tile_size = int(request.values.get('tile_size', 64))
+        stride = int(request.values.get('stride', tile_size))
+        if tile_size < 8 or stride < 1:
+            raise ValueError
+    except ValueError:
+        return jsonify({'error': 'Paramètres tile_size / stride invalides'}), 400
+    
+    digest = None
+    if 'scene' in request.files and request.files['scene'].filename:
+        file = request.files['scene']
+        scene_path, digest = save_scene_upload(file)
+    elif SCENE_INPUT_DIR and request.values.get('path'):
+        scene_path = os.path.join(SCENE_INPUT_DIR, secure_filename(request.values['path']))
+        if not os.path.isfile(scene_path):
+            return jsonify({'error': 'Scène introuvable'}), 404
+    else:
+        return jsonify({'error': 'Aucune scène fournie'}), 400
+    
+    served = g.served
+    job = SceneJob(scene_path, SCENE_DIR, tile_size=tile_size, stride=stride, model_version=served.version,
+                   owner=session['user_id'], digest=digest)
+    
+    def generate():
+        try:
+            for event in job.run(lambda batch: predict_tensors(served, batch), served.class_names, input_size=INPUT_SIZE):
+                if event.get('done'):
+                    event['map_url'] = f'/api/scene/{job.job_id}/map.png'
+                yield json.dumps(event) + '\n'
+        except Exception as e:
+            print(f"Erreur classify_scene: {e}")
+            yield json.dumps({'job_id': job.job_id, 'error': 'Erreur lors du traitement de la scène'}) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/api/scene/<job_id>', methods=['GET'])
+@login_required
+def get_scene_job(job_id):
+    work_dir = owned_job_dir(SCENE_DIR, secure_filename(job_id), session['user_id'])
+    progress_path = os.path.join(work_dir, 'progress.json') if work_dir else None
+    if progress_path is None or not os.path.exists(progress_path):
+        return jsonify({'error': 'Job introuvable'}), 404
+    with open(progress_path) as f:
+        return jsonify(json.load(f)), 200
+
+@app.route('/api/scene/<job_id>/map.png', methods=['GET'])
+@login_required
+def get_scene_map(job_id):
+    work_dir = owned_job_dir(SCENE_DIR, secure_filename(job_id), session['user_id'])
+    if work_dir is None:
+        return jsonify({'error': 'Job introuvable'}), 404
+    return send_from_directory(work_dir, 'class_map.png')
+
+def format_history_rows(predictions):
+    annotate_rows(predictions, probability_class_names())
+    for pred in predictions:
+        pred['confidence'] = round(pred['confidence'] * 100, 2)
+        pred['image_url'] = f'/uploads/{pred["image_name"]}'
+        pred['description'] = CLASS_DESCRIPTIONS.get(pred['predicted_class'], '')
+    return predictions
+
 @app.route('/api/history', methods=['GET'])
 @login_required
 def get_history():
-    conn = get_db_connection()
-    if not conn:
-        return jsonify({'error': 'Erreur de connexion à la base de données'}), 500
+    # ?limit=N&cursor=... : la réponse reste un tableau, le curseur de la page suivante
+    # est renvoyé dans l'en-tête X-Next-Cursor (absent sur la dernière page)
+    try:
+        limit = parse_limit(request.args.get('limit'))
+    except ValueError:
+        return jsonify({'error': 'Paramètre limit invalide'}), 400
+    
+    user_id = session['user_id']
+    cursor = request.args.get('cursor')
+    cache_key = read_cache.key('history', user_id, limit, cursor or '')
+    page = read_cache.get(cache_key)
+    
+    if page is None:
+        try:
+            predictions, next_cursor = store.fetch_history(user_id, limit, cursor)
+            page = (format_history_rows(predictions), next_cursor)
+            read_cache.put(cache_key, page)
+        except ValueError:
+            return jsonify({'error': 'Curseur invalide'}), 400
+        except StorageError as e:
+            print(f"Erreur get_history: {e}")
+            return jsonify({'error': 'Erreur interne du serveur'}), 500
+    
+    predictions, next_cursor = page
+    if write_behind is not None and not cursor:
+        # Lire ses propres écritures : prédictions encore en file en tête de la première page
+        predictions = merge_pending(predictions, format_history_rows(write_behind.pending_for_user(user_id)))
+    
+    response = jsonify(predictions)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response, 200
+
+def parse_uncertainty_filters(args, class_names):
+    # Marge et confiance en %, comme dans les réponses ; entropie normalisée 0-1
+    def number(name, scale=1.0):
+        value = args.get(name)
+        return float(value) / scale if value not in (None, '') else None
     
+    second_class = args.get('second') or None
+    if second_class is not None and second_class not in class_names:
+        raise ValueError(f"Classe inconnue: {second_class}")
+    return {
+        'max_margin': number('max_margin', 100),
+        'min_entropy': number('min_entropy'),
+        'max_confidence': number('max_confidence', 100),
+        'second_class': second_class
+    }
+
+@app.route('/api/history/uncertain', methods=['GET'])
+@login_required
+def get_uncertain_history():
+    # ?max_margin=20&min_entropy=0.5&max_confidence=60&second=Forest&limit=50&scan=5000
+    # Les critères portent sur les `scan` dernières prédictions de l'utilisateur
+    class_names = probability_class_names()
     try:
-        cursor = conn.cursor(dictionary=True)
-        
-        cursor.execute("""
-            SELECT image_name, predicted_class, confidence, timestamp 
-            FROM predictions 
-            WHERE user_id = %s 
-            ORDER BY timestamp DESC
-        """, (session['user_id'],))
-        
-        predictions = cursor.fetchall()
+        filters = parse_uncertainty_filters(request.args, class_names)
+        limit = parse_limit(request.args.get('limit'))
+        scan = parse_limit(request.args.get('scan'), UNCERTAINTY_DEFAULT_SCAN, UNCERTAINTY_MAX_SCAN)
+    except ValueError as e:
+        return jsonify({'error': f'Paramètres invalides: {e}'}), 400
+    
+    try:
+        rows = store.fetch_uncertainty_scan(session['user_id'], scan)
+        predictions = filter_uncertain(rows, class_names, **filters)[:limit]
         
         for pred in predictions:
             pred['confidence'] = round(pred['confidence'] * 100, 2)
@@ -389,53 +1072,189 @@ def get_history():
         
         return jsonify(predictions), 200
         
-    except Error as e:
-        print(f"Erreur get_history: {e}")
+    except StorageError as e:
+        print(f"Erreur get_uncertain_history: {e}")
+        return jsonify({'error': 'Erreur interne du serveur'}), 500
+
+@app.route('/api/history/uncertainty', methods=['GET'])
+@login_required
+def get_uncertainty_summary():
+    # Histogrammes marge / entropie et confusions (1er choix, 2e choix) les plus fréquentes
+    try:
+        margin_threshold = float(request.args.get('margin', '20')) / 100
+        scan = parse_limit(request.args.get('scan'), UNCERTAINTY_DEFAULT_SCAN, UNCERTAINTY_MAX_SCAN)
+    except ValueError:
+        return jsonify({'error': 'Paramètres margin / scan invalides'}), 400
+    
+    try:
+        rows = store.fetch_uncertainty_scan(session['user_id'], scan)
+        return jsonify(uncertainty_summary(rows, probability_class_names(), margin_threshold)), 200
+        
+    except StorageError as e:
+        print(f"Erreur get_uncertainty_summary: {e}")
         return jsonify({'error': 'Erreur interne du serveur'}), 500
-    finally:
-        if conn:
-            conn.close()
 
 @app.route('/api/stats', methods=['GET'])
 @login_required
 def get_stats():
-    conn = get_db_connection()
-    if not conn:
-        return jsonify({'error': 'Erreur de connexion à la base de données'}), 500
+    # ?from=AAAA-MM-JJ&to=AAAA-MM-JJ : période lue sur les agrégats journaliers
+    try:
+        start, end = parse_day(request.args.get('from')), parse_day(request.args.get('to'))
+    except ValueError:
+        return jsonify({'error': 'Paramètres from / to invalides (AAAA-MM-JJ)'}), 400
+    
+    cache_key = read_cache.key('stats', session['user_id'], start or '', end or '')
+    stats = read_cache.get(cache_key)
+    if stats is not None:
+        return jsonify(stats), 200
     
     try:
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT COUNT(*) FROM predictions WHERE user_id = %s", (session['user_id'],))
-        total_predictions = cursor.fetchone()[0]
-        
-        cursor.execute("""
-            SELECT predicted_class, COUNT(*) as count 
-            FROM predictions 
-            WHERE user_id = %s 
-            GROUP BY predicted_class 
-            ORDER BY count DESC
-        """, (session['user_id'],))
-        
-        class_stats = {}
-        for row in cursor.fetchall():
-            class_stats[row[0]] = row[1]
-        
-        return jsonify({
-            'total_predictions': total_predictions,
-            'class_distribution': class_stats
-        }), 200
+        # Compteurs maintenus à l'insertion (user_class_stats, prediction_daily_rollups),
+        # pas de parcours de l'historique
+        if start or end:
+            stats = store.fetch_user_stats_between(session['user_id'], start or date.min, end or date.max)
+        else:
+            stats = store.fetch_user_stats(session['user_id'])
+        read_cache.put(cache_key, stats)
+        return jsonify(stats), 200
         
-    except Error as e:
+    except StorageError as e:
         print(f"Erreur get_stats: {e}")
         return jsonify({'error': 'Erreur interne du serveur'}), 500
-    finally:
-        if conn:
-            conn.close()
+
+@app.route('/api/analytics', methods=['GET'])
+@login_required
+@admin_required
+def get_analytics():
+    # ?from=AAAA-MM-JJ&to=AAAA-MM-JJ&bucket=day|week, toutes prédictions confondues,
+    # servi par class_daily_rollups (voir analytics.py)
+    bucket = request.args.get('bucket', 'day')
+    try:
+        start, end = parse_range(request.args.get('from'), request.args.get('to'), bucket)
+    except ValueError as e:
+        return jsonify({'error': f'Paramètres invalides: {e}'}), 400
+    
+    # Pas d'invalidation par utilisateur pour une vue globale : fraîcheur READ_CACHE_TTL
+    cache_key = read_cache.key('analytics', 'global', start, end, bucket)
+    analytics = read_cache.get(cache_key)
+    if analytics is not None:
+        return jsonify(analytics), 200
+    
+    try:
+        analytics = summarize(store.fetch_class_rollups(start, end), start, end, bucket)
+        read_cache.put(cache_key, analytics)
+        return jsonify(analytics), 200
+        
+    except StorageError as e:
+        print(f"Erreur get_analytics: {e}")
+        return jsonify({'error': 'Erreur interne du serveur'}), 500
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    ready = startup_state['phase'] == 'ready'
+    return jsonify({
+        'ready': ready,
+        'phase': startup_state['phase'],
+        'error': startup_state['error'],
+        'timings': startup_state['timings']
+    }), 200 if ready else 503
+
+@app.route('/api/inference/stats', methods=['GET'])
+@login_required
+@admin_required
+def get_inference_stats():
+    served = serving.current
+    if served is None:
+        return jsonify({'error': 'Modèle non chargé'}), 503
+    stats = served.model.stats()
+    stats['model_version'] = served.version
+    return jsonify(stats), 200
+
+@app.route('/api/heads', methods=['GET'])
+def get_heads():
+    served = serving.current
+    return jsonify({
+        'split_serving': served.split if served is not None else False,
+        'heads': sorted(served.heads) if served is not None and served.heads else ['default'],
+        'embeddings_stored': embedding_store.count() if embedding_store is not None else 0
+    }), 200
+
+@app.route('/api/cache/stats', methods=['GET'])
+@login_required
+@admin_required
+def get_cache_stats():
+    stats = prediction_cache.stats()
+    stats['model_version'] = serving.current.version if serving.current is not None else None
+    stats['read_cache'] = read_cache.stats()
+    return jsonify(stats), 200
+
+@app.route('/api/db/stats', methods=['GET'])
+@login_required
+@admin_required
+def get_db_stats():
+    stats = store.stats()
+    if write_behind is not None:
+        stats['write_behind'] = write_behind.stats()
+    stats['uploads'] = upload_store.stats()
+    return jsonify(stats), 200
+
+@app.route('/api/admin/models', methods=['GET'])
+@login_required
+@admin_required
+def list_models():
+    versions = []
+    for version in registry.versions():
+        metadata = registry.metadata(version)
+        versions.append({
+            'version': version,
+            'backend': metadata['backend'],
+            'classes': len(metadata['class_names']),
+            'created_at': metadata.get('created_at'),
+            'notes': metadata.get('notes', '')
+        })
+    state = serving.state()
+    state['registry_active'] = registry.active_version()
+    state['versions'] = versions
+    return jsonify(state), 200
+
+@app.route('/api/admin/models/<version>/activate', methods=['POST'])
+@login_required
+@admin_required
+def activate_model(version):
+    if MODEL_SERVER_ADDRESS:
+        return jsonify({'error': "Modèle servi par le serveur d'inférence partagé : redémarrer model_server.py"}), 409
+    if version not in registry.versions():
+        return jsonify({'error': f'Version inconnue: {version}'}), 404
+    current = serving.current
+    if current is not None and current.version == version:
+        return jsonify({'message': 'Version déjà active', 'version': version}), 200
+    
+    # Chargement et chauffe en arrière-plan ; models/ACTIVE n'est mis à jour (et suivi par
+    # les autres workers) qu'une fois la version servie avec succès ici.
+    if not serving.load_in_background(version, load_served_model,
+                                      on_ready=lambda served: registry.set_active(served.version)):
+        return jsonify({'error': f'Chargement déjà en cours: {serving.loading}'}), 409
+    return jsonify({'message': 'Chargement démarré', 'version': version}), 202
+
+def upload_cache_headers(response, etag):
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = f"public, max-age={UPLOAD_CACHE_MAX_AGE}, immutable"
+    return response
 
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    # ?size=thumb (miniature) ou 128 (entrée du modèle) ; défaut : image d'origine.
+    # Blob partagé (ou ancien fichier à plat) ; le type MIME suit l'extension du fichier servi
+    try:
+        found = upload_store.variant(filename, request.args.get('size', 'full'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if found is None:
+        return jsonify({'error': 'Image introuvable'}), 404
+    path, etag = found
+    if request.if_none_match.contains(etag):
+        return upload_cache_headers(Response(status=304), etag)
+    return upload_cache_headers(send_from_directory(os.path.dirname(path), os.path.basename(path)), etag)
 
 @app.route('/')
 def index():
@@ -4,14 +4,19 @@ from io import BytesIO
 from PIL import Image
 import numpy as np
 import os
-import mysql.connector
-from mysql.connector import Error
+import threading
 from werkzeug.security import generate_password_hash, check_password_hash
-from tensorflow.keras.models import load_model
-from tensorflow.keras.preprocessing import image
-from tensorflow.keras.applications.resnet50 import preprocess_input
 import datetime
 import json
+from stores import store_from_env, StorageError
+from storage import HISTORY_DEFAULT_LIMIT
+from probabilities import encode_probabilities, describe_vector, annotate_rows
+from read_cache import read_cache_from_env
+from analytics import parse_range, summarize
+from inference_backends import default_model_path
+from model_server import LocalModel, RemoteModel
+from model_registry import ModelRegistry, ModelSlot, ServedModel
+from tta import dihedral_batch, average_predictions, should_use_tta
 
 # Configuration de la page
 st.set_page_config(
@@ -87,6 +92,13 @@ st.markdown("""
 # Configuration des chemins
 MODEL_PATH = "resnet50_fast_model.h5"
 INPUT_SIZE = (128, 128)
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "keras").lower()
+INFERENCE_MODEL_PATH = os.getenv("INFERENCE_MODEL_PATH") or default_model_path(INFERENCE_BACKEND, MODEL_PATH)
+MODEL_SERVER_ADDRESS = os.getenv("MODEL_SERVER_ADDRESS", "")
+MODEL_REGISTRY_DIR = os.getenv("MODEL_REGISTRY_DIR", "models")
+TTA_CONFIDENCE_THRESHOLD = float(os.getenv("TTA_CONFIDENCE_THRESHOLD", "0.6"))
+# Comptes ayant accès aux statistiques globales de la plateforme
+ADMIN_USERS = set(os.getenv("ADMIN_USERS", "admin").split(','))
 
 # Définitions des classes
 CLASS_NAMES = ['AnnualCrop', 'Forest', 'HerbaceousVegetation', 'Highway', 'Industrial', 
@@ -106,252 +118,233 @@ CLASS_DESCRIPTIONS = {
 }
 
 # Fonctions de base de données
-def get_db_connection():
-    try:
-        connection = mysql.connector.connect(
-            host="localhost",
-            user="root",
-            password="1234567890",
-            database="dbtkinter_app",
-            autocommit=True
-        )
-        return connection
-    except Error as e:
-        st.error(f"Erreur de connexion à la base de données: {e}")
-        return None
+# Un seul store par processus Streamlit (pool MySQL ou fichier SQLite selon
+# STORAGE_BACKEND), partagé par toutes les sessions et reruns
+@st.cache_resource
+def get_store():
+    return store_from_env("dbtkinter_app")
+
+# Historique et statistiques en cache : dashboard_page() est ré-exécutée à chaque
+# interaction, sans nouvelle prédiction il n'y a rien à relire dans la base
+@st.cache_resource
+def get_read_cache():
+    return read_cache_from_env(get_store().name)
 
 def init_db():
-    conn = get_db_connection()
-    if conn:
-        try:
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    username VARCHAR(50) UNIQUE NOT NULL,
-                    password VARCHAR(255) NOT NULL,
-                    email VARCHAR(100),
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS predictions (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    user_id INT NOT NULL,
-                    image_name VARCHAR(255) NOT NULL,
-                    predicted_class VARCHAR(50) NOT NULL,
-                    confidence FLOAT NOT NULL,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-                )
-            """)
-            
-            cursor.execute("SELECT COUNT(*) FROM users WHERE username = 'admin'")
-            if cursor.fetchone()[0] == 0:
-                hashed_password = generate_password_hash('admin')
-                cursor.execute(
-                    "INSERT INTO users (username, password) VALUES (%s, %s)",
-                    ('admin', hashed_password)
-                )
-                st.success("Utilisateur admin créé avec le mot de passe 'admin'")
-            
-            conn.commit()
-            cursor.close()
-            conn.close()
-            
-        except Error as e:
-            st.error(f"Erreur lors de l'initialisation de la base de données: {e}")
+    try:
+        store = get_store()
+        store.init_schema()
+        
+        if store.get_user('admin') is None:
+            store.create_user('admin', None, generate_password_hash('admin'))
+            st.success("Utilisateur admin créé avec le mot de passe 'admin'")
+        
+    except StorageError as e:
+        st.error(f"Erreur lors de l'initialisation de la base de données: {e}")
 
 # Fonctions d'authentification
 def register_user(username, email, password):
-    conn = get_db_connection()
-    if not conn:
-        return False, "Erreur de connexion à la base de données"
-    
     try:
-        cursor = conn.cursor()
+        store = get_store()
         
         # Vérifier si l'utilisateur existe déjà
-        cursor.execute("SELECT id FROM users WHERE username = %s", (username,))
-        if cursor.fetchone():
+        if store.get_user(username):
             return False, "Nom d'utilisateur déjà utilisé"
         
-        cursor.execute("SELECT id FROM users WHERE email = %s", (email,))
-        if cursor.fetchone():
+        if store.email_exists(email):
             return False, "Adresse email déjà utilisée"
         
         # Créer l'utilisateur
         hashed_password = generate_password_hash(password)
-        cursor.execute(
-            "INSERT INTO users (username, email, password) VALUES (%s, %s, %s)",
-            (username, email, hashed_password)
-        )
+        store.create_user(username, email, hashed_password)
         
-        conn.commit()
         return True, "Compte créé avec succès"
         
-    except Error as e:
+    except StorageError as e:
         return False, f"Erreur interne: {e}"
-    finally:
-        if conn:
-            conn.close()
 
 def login_user(username, password):
-    conn = get_db_connection()
-    if not conn:
-        return False, None, "Erreur de connexion à la base de données"
-    
     try:
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT id, username, password FROM users WHERE username = %s", (username,))
-        user = cursor.fetchone()
+        user = get_store().get_user(username)
         
         if user and check_password_hash(user['password'], password):
             return True, user, "Connexion réussie"
         else:
             return False, None, "Nom d'utilisateur ou mot de passe incorrect"
             
-    except Error as e:
+    except StorageError as e:
         return False, None, f"Erreur interne: {e}"
-    finally:
-        if conn:
-            conn.close()
 
 def reset_password_by_username(username, new_password):
-    conn = get_db_connection()
-    if not conn:
-        return False, "Erreur de connexion à la base de données"
-    
     try:
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT id FROM users WHERE username = %s", (username,))
-        user = cursor.fetchone()
+        store = get_store()
+        user = store.get_user(username)
         
         if not user:
             return False, "Nom d'utilisateur introuvable"
         
         hashed_password = generate_password_hash(new_password)
-        cursor.execute(
-            "UPDATE users SET password = %s WHERE id = %s",
-            (hashed_password, user['id'])
-        )
-        conn.commit()
+        store.update_password(user['id'], hashed_password)
         
         return True, "Mot de passe réinitialisé avec succès"
         
-    except Error as e:
+    except StorageError as e:
         return False, f"Erreur interne: {e}"
-    finally:
-        conn.close()
 
 # Fonctions de prédiction
+# Version servie partagée par toutes les sessions, comme serving dans app.py : quand
+# models/ACTIVE change, la rerun suivante charge la nouvelle version et l'ancienne est
+# retirée, puis fermée dès que ses prédictions en cours sont terminées
+@st.cache_resource
+def get_model_slot():
+    return ModelSlot()
+
 @st.cache_resource
-def load_model_cached():
+def get_model_load_lock():
+    return threading.Lock()
+
+def load_served_model(version):
     try:
-        model = load_model(MODEL_PATH)
-        st.success("Modèle chargé avec succès")
-        return model
+        metadata = {'class_names': CLASS_NAMES}
+        if MODEL_SERVER_ADDRESS:
+            model = RemoteModel(MODEL_SERVER_ADDRESS)
+            st.success(f"Connecté au serveur d'inférence {MODEL_SERVER_ADDRESS}")
+        elif version:
+            registry = ModelRegistry(MODEL_REGISTRY_DIR)
+            metadata = registry.metadata(version)
+            model = LocalModel(metadata['backend'], registry.artifact_path(version), split=False)
+            st.success(f"Modèle {version} chargé avec succès ({metadata['backend']})")
+        else:
+            model = LocalModel(INFERENCE_BACKEND, INFERENCE_MODEL_PATH, split=False)
+            st.success(f"Modèle chargé avec succès ({INFERENCE_BACKEND})")
+        return ServedModel(version or model.info()['model_version'], model, metadata)
     except Exception as e:
         st.error(f"Erreur lors du chargement du modèle: {e}")
         return None
 
-def predict_with_model(img_array):
-    model = load_model_cached()
-    if model is None:
+def acquire_model():
+    # Réserve la version active, à rendre avec served.release() ; None si aucun modèle
+    version = None if MODEL_SERVER_ADDRESS else ModelRegistry(MODEL_REGISTRY_DIR).active_version()
+    slot = get_model_slot()
+    if needs_model_load(slot, version):
+        with get_model_load_lock():
+            if needs_model_load(slot, version):
+                served = load_served_model(version)
+                if served is None:
+                    # Pas de nouvel essai à chaque rerun tant que models/ACTIVE ne bouge pas
+                    slot.failed_version = version
+                else:
+                    slot.failed_version = None
+                    slot.activate(served)
+    return slot.acquire()
+
+def needs_model_load(slot, version):
+    current = slot.current
+    if current is not None and (version is None or current.version == version):
+        return False
+    # Échec déjà constaté pour cette version : l'ancienne (s'il y en a une) continue de servir
+    return version is None or version != slot.failed_version
+
+def probability_class_names():
+    # Ordre des classes des vecteurs stockés, sans charger le modèle
+    version = None if MODEL_SERVER_ADDRESS else ModelRegistry(MODEL_REGISTRY_DIR).active_version()
+    return ModelRegistry(MODEL_REGISTRY_DIR).metadata(version)['class_names'] if version else CLASS_NAMES
+
+def predict_with_model(served, img_array, tta_mode='off'):
+    if served is None:
         return None, 0, None
         
     try:
-        img_array = np.expand_dims(img_array, axis=0)
-        img_array = preprocess_input(img_array)
-        preds = model.predict(img_array, verbose=0)
-        pred_class = int(np.argmax(preds[0]))
-        confidence = float(np.max(preds[0]))
-        return pred_class, confidence, preds[0]
+        model = served.model
+        img_array = img_array.astype(np.uint8)
+        preds = model.classify(np.expand_dims(img_array, axis=0))[0]
+        # Les 8 variantes diédrales partent en un seul batch
+        if should_use_tta(tta_mode, float(np.max(preds)), TTA_CONFIDENCE_THRESHOLD):
+            preds = average_predictions(model.classify(dihedral_batch(img_array)))[0]
+        pred_class = int(np.argmax(preds))
+        confidence = float(np.max(preds))
+        return pred_class, confidence, preds
     except Exception as e:
         st.error(f"Erreur lors de la prédiction: {e}")
         return None, 0, None
 
-def save_prediction(user_id, image_name, predicted_class, confidence):
-    conn = get_db_connection()
-    if conn:
-        try:
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT INTO predictions (user_id, image_name, predicted_class, confidence) VALUES (%s, %s, %s, %s)",
-                (user_id, image_name, predicted_class, confidence)
-            )
-            conn.commit()
-            conn.close()
-            return True
-        except Error as e:
-            st.error(f"Erreur sauvegarde prédiction: {e}")
-            return False
-    return False
-
-def get_user_history(user_id):
-    conn = get_db_connection()
-    if not conn:
-        return []
+def save_prediction(user_id, image_name, predicted_class, confidence, model_version=None, probabilities=None):
+    try:
+        get_store().insert_predictions([(user_id, image_name, predicted_class, confidence, model_version,
+                                         encode_probabilities(probabilities))])
+        get_read_cache().invalidate(user_id)
+        return True
+    except StorageError as e:
+        st.error(f"Erreur sauvegarde prédiction: {e}")
+        return False
+
+def get_user_history(user_id, limit=HISTORY_DEFAULT_LIMIT, cursor=None):
+    # Renvoie (page d'historique, curseur de la page suivante ou None)
+    cache_key = get_read_cache().key('history', user_id, limit, cursor or '')
+    page = get_read_cache().get(cache_key)
+    if page is not None:
+        return page
     
     try:
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("""
-            SELECT image_name, predicted_class, confidence, timestamp 
-            FROM predictions 
-            WHERE user_id = %s 
-            ORDER BY timestamp DESC
-        """, (user_id,))
-        
-        predictions = cursor.fetchall()
+        predictions, next_cursor = get_store().fetch_history(user_id, limit, cursor)
+        annotate_rows(predictions, probability_class_names())
         
         for pred in predictions:
             pred['confidence'] = round(pred['confidence'] * 100, 2)
         
-        return predictions
+        get_read_cache().put(cache_key, (predictions, next_cursor))
+        return predictions, next_cursor
         
-    except Error as e:
+    except StorageError as e:
+        st.error(f"Erreur récupération historique: {e}")
+        return [], None
+
+def get_recent_predictions(user_id, n=5):
+    cache_key = get_read_cache().key('recent', user_id, n)
+    predictions = get_read_cache().get(cache_key)
+    if predictions is not None:
+        return predictions
+    
+    try:
+        predictions = get_store().fetch_recent(user_id, n)
+        annotate_rows(predictions, probability_class_names())
+        for pred in predictions:
+            pred['confidence'] = round(pred['confidence'] * 100, 2)
+        get_read_cache().put(cache_key, predictions)
+        return predictions
+    except StorageError as e:
         st.error(f"Erreur récupération historique: {e}")
         return []
-    finally:
-        if conn:
-            conn.close()
 
 def get_user_stats(user_id):
-    conn = get_db_connection()
-    if not conn:
-        return {'total_predictions': 0, 'class_distribution': {}}
+    cache_key = get_read_cache().key('stats', user_id)
+    stats = get_read_cache().get(cache_key)
+    if stats is not None:
+        return stats
     
     try:
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT COUNT(*) FROM predictions WHERE user_id = %s", (user_id,))
-        total_predictions = cursor.fetchone()[0]
-        
-        cursor.execute("""
-            SELECT predicted_class, COUNT(*) as count 
-            FROM predictions 
-            WHERE user_id = %s 
-            GROUP BY predicted_class 
-            ORDER BY count DESC
-        """, (user_id,))
+        stats = get_store().fetch_user_stats(user_id)
+        get_read_cache().put(cache_key, stats)
+        return stats
         
-        class_stats = {}
-        for row in cursor.fetchall():
-            class_stats[row[0]] = row[1]
-        
-        return {
-            'total_predictions': total_predictions,
-            'class_distribution': class_stats
-        }
-        
-    except Error as e:
+    except StorageError as e:
         st.error(f"Erreur récupération statistiques: {e}")
         return {'total_predictions': 0, 'class_distribution': {}}
-    finally:
-        if conn:
-            conn.close()
+
+def get_global_analytics(start, end, bucket):
+    # Vue globale : pas d'invalidation par utilisateur, fraîcheur READ_CACHE_TTL
+    cache_key = get_read_cache().key('analytics', 'global', start, end, bucket)
+    analytics = get_read_cache().get(cache_key)
+    if analytics is not None:
+        return analytics
+    
+    try:
+        analytics = summarize(get_store().fetch_class_rollups(start, end), start, end, bucket)
+        get_read_cache().put(cache_key, analytics)
+        return analytics
+    except StorageError as e:
+        st.error(f"Erreur récupération statistiques globales: {e}")
+        return None
 
 # Pages de l'application
 def login_page():
@@ -538,7 +531,7 @@ def dashboard_page():
     
     # Recent Activity
     st.subheader("📋 ACTIVITÉ RÉCENTE")
-    history = get_user_history(user['id'])[:5]
+    history = get_recent_predictions(user['id'], 5)
     
     if not history:
         st.info("Aucune mission récente. Initiez votre première analyse satellite.")
@@ -582,18 +575,30 @@ def predict_page():
         with col1:
             st.image(uploaded_file, caption="Image satellite chargée", use_column_width=True)
             
+            tta_mode = st.radio(
+                "🔁 AUGMENTATION AU TEST (TTA)",
+                ['auto', 'on', 'off'],
+                horizontal=True,
+                help=f"auto : 8 variantes (rotations/miroirs) moyennées si la confiance est < {int(TTA_CONFIDENCE_THRESHOLD * 100)}%"
+            )
+            
             if st.button("🧠 INITIER ANALYSE IA", use_container_width=True):
                 with st.spinner("Analyse en cours..."):
                     # Process image
                     img = Image.open(uploaded_file).convert("RGB")
                     img = img.resize((128, 128))
-                    img_array = image.img_to_array(img)
+                    img_array = np.asarray(img, dtype=np.float32)
                     
                     # Make prediction
-                    pred_class, confidence, _ = predict_with_model(img_array)
+                    served = acquire_model()
+                    try:
+                        pred_class, confidence, probabilities = predict_with_model(served, img_array, tta_mode)
+                    finally:
+                        if served is not None:
+                            served.release()
                     
                     if pred_class is not None:
-                        class_name = CLASS_NAMES[pred_class]
+                        class_name = served.class_names[pred_class]
                         confidence_percent = round(confidence * 100, 2)
                         
                         # Save prediction
@@ -601,7 +606,9 @@ def predict_page():
                             user['id'],
                             uploaded_file.name,
                             class_name,
-                            confidence
+                            confidence,
+                            served.version,
+                            probabilities
                         )
                         
                         # Display results
@@ -613,6 +620,11 @@ def predict_page():
                                 st.markdown(f"**Niveau de confiance:** `{confidence_percent}%`")
                                 st.progress(confidence)
                                 
+                                details = describe_vector(probabilities, served.class_names)
+                                alternatives = ", ".join(f"{alt['class']} ({alt['confidence']}%)" for alt in details['top_k'][1:])
+                                st.markdown(f"**Alternatives:** {alternatives}")
+                                st.caption(f"MARGE {details['margin']}% • ENTROPIE {details['entropy']}")
+                                
                                 st.markdown("**Description:**")
                                 st.info(CLASS_DESCRIPTIONS.get(class_name, ''))
                                 
@@ -630,9 +642,13 @@ def history_page():
     with col2:
         if st.button("🔙 RETOUR AU TABLEAU DE BORD", use_container_width=True):
             st.session_state.current_page = "dashboard"
+            st.session_state.history_cursors = [None]
             st.rerun()
     
-    history = get_user_history(user['id'])
+    # Pile des curseurs des pages déjà vues, pour revenir en arrière
+    if 'history_cursors' not in st.session_state:
+        st.session_state.history_cursors = [None]
+    history, next_cursor = get_user_history(user['id'], cursor=st.session_state.history_cursors[-1])
     
     if not history:
         st.info("Aucune mission enregistrée. Initiez votre première analyse satellite.")
@@ -647,10 +663,25 @@ def history_page():
                     st.write(f"**Fichier:** {pred['image_name']}")
                     st.write(f"**Classe:** {pred['predicted_class']}")
                     st.write(f"**Confiance:** {pred['confidence']}%")
+                    if 'top_k' in pred:
+                        alternatives = ", ".join(f"{alt['class']} ({alt['confidence']}%)" for alt in pred['top_k'][1:])
+                        st.write(f"**Alternatives:** {alternatives} • marge {pred['margin']}%")
                     st.write(f"**Description:** {CLASS_DESCRIPTIONS.get(pred['predicted_class'], '')}")
                 with col2:
                     st.write(f"**Date:** {pred['timestamp'].strftime('%d/%m/%Y')}")
                     st.write(f"**Heure:** {pred['timestamp'].strftime('%H:%M:%S')}")
+        
+        col1, col2, col3 = st.columns([1, 2, 1])
+        with col1:
+            if len(st.session_state.history_cursors) > 1 and st.button("⬅️ PLUS RÉCENTES", use_container_width=True):
+                st.session_state.history_cursors.pop()
+                st.rerun()
+        with col2:
+            st.caption(f"Page {len(st.session_state.history_cursors)}")
+        with col3:
+            if next_cursor and st.button("PLUS ANCIENNES ➡️", use_container_width=True):
+                st.session_state.history_cursors.append(next_cursor)
+                st.rerun()
 
 def classes_page():
     st.markdown("# 🗺️ CLASSIFICATION TERRAIN")
@@ -716,6 +747,70 @@ def stats_page():
             import pandas as pd
             df = pd.DataFrame(list(stats['class_distribution'].items()), columns=['Classe', 'Count'])
             st.bar_chart(df.set_index('Classe'))
+    
+    if user['username'] in ADMIN_USERS:
+        global_analytics_section()
+
+def global_analytics_section():
+    import pandas as pd
+    
+    st.markdown("---")
+    st.markdown("## 🌍 STATISTIQUES DE LA PLATEFORME")
+    
+    col1, col2 = st.columns([3, 1])
+    with col2:
+        bucket = st.radio("Intervalle", ['day', 'week'], horizontal=True,
+                          format_func=lambda value: 'Jour' if value == 'day' else 'Semaine')
+    with col1:
+        today = datetime.date.today()
+        default_start = today - datetime.timedelta(days=29 if bucket == 'day' else 12 * 7 - 1)
+        period = st.date_input("Période", (default_start, today), max_value=today)
+    
+    if not isinstance(period, (tuple, list)) or len(period) != 2:
+        st.info("Sélectionnez une date de début et une date de fin")
+        return
+    try:
+        start, end = parse_range(period[0].isoformat(), period[1].isoformat(), bucket)
+    except ValueError as e:
+        st.error(f"Période invalide: {e}")
+        return
+    
+    analytics = get_global_analytics(start, end, bucket)
+    if analytics is None:
+        return
+    if not analytics['total_predictions']:
+        st.info("Aucune prédiction sur cette période")
+        return
+    
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Analyses", analytics['total_predictions'])
+    col2.metric(f"Confiance < {analytics['low_confidence_threshold']:.0f}%", f"{analytics['low_confidence_rate']:.1f}%")
+    col3.metric("Classes observées", len(analytics['classes']))
+    
+    # Une ligne par intervalle, une colonne par classe
+    index = pd.to_datetime([point['start'] for point in analytics['series']])
+    counts = pd.DataFrame([{name: cell['count'] for name, cell in point['classes'].items()}
+                           for point in analytics['series']], index=index).fillna(0)
+    confidences = pd.DataFrame([{name: cell['mean_confidence'] for name, cell in point['classes'].items()}
+                                for point in analytics['series']], index=index)
+    low_rate = pd.Series([point['low_confidence_rate'] for point in analytics['series']], index=index,
+                         name='Confiance faible (%)')
+    
+    st.subheader("Distribution des classes")
+    st.bar_chart(counts)
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        st.subheader("Confiance moyenne par classe (%)")
+        st.line_chart(confidences)
+    with col2:
+        st.subheader("Taux de prédictions à faible confiance (%)")
+        st.line_chart(low_rate)
+    
+    st.subheader("Récapitulatif par classe")
+    summary = pd.DataFrame.from_dict(analytics['classes'], orient='index')
+    summary.columns = ['Analyses', 'Part (%)', 'Confiance moyenne (%)', 'Confiance faible (%)']
+    st.dataframe(summary, use_container_width=True)
 
 # Application principale
 def main():
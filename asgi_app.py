@@ -0,0 +1,867 @@
+import asyncio
+import json
+import os
+import re
+import secrets
+import tarfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import date, datetime
+from functools import partial, wraps
+
+import aiomysql
+from quart import Quart, request, jsonify, session, send_from_directory, render_template, Response
+from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.utils import secure_filename
+
+import app as core
+from db_pool import db_config
+from storage import (history_query, history_page, parse_limit, parse_day, class_stat_increments,
+                     daily_rollup_increments, class_rollup_increments, stats_from_rows, INSERT_PREDICTION_SQL,
+                     INCREMENT_CLASS_STATS_SQL, INCREMENT_DAILY_ROLLUP_SQL, INCREMENT_CLASS_ROLLUP_SQL,
+                     CLASS_ROLLUP_RANGE_SQL, USER_STATS_SQL, USER_STATS_BETWEEN_SQL,
+                     UNCERTAINTY_SCAN_SQL, UNCERTAINTY_DEFAULT_SCAN, UNCERTAINTY_MAX_SCAN)
+from analytics import parse_range, summarize
+from probabilities import encode_probabilities, describe_vector, filter_uncertain, uncertainty_summary
+from scene_tiling import SceneJob, file_digest, owned_job_dir
+from write_behind import BufferFull, merge_pending
+
+# Mode de service ASGI : mêmes routes /api et mêmes réponses JSON que app.py (index.html
+# fonctionne sans changement), MySQL via aiomysql et modèle partagé avec app.py.
+# La boucle d'événements ne fait que de l'attente : l'inférence tourne dans un pool de
+# threads dédié (assez de threads pour remplir les micro-batches), les lectures/écritures
+# de fichiers et le hachage des mots de passe dans un second pool.
+#
+#   hypercorn asgi_app:app --bind 0.0.0.0:5000
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_POOL_RECYCLE_SECONDS = int(float(os.getenv("DB_POOL_RECYCLE_SECONDS", "1800")))
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", str(core.BATCH_MAX_SIZE)))
+IO_WORKERS = int(os.getenv("IO_WORKERS", "4"))
+
+app = Quart(__name__)
+# Même clé que app.py : les cookies de session restent valables d'un mode à l'autre
+app.secret_key = core.app.secret_key
+app.config['UPLOAD_FOLDER'] = core.app.config['UPLOAD_FOLDER']
+app.config['MAX_CONTENT_LENGTH'] = core.app.config['MAX_CONTENT_LENGTH']
+app.config['SESSION_PERMANENT'] = False
+app.config['PERMANENT_SESSION_LIFETIME'] = 3600
+
+inference_executor = ThreadPoolExecutor(max_workers=INFERENCE_WORKERS, thread_name_prefix="inference")
+io_executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="asgi-io")
+db_pool = None
+
+async def run_inference(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(inference_executor, partial(fn, *args))
+
+async def run_io(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(io_executor, partial(fn, *args))
+
+@app.before_serving
+async def startup():
+    global db_pool
+    if core.store.backend != 'mysql':
+        # Les routes ASGI interrogent MySQL directement via aiomysql
+        raise RuntimeError(f"asgi_app.py requiert STORAGE_BACKEND=mysql (actuel : {core.store.backend})")
+    await run_io(core.init_db)
+    config = db_config("eurosat_db")
+    try:
+        db_pool = await aiomysql.create_pool(
+            host=config['host'], port=config['port'], user=config['user'], password=config['password'],
+            db=config['database'], autocommit=True, minsize=1, maxsize=DB_POOL_SIZE,
+            pool_recycle=DB_POOL_RECYCLE_SECONDS
+        )
+    except Exception as e:
+        print(f"Erreur de connexion à la base de données: {e}")
+
+@app.after_serving
+async def shutdown():
+    if core.write_behind is not None:
+        await run_io(core.write_behind.close)
+    if db_pool is not None:
+        db_pool.close()
+        await db_pool.wait_closed()
+    inference_executor.shutdown(wait=False)
+    io_executor.shutdown(wait=False)
+
+def db_unavailable():
+    return jsonify({'error': 'Erreur de connexion à la base de données'}), 500
+
+def login_required(f):
+    @wraps(f)
+    async def decorated_function(*args, **kwargs):
+        if 'user_id' not in session:
+            return jsonify({'error': 'Authentication required'}), 401
+        return await f(*args, **kwargs)
+    return decorated_function
+
+def model_required(f):
+    @wraps(f)
+    async def decorated_function(*args, **kwargs):
+        if core.startup_state['phase'] == 'failed':
+            return jsonify({'error': 'Modèle non chargé'}), 503
+        core.follow_registry()
+        if core.serving.current is None:
+            return model_unavailable()
+        return await f(*args, **kwargs)
+    return decorated_function
+
+def admin_required(f):
+    @wraps(f)
+    async def decorated_function(*args, **kwargs):
+        if session.get('username') not in core.ADMIN_USERS:
+            return jsonify({'error': 'Accès réservé aux administrateurs'}), 403
+        return await f(*args, **kwargs)
+    return decorated_function
+
+@asynccontextmanager
+async def reserved_model():
+    # Comme model_required dans app.py : la version servie ne peut pas être libérée
+    # par un échange à chaud tant que la requête (ou le flux) l'utilise
+    # None si aucune version n'est servie (l'appelant répond 503) : rien à rendre alors
+    served = core.serving.acquire()
+    try:
+        yield served
+    finally:
+        if served is not None:
+            # La dernière libération ferme l'ancien modèle : hors de la boucle d'événements
+            await run_io(served.release)
+
+def model_unavailable():
+    return jsonify({'error': 'Modèle en cours de chargement', 'phase': core.startup_state['phase']}), 503
+
+async def insert_predictions(rows):
+    # Même transaction que storage.insert_predictions : predictions + user_class_stats + agrégats
+    async with db_pool.acquire() as conn:
+        await conn.begin()
+        try:
+            async with conn.cursor() as cursor:
+                await cursor.executemany(INSERT_PREDICTION_SQL, rows)
+                await cursor.executemany(INCREMENT_CLASS_STATS_SQL, class_stat_increments(rows))
+                await cursor.executemany(INCREMENT_DAILY_ROLLUP_SQL, daily_rollup_increments(rows))
+                await cursor.executemany(INCREMENT_CLASS_ROLLUP_SQL, class_rollup_increments(rows))
+            await conn.commit()
+        except Exception:
+            await conn.rollback()
+            raise
+    await run_io(core.invalidate_user_reads, rows)
+
+async def cache_lookup(namespace, user_id, *params):
+    # Le backend partagé (Redis) est bloquant : hors de la boucle d'événements
+    key = await run_io(core.read_cache.key, namespace, user_id, *params)
+    return key, await run_io(core.read_cache.get, key)
+
+async def record_predictions(rows, context):
+    # Même comportement que app.py : la prédiction est rendue même si son enregistrement échoue
+    if db_pool is None:
+        print(f"Erreur {context}: base indisponible, {len(rows)} prédiction(s) non enregistrée(s) "
+              f"({', '.join(row[1] for row in rows)})")
+        return
+    try:
+        await insert_predictions(rows)
+    except aiomysql.Error as e:
+        print(f"Erreur {context}: {e}")
+
+@app.route('/api/user-info', methods=['GET'])
+async def get_user_info():
+    if 'user_id' in session:
+        return jsonify({
+            'authenticated': True,
+            'user': {
+                'id': session['user_id'],
+                'username': session['username']
+            }
+        }), 200
+    else:
+        return jsonify({'authenticated': False}), 200
+
+@app.route('/api/reset-password-by-username', methods=['POST'])
+async def reset_password_by_username():
+    data = await request.get_json()
+    username = data.get('username')
+    new_password = data.get('new_password')
+
+    if not username or not new_password:
+        return jsonify({'error': "Nom d'utilisateur et nouveau mot de passe requis"}), 400
+
+    if len(new_password) < 6:
+        return jsonify({'error': 'Le mot de passe doit contenir au moins 6 caractères'}), 400
+
+    if db_pool is None:
+        return db_unavailable()
+
+    try:
+        async with db_pool.acquire() as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                await cursor.execute("SELECT id FROM users WHERE username = %s", (username,))
+                user = await cursor.fetchone()
+
+                if not user:
+                    return jsonify({'error': "Nom d'utilisateur introuvable"}), 404
+
+                hashed_password = await run_io(generate_password_hash, new_password)
+                await cursor.execute(
+                    "UPDATE users SET password = %s WHERE id = %s",
+                    (hashed_password, user['id'])
+                )
+
+        return jsonify({
+            'message': 'Mot de passe réinitialisé avec succès',
+            'username': username
+        }), 200
+
+    except aiomysql.Error as e:
+        print(f"Erreur reset_password_by_username: {e}")
+        return jsonify({'error': 'Erreur interne du serveur'}), 500
+
+@app.route('/api/register', methods=['POST'])
+async def register():
+    data = await request.get_json()
+    username = data.get('username')
+    email = data.get('email')
+    password = data.get('password')
+
+    if not username or not email or not password:
+        return jsonify({'error': 'Nom d\'utilisateur, email et mot de passe requis'}), 400
+
+    if len(password) < 6:
+        return jsonify({'error': 'Le mot de passe doit contenir au moins 6 caractères'}), 400
+
+    email_regex = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
+    if not re.match(email_regex, email):
+        return jsonify({'error': 'Adresse email invalide'}), 400
+
+    if db_pool is None:
+        return db_unavailable()
+
+    try:
+        async with db_pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute("SELECT id FROM users WHERE username = %s", (username,))
+                if await cursor.fetchone():
+                    return jsonify({'error': 'Nom d\'utilisateur déjà utilisé'}), 400
+
+                await cursor.execute("SELECT id FROM users WHERE email = %s", (email,))
+                if await cursor.fetchone():
+                    return jsonify({'error': 'Adresse email déjà utilisée'}), 400
+
+                hashed_password = await run_io(generate_password_hash, password)
+                await cursor.execute(
+                    "INSERT INTO users (username, email, password) VALUES (%s, %s, %s)",
+                    (username, email, hashed_password)
+                )
+
+        return jsonify({'message': 'Compte créé avec succès'}), 201
+
+    except aiomysql.Error as e:
+        print(f"Erreur register: {e}")
+        return jsonify({'error': 'Erreur interne du serveur'}), 500
+
+@app.route('/api/login', methods=['POST'])
+async def login():
+    data = await request.get_json()
+    username = data.get('username')
+    password = data.get('password')
+
+    if not username or not password:
+        return jsonify({'error': 'Nom d\'utilisateur et mot de passe requis'}), 400
+
+    if db_pool is None:
+        return db_unavailable()
+
+    try:
+        async with db_pool.acquire() as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                await cursor.execute("SELECT id, username, password FROM users WHERE username = %s", (username,))
+                user = await cursor.fetchone()
+
+        if user and await run_io(check_password_hash, user['password'], password):
+            session['user_id'] = user['id']
+            session['username'] = user['username']
+            return jsonify({'message': 'Connexion réussie', 'user': {'id': user['id'], 'username': user['username']}}), 200
+        else:
+            return jsonify({'error': 'Nom d\'utilisateur ou mot de passe incorrect'}), 401
+
+    except aiomysql.Error as e:
+        print(f"Erreur login: {e}")
+        return jsonify({'error': 'Erreur interne du serveur'}), 500
+
+@app.route('/api/logout', methods=['POST'])
+async def logout():
+    session.clear()
+    return jsonify({'message': 'Déconnexion réussie'}), 200
+
+@app.route('/api/predict', methods=['POST'])
+@login_required
+@model_required
+async def predict():
+    files = await request.files
+    values = await request.values
+    payload = await request.get_json(silent=True) or {}
+    if 'image' not in files and 'image_data' not in payload:
+        return jsonify({'error': 'Aucune image fournie'}), 400
+
+    head_name = values.get('head', 'default')
+    tta_mode = values.get('tta', core.TTA_MODE).lower()
+    if tta_mode not in ('off', 'on', 'auto'):
+        return jsonify({'error': 'Paramètre tta invalide (off, on, auto)'}), 400
+
+    async with reserved_model() as served:
+        if served is None:
+            return model_unavailable()
+        if not core.is_known_head(served, head_name):
+            return jsonify({'error': f'Tête de classification inconnue: {head_name}'}), 400
+
+        try:
+            if 'image' in files:
+                file = files['image']
+                if file.filename == '':
+                    return jsonify({'error': 'Aucun fichier sélectionné'}), 400
+
+                data = await run_io(file.read)
+                filename, digest = await run_io(core.upload_name, data, file.filename)
+            else:
+                data = core.decode_base64_image(payload['image_data'])
+                if not data:
+                    return jsonify({'error': 'Erreur lors du traitement de l\'image'}), 400
+                filename, digest = await run_io(core.upload_name, data)
+
+            try:
+                img_array = await run_io(core.decode_image_bytes, data)
+            except Exception as e:
+                print(f"Erreur lors du décodage de l'image: {e}")
+                return jsonify({'error': 'Erreur lors du traitement de l\'image'}), 400
+
+            pred_class, confidence, predictions, stage, used_tta, model_version = await run_inference(
+                core.predict_with_cascade, served, img_array, filename, head_name, tta_mode)
+
+            if pred_class is None:
+                return jsonify({'error': 'Erreur lors de la prédiction'}), 500
+
+            await run_io(core.persist_upload, filename, digest, data)
+
+            class_name = served.class_names[pred_class]
+            class_description = core.CLASS_DESCRIPTIONS.get(class_name, '')
+
+            row = (session['user_id'], filename, class_name, confidence, model_version, encode_probabilities(predictions))
+            if core.write_behind is not None:
+                try:
+                    # Journal local + file : pas d'aller-retour MySQL avant la réponse
+                    await run_io(core.write_behind.submit, row)
+                    row = None
+                except BufferFull as e:
+                    print(f"Écriture différée indisponible: {e}")
+            if row is not None:
+                await record_predictions([row], "enregistrement prédiction")
+
+            result = {
+                'class': class_name,
+                'description': class_description,
+                'confidence': round(confidence * 100, 2),
+                'image_url': f'/uploads/{filename}',
+                'head': head_name,
+                'tta': used_tta,
+                'stage': stage,
+                'model_version': model_version,
+                'timestamp': datetime.now().isoformat()
+            }
+            result.update(describe_vector(predictions, served.class_names))
+
+            return jsonify(result), 200
+
+        except Exception as e:
+            print(f"Erreur predict: {e}")
+            return jsonify({'error': 'Erreur lors du traitement de l\'image'}), 500
+
+@app.route('/api/predict/batch', methods=['POST'])
+@login_required
+@model_required
+async def predict_batch():
+    files = await request.files
+    values = await request.values
+    if 'archive' not in files and 'images' not in files:
+        return jsonify({'error': 'Aucune image fournie'}), 400
+
+    head_name = values.get('head', 'default')
+    if not core.is_known_head(core.serving.current, head_name):
+        return jsonify({'error': f'Tête de classification inconnue: {head_name}'}), 400
+
+    user_id = session['user_id']
+
+    def next_batch(uploads):
+        return [item for _, item in zip(range(core.BULK_BATCH_SIZE), uploads)]
+
+    async def generate():
+        total = 0
+        errors = 0
+        async with reserved_model() as served:
+            if served is None:
+                yield (json.dumps({'error': 'Modèle en cours de chargement'}) + '\n').encode('utf-8')
+                return
+            uploads = core.iter_bulk_uploads(files)
+            try:
+                while True:
+                    # Décompression de l'archive hors de la boucle d'événements
+                    batch = await run_io(next_batch, uploads)
+                    if not batch:
+                        break
+                    try:
+                        results, rows = await run_inference(core.classify_bulk_batch, served, batch, user_id, head_name)
+                    except Exception as e:
+                        print(f"Erreur predict_batch: {e}")
+                        results, rows = [{'filename': name, 'error': 'Erreur lors de la prédiction'} for name, _ in batch], []
+                    if rows:
+                        await record_predictions(rows, "enregistrement predict_batch")
+                    for result in results:
+                        total += 1
+                        errors += 'error' in result
+                        yield (json.dumps(result) + '\n').encode('utf-8')
+            except (zipfile.BadZipFile, tarfile.TarError) as e:
+                print(f"Erreur archive predict_batch: {e}")
+                errors += 1
+                yield (json.dumps({'error': 'Archive invalide'}) + '\n').encode('utf-8')
+
+        yield (json.dumps({'done': True, 'total': total, 'errors': errors}) + '\n').encode('utf-8')
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+@app.route('/api/similar', methods=['POST'])
+@login_required
+@model_required
+async def find_similar():
+    values = await request.values
+    try:
+        k = max(1, min(int(values.get('k', 10)), 100))
+    except ValueError:
+        return jsonify({'error': 'Paramètre k invalide'}), 400
+
+    async with reserved_model() as served:
+        if served is None:
+            return model_unavailable()
+        if core.vector_index is None or not served.split or core.embedding_version(served) != core.EMBEDDING_VERSION:
+            return jsonify({'error': 'Recherche par similarité indisponible (service backbone/tête désactivé)'}), 503
+
+        try:
+            files = await request.files
+            if 'image' in files:
+                data = await run_io(files['image'].read)
+                exclude = None
+            else:
+                payload = await request.get_json(silent=True) or {}
+                image_name = payload.get('image_name') or values.get('image_name')
+                if not image_name:
+                    return jsonify({'error': 'Aucune image fournie'}), 400
+                exclude = secure_filename(image_name)
+                data = await run_io(core.upload_store.read, exclude)
+
+            img_array = await run_io(core.decode_image_bytes, data)
+            embedding = await run_inference(embed_image, served, img_array)
+        except FileNotFoundError:
+            return jsonify({'error': 'Image introuvable'}), 404
+        except Exception as e:
+            print(f"Erreur find_similar: {e}")
+            return jsonify({'error': 'Erreur lors du traitement de l\'image'}), 400
+
+    matches = await run_inference(core.vector_index.search, embedding, k, exclude)
+    details = {}
+    if matches and db_pool is not None:
+        try:
+            async with db_pool.acquire() as conn:
+                async with conn.cursor(aiomysql.DictCursor) as cursor:
+                    placeholders = ', '.join(['%s'] * len(matches))
+                    await cursor.execute(
+                        f"SELECT image_name, predicted_class, confidence FROM predictions WHERE image_name IN ({placeholders})",
+                        [name for name, _ in matches]
+                    )
+                    for row in await cursor.fetchall():
+                        details[row['image_name']] = row
+        except aiomysql.Error as e:
+            print(f"Erreur find_similar: {e}")
+
+    results = []
+    for name, score in matches:
+        row = details.get(name, {})
+        results.append({
+            'image_name': name,
+            'image_url': f'/uploads/{name}',
+            'similarity': round(score, 4),
+            'predicted_class': row.get('predicted_class'),
+            'confidence': round(row['confidence'] * 100, 2) if 'confidence' in row else None
+        })
+
+    return jsonify({'results': results, 'indexed': len(core.vector_index)}), 200
+
+def read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def embed_image(served, img_array):
+    image_hash, embedding = core.lookup_embedding(served, img_array)
+    if embedding is None:
+        embedding = served.model.predict(img_array)
+        core.store_embedding(served, image_hash, embedding)
+    return embedding
+
+async def save_scene_upload(file):
+    # Même nommage par contenu que app.py : pas de collision entre utilisateurs
+    upload_dir = os.path.join(core.SCENE_DIR, 'uploads')
+    os.makedirs(upload_dir, exist_ok=True)
+    ext = os.path.splitext(secure_filename(file.filename))[1].lower()
+    tmp_path = os.path.join(upload_dir, f'.{secrets.token_hex(8)}.tmp')
+    try:
+        await file.save(tmp_path)
+        digest = await run_io(file_digest, tmp_path)
+        scene_path = os.path.join(upload_dir, digest + ext)
+        os.replace(tmp_path, scene_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return scene_path, digest
+
+@app.route('/api/scene', methods=['POST'])
+@login_required
+@model_required
+async def classify_scene():
+
+    # Les scènes dépassent largement la limite des uploads d'images simples
+    if request.content_length is not None and request.content_length > core.SCENE_MAX_UPLOAD:
+        return jsonify({'error': 'Scène trop volumineuse'}), 413
+    request.max_content_length = core.SCENE_MAX_UPLOAD
+    os.makedirs(core.SCENE_DIR, exist_ok=True)
+    files = await request.files
+    values = await request.values
+
+    try:
+        tile_size = int(values.get('tile_size', 64))
+        stride = int(values.get('stride', tile_size))
+        if tile_size < 8 or stride < 1:
+            raise ValueError
+    except ValueError:
+        return jsonify({'error': 'Paramètres tile_size / stride invalides'}), 400
+
+    digest = None
+    if 'scene' in files and files['scene'].filename:
+        scene_path, digest = await save_scene_upload(files['scene'])
+    elif core.SCENE_INPUT_DIR and values.get('path'):
+        scene_path = os.path.join(core.SCENE_INPUT_DIR, secure_filename(values['path']))
+        if not os.path.isfile(scene_path):
+            return jsonify({'error': 'Scène introuvable'}), 404
+    else:
+        return jsonify({'error': 'Aucune scène fournie'}), 400
+
+    version = core.serving.current.version
+    # Hachage de la scène entière pour l'identifiant de job : hors de la boucle
+    job = await run_io(partial(SceneJob, scene_path, core.SCENE_DIR, tile_size=tile_size,
+                               stride=stride, model_version=version, owner=session['user_id'], digest=digest))
+
+    async def generate():
+        async with reserved_model() as served:
+            if served is None:
+                yield (json.dumps({'error': 'Modèle en cours de chargement'}) + '\n').encode('utf-8')
+                return
+            try:
+                events = job.run(lambda batch: core.predict_tensors(served, batch), served.class_names,
+                                 input_size=core.INPUT_SIZE)
+                while True:
+                    event = await run_inference(next, events, None)
+                    if event is None:
+                        break
+                    if event.get('done'):
+                        event['map_url'] = f'/api/scene/{job.job_id}/map.png'
+                    yield (json.dumps(event) + '\n').encode('utf-8')
+            except Exception as e:
+                print(f"Erreur classify_scene: {e}")
+                yield (json.dumps({'job_id': job.job_id, 'error': 'Erreur lors du traitement de la scène'}) + '\n').encode('utf-8')
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+@app.route('/api/scene/<job_id>', methods=['GET'])
+@login_required
+async def get_scene_job(job_id):
+    work_dir = owned_job_dir(core.SCENE_DIR, secure_filename(job_id), session['user_id'])
+    progress_path = os.path.join(work_dir, 'progress.json') if work_dir else None
+    if progress_path is None or not os.path.exists(progress_path):
+        return jsonify({'error': 'Job introuvable'}), 404
+    return jsonify(json.loads(await run_io(read_file, progress_path))), 200
+
+@app.route('/api/scene/<job_id>/map.png', methods=['GET'])
+@login_required
+async def get_scene_map(job_id):
+    work_dir = owned_job_dir(core.SCENE_DIR, secure_filename(job_id), session['user_id'])
+    if work_dir is None:
+        return jsonify({'error': 'Job introuvable'}), 404
+    return await send_from_directory(work_dir, 'class_map.png')
+
+@app.route('/api/history', methods=['GET'])
+@login_required
+async def get_history():
+    user_id = session['user_id']
+    cursor_param = request.args.get('cursor')
+    try:
+        limit = parse_limit(request.args.get('limit'))
+        sql, params = history_query(user_id, limit, cursor_param)
+    except ValueError:
+        return jsonify({'error': 'Paramètres limit / cursor invalides'}), 400
+
+    cache_key, page = await cache_lookup('history', user_id, limit, cursor_param or '')
+    if page is None:
+        if db_pool is None:
+            return db_unavailable()
+        try:
+            async with db_pool.acquire() as conn:
+                async with conn.cursor(aiomysql.DictCursor) as cursor:
+                    await cursor.execute(sql, params)
+                    predictions, next_cursor = history_page(await cursor.fetchall(), limit)
+        except aiomysql.Error as e:
+            print(f"Erreur get_history: {e}")
+            return jsonify({'error': 'Erreur interne du serveur'}), 500
+        page = (await run_io(core.format_history_rows, predictions), next_cursor)
+        await run_io(core.read_cache.put, cache_key, page)
+
+    predictions, next_cursor = page
+    if core.write_behind is not None and not cursor_param:
+        predictions = merge_pending(predictions, core.format_history_rows(core.write_behind.pending_for_user(user_id)))
+
+    response = jsonify(predictions)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response, 200
+
+async def fetch_uncertainty_scan(user_id, scan):
+    async with db_pool.acquire() as conn:
+        async with conn.cursor(aiomysql.DictCursor) as cursor:
+            await cursor.execute(UNCERTAINTY_SCAN_SQL, (user_id, scan))
+            rows = await cursor.fetchall()
+    for row in rows:
+        row.pop('id', None)
+    return rows
+
+@app.route('/api/history/uncertain', methods=['GET'])
+@login_required
+async def get_uncertain_history():
+    class_names = core.probability_class_names()
+    try:
+        filters = core.parse_uncertainty_filters(request.args, class_names)
+        limit = parse_limit(request.args.get('limit'))
+        scan = parse_limit(request.args.get('scan'), UNCERTAINTY_DEFAULT_SCAN, UNCERTAINTY_MAX_SCAN)
+    except ValueError as e:
+        return jsonify({'error': f'Paramètres invalides: {e}'}), 400
+
+    if db_pool is None:
+        return db_unavailable()
+
+    try:
+        rows = await fetch_uncertainty_scan(session['user_id'], scan)
+        # Décodage et masques numpy hors de la boucle d'événements
+        predictions = (await run_io(partial(filter_uncertain, rows, class_names, **filters)))[:limit]
+
+        for pred in predictions:
+            pred['confidence'] = round(pred['confidence'] * 100, 2)
+            pred['image_url'] = f'/uploads/{pred["image_name"]}'
+            pred['description'] = core.CLASS_DESCRIPTIONS.get(pred['predicted_class'], '')
+
+        return jsonify(predictions), 200
+
+    except aiomysql.Error as e:
+        print(f"Erreur get_uncertain_history: {e}")
+        return jsonify({'error': 'Erreur interne du serveur'}), 500
+
+@app.route('/api/history/uncertainty', methods=['GET'])
+@login_required
+async def get_uncertainty_summary():
+    try:
+        margin_threshold = float(request.args.get('margin', '20')) / 100
+        scan = parse_limit(request.args.get('scan'), UNCERTAINTY_DEFAULT_SCAN, UNCERTAINTY_MAX_SCAN)
+    except ValueError:
+        return jsonify({'error': 'Paramètres margin / scan invalides'}), 400
+
+    if db_pool is None:
+        return db_unavailable()
+
+    try:
+        rows = await fetch_uncertainty_scan(session['user_id'], scan)
+        summary = await run_io(uncertainty_summary, rows, core.probability_class_names(), margin_threshold)
+        return jsonify(summary), 200
+
+    except aiomysql.Error as e:
+        print(f"Erreur get_uncertainty_summary: {e}")
+        return jsonify({'error': 'Erreur interne du serveur'}), 500
+
+@app.route('/api/stats', methods=['GET'])
+@login_required
+async def get_stats():
+    try:
+        start, end = parse_day(request.args.get('from')), parse_day(request.args.get('to'))
+    except ValueError:
+        return jsonify({'error': 'Paramètres from / to invalides (AAAA-MM-JJ)'}), 400
+
+    cache_key, stats = await cache_lookup('stats', session['user_id'], start or '', end or '')
+    if stats is not None:
+        return jsonify(stats), 200
+
+    if db_pool is None:
+        return db_unavailable()
+
+    try:
+        async with db_pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                if start or end:
+                    await cursor.execute(USER_STATS_BETWEEN_SQL,
+                                         (session['user_id'], start or date.min, end or date.max))
+                else:
+                    await cursor.execute(USER_STATS_SQL, (session['user_id'],))
+                stats = stats_from_rows(await cursor.fetchall())
+
+        await run_io(core.read_cache.put, cache_key, stats)
+        return jsonify(stats), 200
+
+    except aiomysql.Error as e:
+        print(f"Erreur get_stats: {e}")
+        return jsonify({'error': 'Erreur interne du serveur'}), 500
+
+@app.route('/api/analytics', methods=['GET'])
+@login_required
+@admin_required
+async def get_analytics():
+    bucket = request.args.get('bucket', 'day')
+    try:
+        start, end = parse_range(request.args.get('from'), request.args.get('to'), bucket)
+    except ValueError as e:
+        return jsonify({'error': f'Paramètres invalides: {e}'}), 400
+
+    cache_key, analytics = await cache_lookup('analytics', 'global', start, end, bucket)
+    if analytics is not None:
+        return jsonify(analytics), 200
+
+    if db_pool is None:
+        return db_unavailable()
+
+    try:
+        async with db_pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(CLASS_ROLLUP_RANGE_SQL, (start, end))
+                rows = await cursor.fetchall()
+
+        # Fusion pandas : hors de la boucle d'événements
+        analytics = await run_io(summarize, rows, start, end, bucket)
+        await run_io(core.read_cache.put, cache_key, analytics)
+        return jsonify(analytics), 200
+
+    except aiomysql.Error as e:
+        print(f"Erreur get_analytics: {e}")
+        return jsonify({'error': 'Erreur interne du serveur'}), 500
+
+@app.route('/ready', methods=['GET'])
+async def ready():
+    state = core.startup_state
+    is_ready = state['phase'] == 'ready'
+    return jsonify({
+        'ready': is_ready,
+        'phase': state['phase'],
+        'error': state['error'],
+        'timings': state['timings']
+    }), 200 if is_ready else 503
+
+@app.route('/api/inference/stats', methods=['GET'])
+@login_required
+@admin_required
+async def get_inference_stats():
+    served = core.serving.current
+    if served is None:
+        return jsonify({'error': 'Modèle non chargé'}), 503
+    stats = served.model.stats()
+    stats['model_version'] = served.version
+    stats['executor_workers'] = INFERENCE_WORKERS
+    return jsonify(stats), 200
+
+@app.route('/api/heads', methods=['GET'])
+async def get_heads():
+    served = core.serving.current
+    store = core.embedding_store
+    return jsonify({
+        'split_serving': served.split if served is not None else False,
+        'heads': sorted(served.heads) if served is not None and served.heads else ['default'],
+        'embeddings_stored': await run_io(store.count) if store is not None else 0
+    }), 200
+
+@app.route('/api/cache/stats', methods=['GET'])
+@login_required
+@admin_required
+async def get_cache_stats():
+    stats = core.prediction_cache.stats()
+    stats['model_version'] = core.serving.current.version if core.serving.current is not None else None
+    stats['read_cache'] = core.read_cache.stats()
+    return jsonify(stats), 200
+
+@app.route('/api/db/stats', methods=['GET'])
+@login_required
+@admin_required
+async def get_db_stats():
+    if db_pool is None:
+        return db_unavailable()
+    stats = {
+        'size': db_pool.maxsize,
+        'open': db_pool.size,
+        'idle': db_pool.freesize,
+        'in_use': db_pool.size - db_pool.freesize
+    }
+    if core.write_behind is not None:
+        stats['write_behind'] = core.write_behind.stats()
+    stats['uploads'] = await run_io(core.upload_store.stats)
+    return jsonify(stats), 200
+
+@app.route('/api/admin/models', methods=['GET'])
+@login_required
+@admin_required
+async def list_models():
+    registry = core.registry
+    versions = []
+    for version in await run_io(registry.versions):
+        metadata = await run_io(registry.metadata, version)
+        versions.append({
+            'version': version,
+            'backend': metadata['backend'],
+            'classes': len(metadata['class_names']),
+            'created_at': metadata.get('created_at'),
+            'notes': metadata.get('notes', '')
+        })
+    state = core.serving.state()
+    state['registry_active'] = registry.active_version()
+    state['versions'] = versions
+    return jsonify(state), 200
+
+@app.route('/api/admin/models/<version>/activate', methods=['POST'])
+@login_required
+@admin_required
+async def activate_model(version):
+    if core.MODEL_SERVER_ADDRESS:
+        return jsonify({'error': "Modèle servi par le serveur d'inférence partagé : redémarrer model_server.py"}), 409
+    if version not in await run_io(core.registry.versions):
+        return jsonify({'error': f'Version inconnue: {version}'}), 404
+    current = core.serving.current
+    if current is not None and current.version == version:
+        return jsonify({'message': 'Version déjà active', 'version': version}), 200
+
+    if not core.serving.load_in_background(version, core.load_served_model,
+                                           on_ready=lambda served: core.registry.set_active(served.version)):
+        return jsonify({'error': f'Chargement déjà en cours: {core.serving.loading}'}), 409
+    return jsonify({'message': 'Chargement démarré', 'version': version}), 202
+
+@app.route('/uploads/<filename>')
+async def uploaded_file(filename):
+    try:
+        found = await run_io(core.upload_store.variant, filename, request.args.get('size', 'full'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if found is None:
+        return jsonify({'error': 'Image introuvable'}), 404
+    path, etag = found
+    if request.if_none_match.contains(etag):
+        return core.upload_cache_headers(Response('', status=304), etag)
+    response = await send_from_directory(os.path.dirname(path), os.path.basename(path))
+    return core.upload_cache_headers(response, etag)
+
+@app.route('/')
+async def index():
+    return await render_template('index.html')
@@ -0,0 +1,164 @@
+import threading
+import time
+from collections import Counter, deque
+
+import numpy as np
+
+
+class _PendingRequest:
+    def __init__(self, tensor):
+        self.tensor = tensor
+        self.enqueued_at = time.perf_counter()
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class BatchingEngine:
+    # Regroupe les requêtes concurrentes en un seul appel au modèle.
+    # predict_fn reçoit un batch (N, H, W, C) déjà prétraité et renvoie (N, n_classes).
+
+    def __init__(self, predict_fn, max_batch_size=16, max_wait_ms=8, stats_window=1000):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._busy = False
+        self._closed = False
+
+        self._batch_sizes = Counter()
+        self._wait_times = deque(maxlen=stats_window)
+        self._total_requests = 0
+        self._total_batches = 0
+        self._immediate_runs = 0
+
+        self._worker = threading.Thread(target=self._run, name="batching-engine", daemon=True)
+        self._worker.start()
+
+    def predict(self, tensor):
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Moteur d'inférence arrêté")
+            # Trafic faible : rien en attente et modèle libre -> exécution immédiate
+            immediate = not self._queue and not self._busy
+            if immediate:
+                self._busy = True
+            else:
+                request = _PendingRequest(tensor)
+                self._queue.append(request)
+                self._cond.notify_all()
+
+        if immediate:
+            try:
+                preds = self.predict_fn(np.expand_dims(tensor, axis=0))
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._record_batch(1, [0.0])
+                    self._immediate_runs += 1
+                    self._cond.notify_all()
+            return preds[0]
+
+        request.event.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def run_batch(self, batch):
+        # Batch déjà constitué (endpoint bulk) : exécuté entre deux batches du planificateur
+        with self._cond:
+            while self._busy and not self._closed:
+                self._cond.wait()
+            if self._closed:
+                raise RuntimeError("Moteur d'inférence arrêté")
+            self._busy = True
+        try:
+            return self.predict_fn(batch)
+        finally:
+            with self._cond:
+                self._busy = False
+                self._record_batch(len(batch), [0.0] * len(batch))
+                self._cond.notify_all()
+
+    def _collect_batch(self):
+        with self._cond:
+            while True:
+                # Modèle occupé (y compris à l'arrêt) : attendre qu'il soit rendu
+                while self._busy or (not self._closed and not self._queue):
+                    self._cond.wait()
+                if self._closed and not self._queue:
+                    return None
+
+                # Attendre un batch complet ou l'expiration du délai du plus ancien
+                deadline = self._queue[0].enqueued_at + self.max_wait
+                while len(self._queue) < self.max_batch_size and not self._closed and not self._busy:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+
+                # run_batch a pu prendre le modèle pendant l'attente : on ne l'exécute
+                # jamais en parallèle, le batch part après lui
+                if self._busy:
+                    continue
+                size = min(len(self._queue), self.max_batch_size)
+                batch = [self._queue.popleft() for _ in range(size)]
+                self._busy = True
+                return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            if batch is None:
+                return
+
+            started = time.perf_counter()
+            try:
+                preds = self.predict_fn(np.stack([r.tensor for r in batch]))
+                for request, row in zip(batch, preds):
+                    request.result = row
+            except Exception as e:
+                for request in batch:
+                    request.error = e
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._record_batch(len(batch), [started - r.enqueued_at for r in batch])
+                    self._cond.notify_all()
+                for request in batch:
+                    request.event.set()
+
+    def _record_batch(self, size, waits):
+        self._batch_sizes[size] += 1
+        self._wait_times.extend(waits)
+        self._total_requests += size
+        self._total_batches += 1
+
+    def stats(self):
+        with self._cond:
+            waits = np.array(self._wait_times, dtype=np.float64) * 1000.0
+            return {
+                'queue_depth': len(self._queue),
+                'busy': self._busy,
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000.0,
+                'total_requests': self._total_requests,
+                'total_batches': self._total_batches,
+                'immediate_runs': self._immediate_runs,
+                'batch_size_histogram': {str(k): v for k, v in sorted(self._batch_sizes.items())},
+                'wait_ms': {
+                    'count': int(waits.size),
+                    'mean': round(float(waits.mean()), 3) if waits.size else 0.0,
+                    'p50': round(float(np.percentile(waits, 50)), 3) if waits.size else 0.0,
+                    'p95': round(float(np.percentile(waits, 95)), 3) if waits.size else 0.0,
+                    'max': round(float(waits.max()), 3) if waits.size else 0.0,
+                }
+            }
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._worker.join(timeout=5)
@@ -0,0 +1,146 @@
+import argparse
+import json
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from probabilities import encode_probabilities
+from storage import HISTORY_DEFAULT_LIMIT
+from stores import MySQLStore
+
+# Latence par requête des chemins de données de l'API selon le backend de stockage :
+#
+#   predict   insertion d'une prédiction (INSERT + compteurs user_class_stats)
+#   history   première page de /api/history
+#   page2     page suivante (pagination par curseur)
+#   stats     /api/stats (lecture de user_class_stats)
+#
+#   python bench_storage.py --backend sqlite mysql --users 20 --seed 5000 --requests 2000
+#
+# MySQL : DB_HOST / DB_USER / DB_PASSWORD, base DB_NAME (défaut eurosat_bench, à créer
+# au préalable). SQLite : fichier --sqlite-path, recréé à chaque lancement.
+# Les utilisateurs bench_user_* et leurs prédictions restent en base après le banc.
+
+CLASS_NAMES = ['AnnualCrop', 'Forest', 'HerbaceousVegetation', 'Highway', 'Industrial',
+               'Pasture', 'PermanentCrop', 'Residential', 'River', 'SeaLake']
+
+
+def open_store(backend, sqlite_path):
+    if backend == 'sqlite':
+        from sqlite_store import SQLiteStore
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(sqlite_path + suffix):
+                os.remove(sqlite_path + suffix)
+        return SQLiteStore(sqlite_path)
+    from db_pool import pool_from_env
+    return MySQLStore(pool_from_env('eurosat_bench'))
+
+
+def random_row(rng, user_id, timestamp=None):
+    probs = rng.dirichlet(np.full(len(CLASS_NAMES), 0.3))
+    index = int(np.argmax(probs))
+    row = (user_id, f"bench_{rng.integers(1 << 40):010x}.png", CLASS_NAMES[index], float(probs[index]),
+           'bench', encode_probabilities(probs))
+    return row + (timestamp,) if timestamp is not None else row
+
+
+def seed(store, users, rows_per_user, batch_size, rng):
+    user_ids = []
+    for i in range(users):
+        username = f"bench_user_{i}"
+        if store.get_user(username) is None:
+            store.create_user(username, None, 'bench')
+        user_ids.append(store.get_user(username)['id'])
+
+    # Historique étalé sur 30 jours, inséré par lots comme l'écriture différée
+    started = datetime.now() - timedelta(days=30)
+    step = timedelta(days=30) / max(rows_per_user, 1)
+    for user_id in user_ids:
+        rows = [random_row(rng, user_id, started + step * i) for i in range(rows_per_user)]
+        for i in range(0, len(rows), batch_size):
+            store.insert_predictions(rows[i:i + batch_size])
+    return user_ids
+
+
+def measure(fn, requests):
+    latencies = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - started) * 1000.0)
+    latencies = np.array(latencies)
+    return {
+        'requests': requests,
+        'mean_ms': round(float(latencies.mean()), 3),
+        'p50_ms': round(float(np.percentile(latencies, 50)), 3),
+        'p95_ms': round(float(np.percentile(latencies, 95)), 3),
+        'p99_ms': round(float(np.percentile(latencies, 99)), 3)
+    }
+
+
+def run(store, user_ids, requests, limit, rng):
+    def predict():
+        store.insert_predictions([random_row(rng, random.choice(user_ids))])
+
+    def history():
+        store.fetch_history(random.choice(user_ids), limit)
+
+    cursors = {user_id: store.fetch_history(user_id, limit)[1] for user_id in user_ids}
+
+    def page2():
+        user_id = random.choice(user_ids)
+        store.fetch_history(user_id, limit, cursors[user_id])
+
+    def stats():
+        store.fetch_user_stats(random.choice(user_ids))
+
+    # Une passe à blanc : connexions ouvertes, instructions préparées, pages en cache
+    paths = [('predict', predict), ('history', history), ('page2', page2), ('stats', stats)]
+    for _, fn in paths:
+        fn()
+    return {name: measure(fn, requests) for name, fn in paths}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Banc de latence des backends de stockage")
+    parser.add_argument('--backend', nargs='+', choices=['mysql', 'sqlite'], default=['sqlite', 'mysql'])
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=5000, help="Prédictions existantes par utilisateur")
+    parser.add_argument('--seed-batch', type=int, default=500)
+    parser.add_argument('--requests', type=int, default=2000, help="Requêtes mesurées par chemin")
+    parser.add_argument('--limit', type=int, default=HISTORY_DEFAULT_LIMIT, help="Taille de page d'historique")
+    parser.add_argument('--sqlite-path', default='bench_storage.sqlite')
+    parser.add_argument('--output', help="Résultats JSON")
+    args = parser.parse_args()
+
+    results = {}
+    for backend in args.backend:
+        rng = np.random.default_rng(0)
+        random.seed(0)
+        store = open_store(backend, args.sqlite_path)
+        try:
+            store.init_schema()
+            started = time.perf_counter()
+            user_ids = seed(store, args.users, args.seed, args.seed_batch, rng)
+            print(f"[{backend}] {args.users * args.seed} prédictions insérées en {time.perf_counter() - started:.1f} s")
+            results[backend] = run(store, user_ids, args.requests, args.limit, rng)
+        finally:
+            store.close()
+
+    print(f"{'backend':<8} {'chemin':<8} {'moyenne':>9} {'p50':>9} {'p95':>9} {'p99':>9}  (ms)")
+    for backend, paths in results.items():
+        for name, row in paths.items():
+            print(f"{backend:<8} {name:<8} {row['mean_ms']:>9.3f} {row['p50_ms']:>9.3f} "
+                  f"{row['p95_ms']:>9.3f} {row['p99_ms']:>9.3f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Résultats écrits dans {args.output}")
+
+
+if __name__ == '__main__':
+    main()
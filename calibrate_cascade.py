@@ -0,0 +1,146 @@
+import argparse
+import json
+import time
+
+import numpy as np
+
+from cascade import accepts
+from export_model import load_split
+from inference_backends import load_backend
+
+# Choisit les seuils de la cascade sur le split de validation : précision cible
+# atteinte pour un coût moyen (ms/image mesurées) minimal.
+#
+#   python calibrate_cascade.py --val-dir EuroSAT_split/val --light modelCNN.h5 \
+#       --heavy resnet50_fast_model.h5 --ensemble modelVGG16.h5 modelDenseNet121.h5 \
+#       --target-accuracy 0.97
+
+CONFIDENCE_GRID = np.concatenate([np.linspace(0.5, 0.95, 46), np.linspace(0.955, 0.999, 12)])
+MARGIN_GRID = np.linspace(0.0, 0.9, 10)
+
+
+def run_model(path, images, batch_size):
+    backend = load_backend('keras', path)
+    backend.predict(images[:batch_size])
+    started = time.perf_counter()
+    probs = np.concatenate([backend.predict(images[i:i + batch_size]) for i in range(0, len(images), batch_size)])
+    cost_ms = (time.perf_counter() - started) * 1000.0 / len(images)
+    return probs.astype(np.float32), cost_ms
+
+
+def search(light, heavy, ensemble, labels, costs, target_accuracy):
+    light_correct = np.argmax(light, axis=1) == labels
+    heavy_correct = np.argmax(heavy, axis=1) == labels
+    ensemble_correct = np.argmax(ensemble, axis=1) == labels if ensemble is not None else heavy_correct
+
+    # Toutes les combinaisons de seuils lourds sont évaluées d'un coup : matrice (H, N)
+    if ensemble is not None:
+        heavy_grid = [(c, m) for c in CONFIDENCE_GRID for m in MARGIN_GRID]
+        heavy_ok = np.stack([accepts(heavy, c, m) for c, m in heavy_grid])
+    else:
+        heavy_grid = [(None, None)]
+        heavy_ok = np.ones((1, len(labels)), dtype=bool)
+
+    best = None
+    for light_conf in CONFIDENCE_GRID:
+        for light_margin in MARGIN_GRID:
+            light_ok = accepts(light, light_conf, light_margin)
+            escalated = ~light_ok
+            correct = np.where(light_ok, light_correct, np.where(heavy_ok, heavy_correct, ensemble_correct))
+            accuracy = correct.mean(axis=1)
+            ensemble_rate = (escalated & ~heavy_ok).mean(axis=1)
+            cost = costs['light'] + escalated.mean() * costs['heavy'] + ensemble_rate * costs['ensemble']
+
+            meets = accuracy >= target_accuracy
+            if meets.any():
+                i = int(np.argmin(np.where(meets, cost, np.inf)))
+            else:
+                i = int(np.argmax(accuracy))
+
+            candidate = {
+                'accuracy': float(accuracy[i]),
+                'cost_ms': float(cost[i]),
+                'light_rate': float(light_ok.mean()),
+                'ensemble_rate': float(ensemble_rate[i]),
+                'light_min_confidence': float(light_conf),
+                'light_min_margin': float(light_margin),
+                'heavy_min_confidence': None if heavy_grid[i][0] is None else float(heavy_grid[i][0]),
+                'heavy_min_margin': None if heavy_grid[i][1] is None else float(heavy_grid[i][1])
+            }
+            if best is None \
+                    or (meets[i] and (not best[0] or candidate['cost_ms'] < best[1]['cost_ms'])) \
+                    or (not meets[i] and not best[0] and candidate['accuracy'] > best[1]['accuracy']):
+                best = (bool(meets[i]), candidate)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibration des seuils de la cascade de modèles")
+    parser.add_argument('--val-dir', required=True)
+    parser.add_argument('--light', default='modelCNN.h5')
+    parser.add_argument('--heavy', default='resnet50_fast_model.h5')
+    parser.add_argument('--ensemble', nargs='*', default=[], help="Modèles lourds additionnels moyennés avec --heavy")
+    parser.add_argument('--target-accuracy', type=float, default=0.97)
+    parser.add_argument('--samples', type=int, default=5000)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--output', default='cascade.json')
+    args = parser.parse_args()
+
+    images, labels = load_split(args.val_dir, args.samples)
+
+    light, light_cost = run_model(args.light, images, args.batch_size)
+    heavy, heavy_cost = run_model(args.heavy, images, args.batch_size)
+    ensemble, ensemble_cost = None, 0.0
+    if args.ensemble:
+        members = [heavy]
+        for path in args.ensemble:
+            probs, cost = run_model(path, images, args.batch_size)
+            members.append(probs)
+            ensemble_cost += cost
+        ensemble = np.mean(members, axis=0)
+    costs = {'light': light_cost, 'heavy': heavy_cost, 'ensemble': ensemble_cost}
+
+    print(f"Coûts mesurés (ms/image): léger={light_cost:.2f} lourd={heavy_cost:.2f} ensemble(+)={ensemble_cost:.2f}")
+    print(f"Précision seule: léger={np.mean(np.argmax(light, axis=1) == labels):.4f} "
+          f"lourd={np.mean(np.argmax(heavy, axis=1) == labels):.4f}")
+
+    meets, best = search(light, heavy, ensemble, labels, costs, args.target_accuracy)
+    if not meets:
+        print(f"Précision cible {args.target_accuracy} inatteignable, meilleure configuration retenue")
+
+    config = {
+        'light': {
+            'name': 'cnn',
+            'path': args.light,
+            'min_confidence': best['light_min_confidence'],
+            'min_margin': best['light_min_margin']
+        },
+        'heavy': {'name': 'resnet50', 'path': args.heavy},
+        'calibration': {
+            'val_dir': args.val_dir,
+            'samples': int(len(labels)),
+            'target_accuracy': args.target_accuracy,
+            'accuracy': best['accuracy'],
+            'cost_ms': best['cost_ms'],
+            'heavy_only_cost_ms': heavy_cost,
+            'light_rate': best['light_rate'],
+            'ensemble_rate': best['ensemble_rate']
+        }
+    }
+    if ensemble is not None:
+        config['ensemble'] = {
+            'paths': args.ensemble,
+            'heavy_min_confidence': best['heavy_min_confidence'],
+            'heavy_min_margin': best['heavy_min_margin']
+        }
+
+    with open(args.output, 'w') as f:
+        json.dump(config, f, indent=2)
+
+    print(f"Précision {best['accuracy']:.4f} • coût moyen {best['cost_ms']:.2f} ms/image "
+          f"(ResNet50 seul: {heavy_cost:.2f}) • {best['light_rate'] * 100:.1f}% résolues par le CNN")
+    print(f"Configuration écrite dans {args.output}")
+
+
+if __name__ == '__main__':
+    main()
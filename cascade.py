@@ -0,0 +1,56 @@
+import json
+
+import numpy as np
+
+# Cascade à seuil de confiance : le petit CNN du notebook répond seul aux tuiles faciles,
+# les autres montent vers ResNet50 puis, si configuré, vers un ensemble de modèles lourds.
+# Les seuils viennent de calibrate_cascade.py (fichier CASCADE_CONFIG).
+
+
+def top2_margin(probs):
+    probs = np.asarray(probs, dtype=np.float32)
+    top2 = np.sort(probs, axis=-1)[..., -2:]
+    return top2[..., 1], top2[..., 1] - top2[..., 0]
+
+
+def accepts(probs, min_confidence, min_margin):
+    confidence, margin = top2_margin(probs)
+    return (confidence >= min_confidence) & (margin >= min_margin)
+
+
+class Cascade:
+
+    def __init__(self, config, load_model_fn):
+        light = config['light']
+        self.light_name = light.get('name', 'cnn')
+        self.light_model = load_model_fn(light['path'])
+        self.light_min_confidence = float(light['min_confidence'])
+        self.light_min_margin = float(light.get('min_margin', 0.0))
+
+        self.heavy_name = config.get('heavy', {}).get('name', 'resnet50')
+
+        ensemble = config.get('ensemble')
+        self.ensemble_models = []
+        if ensemble:
+            self.ensemble_models = [load_model_fn(path) for path in ensemble['paths']]
+            self.heavy_min_confidence = float(ensemble['heavy_min_confidence'])
+            self.heavy_min_margin = float(ensemble.get('heavy_min_margin', 0.0))
+
+    @classmethod
+    def from_file(cls, path, load_model_fn):
+        with open(path) as f:
+            return cls(json.load(f), load_model_fn)
+
+    def light_predict(self, img_array):
+        return self.light_model.predict(img_array)
+
+    def light_accepts(self, probs):
+        return bool(accepts(probs, self.light_min_confidence, self.light_min_margin))
+
+    def needs_ensemble(self, probs):
+        return bool(self.ensemble_models) and not bool(accepts(probs, self.heavy_min_confidence, self.heavy_min_margin))
+
+    def ensemble_predict(self, img_array, heavy_probs):
+        members = [np.asarray(heavy_probs, dtype=np.float32)]
+        members.extend(np.asarray(m.predict(img_array), dtype=np.float32) for m in self.ensemble_models)
+        return np.mean(members, axis=0)
@@ -0,0 +1,71 @@
+import argparse
+import sys
+from datetime import date
+
+import mysql.connector
+
+from db_pool import ConnectionPool, db_config
+from stores import MySQLStore, StorageError
+
+# Vérifie l'initialisation du schéma MySQL sur une base vide (premier déploiement) :
+#
+#   python check_schema.py [--database eurosat_schema_check] [--keep]
+#
+# Crée la base, lance init_schema deux fois (la seconde doit être sans effet), vérifie les
+# tables attendues puis insère et relit une prédiction par le même chemin que /api/predict.
+# La base est supprimée à la fin sauf --keep. Identifiants : DB_HOST / DB_USER / DB_PASSWORD.
+
+EXPECTED_TABLES = {'users', 'predictions', 'user_class_stats', 'prediction_daily_rollups', 'class_daily_rollups'}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Initialisation du schéma MySQL sur une base vide")
+    parser.add_argument('--database', default='eurosat_schema_check')
+    parser.add_argument('--keep', action='store_true', help="Conserve la base après la vérification")
+    args = parser.parse_args()
+
+    config = db_config(args.database)
+    config['database'] = args.database
+    server = {key: value for key, value in config.items() if key != 'database'}
+    admin = mysql.connector.connect(autocommit=True, **server)
+    cursor = admin.cursor()
+    try:
+        cursor.execute(f"DROP DATABASE IF EXISTS `{args.database}`")
+        cursor.execute(f"CREATE DATABASE `{args.database}`")
+
+        store = MySQLStore(ConnectionPool(config, size=2))
+        try:
+            store.init_schema()
+            store.init_schema()
+            cursor.execute(f"SHOW TABLES FROM `{args.database}`")
+            missing = EXPECTED_TABLES - {name for (name,) in cursor.fetchall()}
+            if missing:
+                print(f"Tables manquantes : {', '.join(sorted(missing))}")
+                return 1
+
+            store.create_user('schema_check', None, 'x')
+            user_id = store.get_user('schema_check')['id']
+            store.insert_predictions([(user_id, 'check.png', 'Forest', 0.9, 'check', None)])
+            if store.fetch_user_stats(user_id) != store.fetch_user_stats_between(user_id, date.today(), date.today()):
+                print("Agrégats journaliers incohérents avec user_class_stats")
+                return 1
+            if not store.fetch_class_rollups(date.today(), date.today()):
+                print("Agrégats globaux vides après insertion")
+                return 1
+        except StorageError as e:
+            print(f"Erreur d'initialisation du schéma: {e}")
+            return 1
+        finally:
+            store.close()
+
+        print("Schéma initialisé sur base vide : OK")
+        return 0
+    finally:
+        if not args.keep:
+            cursor.execute(f"DROP DATABASE IF EXISTS `{args.database}`")
+        cursor.close()
+        admin.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
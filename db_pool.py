@@ -0,0 +1,188 @@
+import os
+import threading
+import time
+from collections import deque
+
+import mysql.connector
+from mysql.connector import Error
+
+# Pool de connexions MySQL partagé par app.py et appST.py.
+# get_db_connection() garde la même interface : close() rend la connexion au pool au lieu
+# de la fermer. Une connexion trop ancienne est recyclée, une connexion morte (coupure,
+# wait_timeout du serveur) est détectée par un ping avant d'être prêtée. Quand le pool
+# est plein, l'appelant attend au plus DB_POOL_TIMEOUT secondes puis reçoit PoolTimeout.
+
+
+class PoolTimeout(Error):
+    pass
+
+
+def db_config(default_database):
+    # Identifiants lus dans l'environnement, jamais dans le code
+    return {
+        'host': os.getenv("DB_HOST", "localhost"),
+        'port': int(os.getenv("DB_PORT", "3306")),
+        'user': os.getenv("DB_USER", "root"),
+        'password': os.getenv("DB_PASSWORD", ""),
+        'database': os.getenv("DB_NAME", default_database)
+    }
+
+
+class PooledConnection:
+    # Mandataire vers la connexion mysql.connector
+
+    def __init__(self, pool, raw, created_at):
+        self._pool = pool
+        self._raw = raw
+        self.created_at = created_at
+        self._returned = False
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def close(self):
+        if not self._returned:
+            self._returned = True
+            self._pool._release(self)
+
+
+class ConnectionPool:
+
+    def __init__(self, config, size=10, recycle_seconds=1800, pre_ping=True, wait_timeout=5.0, max_waiting=64):
+        self.config = config
+        self.size = max(1, int(size))
+        self.recycle_seconds = recycle_seconds
+        self.pre_ping = pre_ping
+        self.wait_timeout = wait_timeout
+        self.max_waiting = max_waiting
+
+        self._cond = threading.Condition()
+        self._idle = deque()
+        self._open = 0
+        self._in_use = 0
+        self._waiting = 0
+        self._created = 0
+        self._recycled = 0
+        self._ping_failures = 0
+        self._timeouts = 0
+        self._rejected = 0
+
+    def _connect(self):
+        raw = mysql.connector.connect(autocommit=True, **self.config)
+        with self._cond:
+            self._created += 1
+        return raw
+
+    def _usable(self, raw, created_at):
+        if self.recycle_seconds and time.monotonic() - created_at > self.recycle_seconds:
+            with self._cond:
+                self._recycled += 1
+            _close_quietly(raw)
+            return False
+        if self.pre_ping:
+            try:
+                raw.ping(reconnect=False)
+            except Error:
+                with self._cond:
+                    self._ping_failures += 1
+                _close_quietly(raw)
+                return False
+        return True
+
+    def connection(self):
+        deadline = time.monotonic() + self.wait_timeout
+        with self._cond:
+            while not self._idle and self._open >= self.size:
+                # Contre-pression : au-delà de max_waiting on refuse sans attendre
+                if self._waiting >= self.max_waiting:
+                    self._rejected += 1
+                    raise PoolTimeout(f"Pool MySQL saturé ({self._waiting} requêtes en attente)")
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(f"Aucune connexion MySQL libre après {self.wait_timeout}s")
+                self._waiting += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+            # LIFO : les connexions les plus récemment utilisées restent chaudes
+            raw, created_at = self._idle.pop() if self._idle else (None, None)
+            if raw is None:
+                self._open += 1
+            self._in_use += 1
+
+        try:
+            if raw is not None and not self._usable(raw, created_at):
+                raw = None
+            if raw is None:
+                raw = self._connect()
+                created_at = time.monotonic()
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        return PooledConnection(self, raw, created_at)
+
+    def _release(self, conn):
+        raw = conn._raw
+        healthy = True
+        try:
+            # Résultats non lus ou transaction ouverte : on remet la connexion à zéro
+            raw.consume_results()
+            if raw.in_transaction:
+                raw.rollback()
+        except Error:
+            healthy = False
+        with self._cond:
+            self._in_use -= 1
+            if healthy:
+                self._idle.append((raw, conn.created_at))
+            else:
+                self._open -= 1
+            self._cond.notify()
+        if not healthy:
+            _close_quietly(raw)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'size': self.size,
+                'open': self._open,
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+                'waiting': self._waiting,
+                'created': self._created,
+                'recycled': self._recycled,
+                'ping_failures': self._ping_failures,
+                'timeouts': self._timeouts,
+                'rejected': self._rejected
+            }
+
+    def close_all(self):
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._open -= len(idle)
+        for raw, _ in idle:
+            _close_quietly(raw)
+
+
+def _close_quietly(raw):
+    try:
+        raw.close()
+    except Error:
+        pass
+
+
+def pool_from_env(default_database):
+    return ConnectionPool(
+        db_config(default_database),
+        size=int(os.getenv("DB_POOL_SIZE", "10")),
+        recycle_seconds=float(os.getenv("DB_POOL_RECYCLE_SECONDS", "1800")),
+        pre_ping=os.getenv("DB_POOL_PRE_PING", "true").lower() == "true",
+        wait_timeout=float(os.getenv("DB_POOL_TIMEOUT", "5")),
+        max_waiting=int(os.getenv("DB_POOL_MAX_WAITING", "64"))
+    )
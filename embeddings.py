@@ -0,0 +1,260 @@
+import argparse
+import json
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+# Service en deux temps : backbone ResNet50 (une fois par image) -> embedding 2048-d
+# stocké en float16, puis tête dense évaluée en NumPy (quelques produits matriciels).
+
+EMBEDDING_DTYPE = np.float16
+
+
+def _softmax(x):
+    x = x - np.max(x, axis=-1, keepdims=True)
+    e = np.exp(x)
+    return e / np.sum(e, axis=-1, keepdims=True)
+
+
+ACTIVATIONS = {
+    'linear': lambda x: x,
+    'relu': lambda x: np.maximum(x, 0),
+    'softmax': _softmax,
+    'sigmoid': lambda x: 1.0 / (1.0 + np.exp(-x))
+}
+
+
+class NumpyHead:
+    # Tête de classification sans TensorFlow : Dense / BatchNormalization (repliée) / Dropout ignoré
+
+    def __init__(self, ops, name='default'):
+        self.ops = ops
+        self.name = name
+
+    @classmethod
+    def from_keras_layers(cls, layers, name='default'):
+        ops = []
+        for layer in layers:
+            kind = layer.__class__.__name__
+            if kind == 'Dense':
+                w, b = layer.get_weights()
+                ops.append(('dense', w.astype(np.float32), b.astype(np.float32), layer.activation.__name__))
+            elif kind == 'BatchNormalization':
+                weights = layer.get_weights()
+                gamma = weights.pop(0) if layer.scale else 1.0
+                beta = weights.pop(0) if layer.center else 0.0
+                mean, var = weights
+                scale = (gamma / np.sqrt(var + layer.epsilon)).astype(np.float32)
+                ops.append(('affine', scale, (beta - mean * scale).astype(np.float32), 'linear'))
+            elif kind == 'Dropout':
+                continue
+            elif kind == 'Activation':
+                ops.append(('activation', None, None, layer.activation.__name__))
+            else:
+                raise ValueError(f"Couche non supportée dans la tête: {kind}")
+        return cls(ops, name)
+
+    @classmethod
+    def load(cls, path, name=None):
+        data = np.load(path, allow_pickle=False)
+        spec = json.loads(str(data['spec']))
+        ops = []
+        for i, (kind, activation) in enumerate(spec):
+            a = data[f'a{i}'] if f'a{i}' in data else None
+            b = data[f'b{i}'] if f'b{i}' in data else None
+            ops.append((kind, a, b, activation))
+        return cls(ops, name or os.path.splitext(os.path.basename(path))[0])
+
+    def save(self, path):
+        arrays = {'spec': json.dumps([[kind, activation] for kind, _, _, activation in self.ops])}
+        for i, (_, a, b, _) in enumerate(self.ops):
+            if a is not None:
+                arrays[f'a{i}'] = a
+            if b is not None:
+                arrays[f'b{i}'] = b
+        np.savez(path, **arrays)
+
+    def predict(self, embeddings):
+        x = np.asarray(embeddings, dtype=np.float32)
+        for kind, a, b, activation in self.ops:
+            if kind == 'dense':
+                x = x @ a + b
+            elif kind == 'affine':
+                x = x * a + b
+            x = ACTIVATIONS[activation](x)
+        return x
+
+
+class SplitModel:
+    # Découpe le modèle Keras (Sequential : backbone, GlobalAveragePooling2D, tête dense)
+
+    def __init__(self, keras_model):
+        from tensorflow.keras.models import Model
+
+        pool_index = None
+        for i, layer in enumerate(keras_model.layers):
+            if layer.__class__.__name__ in ('GlobalAveragePooling2D', 'GlobalMaxPooling2D'):
+                pool_index = i
+                break
+        if pool_index is None:
+            raise ValueError("Aucune couche de pooling global : modèle non découpable")
+
+        self.backbone = Model(keras_model.inputs, keras_model.layers[pool_index].output)
+        self.head = NumpyHead.from_keras_layers(keras_model.layers[pool_index + 1:])
+        self.embedding_size = int(self.backbone.output_shape[-1])
+
+    def embed(self, batch):
+        return self.backbone.predict(batch, verbose=0)
+
+    def predict(self, batch):
+        return self.head.predict(self.embed(batch))
+
+
+class EmbeddingStore:
+    # Embeddings float16 indexés par hash d'image, plus l'association image_name -> hash
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                image_hash TEXT PRIMARY KEY,
+                embedding BLOB NOT NULL
+            )
+        """)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS embedding_images (
+                image_name TEXT PRIMARY KEY,
+                image_hash TEXT NOT NULL
+            )
+        """)
+        self._db.commit()
+
+    def get(self, image_hash):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT embedding FROM embeddings WHERE image_hash = ?", (image_hash,)
+            ).fetchone()
+        if row is None:
+            return None
+        return np.frombuffer(row[0], dtype=EMBEDDING_DTYPE)
+
+    def put(self, image_hash, embedding, image_name=None):
+        # Renvoie True si image_name est nouvellement associé à ce hash
+        blob = np.asarray(embedding, dtype=EMBEDDING_DTYPE).tobytes()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR IGNORE INTO embeddings (image_hash, embedding) VALUES (?, ?)",
+                (image_hash, blob)
+            )
+            linked = self._link(image_name, image_hash) if image_name else False
+            self._db.commit()
+            return linked
+
+    def link(self, image_name, image_hash):
+        with self._lock:
+            linked = self._link(image_name, image_hash)
+            self._db.commit()
+            return linked
+
+    def _link(self, image_name, image_hash):
+        row = self._db.execute(
+            "SELECT image_hash FROM embedding_images WHERE image_name = ?", (image_name,)
+        ).fetchone()
+        if row is not None and row[0] == image_hash:
+            return False
+        self._db.execute(
+            "INSERT OR REPLACE INTO embedding_images (image_name, image_hash) VALUES (?, ?)",
+            (image_name, image_hash)
+        )
+        return True
+
+    def iter_images(self, batch_size=1024):
+        # (noms d'images, matrice float16) par blocs, pour reclasser tout l'historique
+        with self._lock:
+            rows = self._db.execute("""
+                SELECT i.image_name, e.embedding
+                FROM embedding_images i JOIN embeddings e ON e.image_hash = i.image_hash
+                ORDER BY i.image_name
+            """).fetchall()
+        for start in range(0, len(rows), batch_size):
+            chunk = rows[start:start + batch_size]
+            names = [name for name, _ in chunk]
+            matrix = np.frombuffer(b''.join(blob for _, blob in chunk), dtype=EMBEDDING_DTYPE)
+            yield names, matrix.reshape(len(chunk), -1)
+
+    def count(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+
+def load_heads(directory):
+    heads = {}
+    if directory and os.path.isdir(directory):
+        for name in sorted(os.listdir(directory)):
+            if name.endswith('.npz'):
+                head = NumpyHead.load(os.path.join(directory, name))
+                heads[head.name] = head
+    return heads
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Outils backbone/tête pour EuroSAT")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    export = sub.add_parser('export-head', help="Extrait la tête dense d'un modèle Keras en .npz")
+    export.add_argument('--model', default='resnet50_fast_model.h5')
+    export.add_argument('--output', default='heads/default.npz')
+
+    reclassify = sub.add_parser('reclassify', help="Reclasse l'historique stocké avec une tête")
+    reclassify.add_argument('--store', default='embeddings.sqlite')
+    reclassify.add_argument('--head', required=True)
+    reclassify.add_argument('--output', help="Fichier JSON lignes des nouvelles prédictions")
+    reclassify.add_argument('--registry', default=os.getenv("MODEL_REGISTRY_DIR", "models"))
+    reclassify.add_argument('--version', help="Version dont les classes nomment les sorties (défaut: version active)")
+    args = parser.parse_args()
+
+    if args.command == 'export-head':
+        from tensorflow.keras.models import load_model
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        SplitModel(load_model(args.model)).head.save(args.output)
+        print(f"Tête exportée -> {args.output}")
+        return
+
+    # Noms des classes lus dans les métadonnées de la version, comme pour le service
+    from model_registry import CLASS_NAMES, ModelRegistry
+    registry = ModelRegistry(args.registry)
+    version = args.version or registry.active_version()
+    try:
+        class_names = registry.metadata(version)['class_names'] if version else CLASS_NAMES
+    except KeyError:
+        parser.error(f"Version inconnue: {version}")
+
+    head = NumpyHead.load(args.head)
+    store = EmbeddingStore(args.store)
+    out = open(args.output, 'w') if args.output else None
+    total = 0
+    for names, matrix in store.iter_images():
+        probs = head.predict(matrix)
+        if probs.shape[-1] != len(class_names):
+            parser.error(f"La tête '{head.name}' a {probs.shape[-1]} sorties pour {len(class_names)} classes")
+        for name, row in zip(names, probs):
+            record = {
+                'image_name': name,
+                'predicted_class': class_names[int(np.argmax(row))],
+                'confidence': float(np.max(row))
+            }
+            if out:
+                out.write(json.dumps(record) + '\n')
+        total += len(names)
+    if out:
+        out.close()
+    print(f"{total} images reclassées avec la tête '{head.name}'")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+from PIL import Image
+from tensorflow.keras.applications.resnet50 import preprocess_input
+
+from inference_backends import load_backend
+
+# Exporte le modèle Keras vers TFLite / ONNX (float32, float16 ou INT8)
+# puis compare précision et latence avec le modèle d'origine.
+#
+#   python export_model.py --format tflite --quantize int8 \
+#       --calibration-dir EuroSAT_split/train --eval-dir EuroSAT_split/test
+
+INPUT_SIZE = (128, 128)
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.tif', '.tiff')
+
+
+def load_split(directory, max_samples, seed=42):
+    # Même ordre de classes que flow_from_directory (ordre alphabétique des dossiers)
+    class_names = sorted(d for d in os.listdir(directory) if os.path.isdir(os.path.join(directory, d)))
+    samples = []
+    for label, class_name in enumerate(class_names):
+        class_dir = os.path.join(directory, class_name)
+        for name in sorted(os.listdir(class_dir)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                samples.append((os.path.join(class_dir, name), label))
+
+    rng = np.random.default_rng(seed)
+    rng.shuffle(samples)
+    samples = samples[:max_samples]
+
+    images = np.empty((len(samples), INPUT_SIZE[0], INPUT_SIZE[1], 3), dtype=np.float32)
+    labels = np.empty(len(samples), dtype=np.int64)
+    for i, (path, label) in enumerate(samples):
+        img = Image.open(path).convert('RGB').resize(INPUT_SIZE, Image.NEAREST)
+        images[i] = np.asarray(img, dtype=np.float32)
+        labels[i] = label
+    return preprocess_input(images), labels
+
+
+def export_tflite(model, output_path, quantize, calibration):
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantize == 'float16':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantize == 'int8':
+        def representative_dataset():
+            for i in range(len(calibration)):
+                yield [calibration[i:i + 1]]
+
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+
+    with open(output_path, 'wb') as f:
+        f.write(converter.convert())
+
+
+def export_onnx(model, output_path, quantize, calibration):
+    import tensorflow as tf
+    import tf2onnx
+
+    spec = (tf.TensorSpec((None, INPUT_SIZE[0], INPUT_SIZE[1], 3), tf.float32, name='input'),)
+    float_path = output_path if quantize == 'none' else output_path + '.fp32'
+    tf2onnx.convert.from_keras(model, input_signature=spec, opset=13, output_path=float_path)
+
+    if quantize == 'float16':
+        import onnx
+        from onnxconverter_common import float16
+        onnx.save(float16.convert_float_to_float16(onnx.load(float_path)), output_path)
+    elif quantize == 'int8':
+        from onnxruntime.quantization import CalibrationDataReader, QuantType, quantize_static
+
+        class EuroSATReader(CalibrationDataReader):
+            def __init__(self):
+                self._iter = iter(calibration[i:i + 1] for i in range(len(calibration)))
+
+            def get_next(self):
+                batch = next(self._iter, None)
+                return None if batch is None else {'input': batch}
+
+        quantize_static(float_path, output_path, EuroSATReader(),
+                        activation_type=QuantType.QInt8, weight_type=QuantType.QInt8)
+
+    if float_path != output_path:
+        os.remove(float_path)
+
+
+def evaluate(backend, images, labels, batch_size):
+    probs = np.concatenate([backend.predict(images[i:i + batch_size]) for i in range(0, len(images), batch_size)])
+
+    # Latence par image (batch de 1), après un passage de chauffe
+    backend.predict(images[:1])
+    timings = []
+    for i in range(min(len(images), 100)):
+        start = time.perf_counter()
+        backend.predict(images[i:i + 1])
+        timings.append((time.perf_counter() - start) * 1000.0)
+
+    return probs, {
+        'accuracy': float(np.mean(np.argmax(probs, axis=1) == labels)),
+        'latency_ms_mean': float(np.mean(timings)),
+        'latency_ms_p95': float(np.percentile(timings, 95))
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export du modèle EuroSAT vers un runtime léger")
+    parser.add_argument('--model', default='resnet50_fast_model.h5')
+    parser.add_argument('--format', choices=['tflite', 'onnx'], default='tflite')
+    parser.add_argument('--quantize', choices=['none', 'float16', 'int8'], default='none')
+    parser.add_argument('--output', help="Chemin de sortie (défaut: <modèle>[_<quantize>].<format>)")
+    parser.add_argument('--calibration-dir', help="Dossier d'images par classe pour la calibration INT8")
+    parser.add_argument('--calibration-samples', type=int, default=200)
+    parser.add_argument('--eval-dir', help="Dossier de test par classe pour comparer au modèle Keras")
+    parser.add_argument('--eval-samples', type=int, default=1000)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--report', help="Fichier JSON du rapport de comparaison")
+    args = parser.parse_args()
+
+    if args.quantize == 'int8' and not args.calibration_dir:
+        parser.error("--calibration-dir est requis pour la quantification INT8")
+
+    output = args.output
+    if not output:
+        suffix = '' if args.quantize == 'none' else f'_{args.quantize}'
+        output = f"{os.path.splitext(args.model)[0]}{suffix}.{args.format}"
+
+    keras_backend = load_backend('keras', args.model)
+    calibration = None
+    if args.calibration_dir:
+        calibration, _ = load_split(args.calibration_dir, args.calibration_samples)
+
+    print(f"Export {args.format} ({args.quantize}) -> {output}")
+    if args.format == 'tflite':
+        export_tflite(keras_backend.model, output, args.quantize, calibration)
+    else:
+        export_onnx(keras_backend.model, output, args.quantize, calibration)
+    print(f"Taille: {os.path.getsize(args.model) / 1e6:.1f} Mo -> {os.path.getsize(output) / 1e6:.1f} Mo")
+
+    if not args.eval_dir:
+        return
+
+    images, labels = load_split(args.eval_dir, args.eval_samples)
+    keras_probs, keras_metrics = evaluate(keras_backend, images, labels, args.batch_size)
+    exported_probs, exported_metrics = evaluate(load_backend(args.format, output), images, labels, args.batch_size)
+
+    report = {
+        'format': args.format,
+        'quantize': args.quantize,
+        'output': output,
+        'samples': int(len(labels)),
+        'keras': keras_metrics,
+        'exported': exported_metrics,
+        'accuracy_delta': exported_metrics['accuracy'] - keras_metrics['accuracy'],
+        'top1_agreement': float(np.mean(np.argmax(keras_probs, axis=1) == np.argmax(exported_probs, axis=1))),
+        'speedup': keras_metrics['latency_ms_mean'] / exported_metrics['latency_ms_mean']
+    }
+
+    print(f"Précision Keras   : {keras_metrics['accuracy']:.4f} • {keras_metrics['latency_ms_mean']:.2f} ms/image")
+    print(f"Précision exportée: {exported_metrics['accuracy']:.4f} • {exported_metrics['latency_ms_mean']:.2f} ms/image")
+    print(f"Delta précision   : {report['accuracy_delta']:+.4f} • accord top-1: {report['top1_agreement']:.4f} • accélération x{report['speedup']:.2f}")
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
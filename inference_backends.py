@@ -0,0 +1,106 @@
+import os
+import threading
+
+import numpy as np
+
+BACKEND_EXTENSIONS = {
+    'keras': '.h5',
+    'tflite': '.tflite',
+    'onnx': '.onnx'
+}
+
+
+class KerasBackend:
+    name = 'keras'
+
+    def __init__(self, path):
+        from tensorflow.keras.models import load_model
+        self.path = path
+        self.model = load_model(path)
+
+    def predict(self, batch):
+        return self.model.predict(batch, verbose=0)
+
+
+class TFLiteBackend:
+    name = 'tflite'
+
+    def __init__(self, path, num_threads=None):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            from tensorflow.lite import Interpreter
+        self.path = path
+        self.interpreter = Interpreter(model_path=path, num_threads=num_threads or os.cpu_count())
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch_size = int(self._input['shape'][0])
+        # L'interpréteur n'est pas réentrant
+        self._lock = threading.Lock()
+
+    def _quantize(self, batch):
+        scale, zero_point = self._input['quantization']
+        if self._input['dtype'] in (np.int8, np.uint8) and scale:
+            info = np.iinfo(self._input['dtype'])
+            batch = np.clip(np.round(batch / scale + zero_point), info.min, info.max)
+        return batch.astype(self._input['dtype'])
+
+    def _dequantize(self, output):
+        scale, zero_point = self._output['quantization']
+        if self._output['dtype'] in (np.int8, np.uint8) and scale:
+            return (output.astype(np.float32) - zero_point) * scale
+        return output.astype(np.float32)
+
+    def predict(self, batch):
+        with self._lock:
+            if batch.shape[0] != self._batch_size:
+                self.interpreter.resize_tensor_input(self._input['index'], batch.shape)
+                self.interpreter.allocate_tensors()
+                self._input = self.interpreter.get_input_details()[0]
+                self._output = self.interpreter.get_output_details()[0]
+                self._batch_size = batch.shape[0]
+            self.interpreter.set_tensor(self._input['index'], self._quantize(batch))
+            self.interpreter.invoke()
+            return self._dequantize(self.interpreter.get_tensor(self._output['index']))
+
+
+class OnnxBackend:
+    name = 'onnx'
+
+    def __init__(self, path, num_threads=None):
+        import onnxruntime as ort
+        self.path = path
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self._input = self.session.get_inputs()[0]
+        self._dtype = np.float16 if self._input.type == 'tensor(float16)' else np.float32
+
+    def predict(self, batch):
+        outputs = self.session.run(None, {self._input.name: batch.astype(self._dtype)})
+        return outputs[0].astype(np.float32)
+
+
+BACKENDS = {
+    'keras': KerasBackend,
+    'tflite': TFLiteBackend,
+    'onnx': OnnxBackend
+}
+
+
+def default_model_path(backend, keras_path):
+    if backend == 'keras':
+        return keras_path
+    return os.path.splitext(keras_path)[0] + BACKEND_EXTENSIONS[backend]
+
+
+def load_backend(name, path, num_threads=None):
+    name = (name or 'keras').lower()
+    if name not in BACKENDS:
+        raise ValueError(f"Backend d'inférence inconnu: {name} (choix: {', '.join(BACKENDS)})")
+    if name == 'keras':
+        return KerasBackend(path)
+    return BACKENDS[name](path, num_threads=num_threads)
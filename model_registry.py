@@ -0,0 +1,267 @@
+import argparse
+import gc
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+
+from inference_backends import BACKEND_EXTENSIONS
+
+# Registre de modèles versionnés, partagé entre workers :
+#   models/<version>/model.<ext>       artefact (.h5, .tflite ou .onnx)
+#   models/<version>/metadata.json     classes, taille d'entrée, prétraitement, backend
+#   models/ACTIVE                      version servie (les autres workers la suivent)
+#
+#   python model_registry.py register --model resnet50_v2.h5 --version v2
+#   python model_registry.py activate v2
+
+CLASS_NAMES = ['AnnualCrop', 'Forest', 'HerbaceousVegetation', 'Highway', 'Industrial',
+               'Pasture', 'PermanentCrop', 'Residential', 'River', 'SeaLake']
+
+# Seul prétraitement implémenté par LocalModel (resnet50.preprocess_input, mode caffe)
+PREPROCESSING = ('resnet50',)
+
+
+class ModelRegistry:
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._active_path = os.path.join(directory, 'ACTIVE')
+
+    def versions(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(
+            name for name in os.listdir(self.directory)
+            if os.path.exists(os.path.join(self.directory, name, 'metadata.json'))
+        )
+
+    def metadata(self, version):
+        path = os.path.join(self.directory, version, 'metadata.json')
+        if not os.path.exists(path):
+            raise KeyError(version)
+        with open(path) as f:
+            return json.load(f)
+
+    def artifact_path(self, version):
+        return os.path.join(self.directory, version, self.metadata(version)['model_file'])
+
+    def active_version(self):
+        try:
+            with open(self._active_path) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def set_active(self, version):
+        self.metadata(version)
+        tmp_path = self._active_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(version)
+        os.replace(tmp_path, self._active_path)
+
+    def register(self, model_path, version, backend='keras', class_names=None,
+                 input_size=(128, 128), preprocessing='resnet50', embedding_version=None, notes=''):
+        if backend not in BACKEND_EXTENSIONS:
+            raise ValueError(f"Backend inconnu: {backend}")
+        if preprocessing not in PREPROCESSING:
+            raise ValueError(f"Prétraitement non supporté: {preprocessing}")
+        version_dir = os.path.join(self.directory, version)
+        if os.path.exists(version_dir):
+            raise ValueError(f"La version {version} existe déjà")
+
+        # Copie dans un dossier temporaire puis renommage : une version visible est complète
+        tmp_dir = version_dir + '.tmp'
+        os.makedirs(tmp_dir, exist_ok=True)
+        model_file = 'model' + BACKEND_EXTENSIONS[backend]
+        shutil.copyfile(model_path, os.path.join(tmp_dir, model_file))
+        metadata = {
+            'version': version,
+            'backend': backend,
+            'model_file': model_file,
+            'class_names': list(class_names or CLASS_NAMES),
+            'input_size': list(input_size),
+            'preprocessing': preprocessing,
+            'source': os.path.basename(model_path),
+            'notes': notes,
+            'created_at': datetime.now().isoformat()
+        }
+        if embedding_version:
+            # Backbone ré-entraîné : les embeddings stockés ne sont plus comparables
+            metadata['embedding_version'] = embedding_version
+        with open(os.path.join(tmp_dir, 'metadata.json'), 'w') as f:
+            json.dump(metadata, f, indent=2)
+        os.replace(tmp_dir, version_dir)
+        return metadata
+
+
+class ServedModel:
+    # Une version chargée et chauffée, avec le nombre de requêtes qui l'utilisent encore.
+    # Une fois remplacée, elle est libérée dès que la dernière requête se termine.
+
+    def __init__(self, version, model, metadata, heads=None):
+        self.version = version
+        self.model = model
+        self.metadata = metadata
+        self.class_names = metadata['class_names']
+        self.heads = heads or {}
+        self.split = model.split
+        self.loaded_at = time.time()
+        self._lock = threading.Lock()
+        self._refs = 0
+        self._retired = False
+        self.freed = threading.Event()
+
+    def _acquire(self):
+        with self._lock:
+            self._refs += 1
+
+    def release(self):
+        with self._lock:
+            self._refs -= 1
+            free = self._retired and self._refs == 0
+        if free:
+            self._free()
+
+    def retire(self):
+        with self._lock:
+            self._retired = True
+            free = self._refs == 0
+        if free:
+            self._free()
+
+    @property
+    def in_flight(self):
+        return self._refs
+
+    def _free(self):
+        try:
+            self.model.close()
+        except Exception as e:
+            print(f"Erreur lors de la libération du modèle {self.version}: {e}")
+        self.model = None
+        self.heads = {}
+        gc.collect()
+        self.freed.set()
+        print(f"Modèle {self.version} drainé et libéré")
+
+
+class ModelSlot:
+    # Version servie : l'échange est atomique, les requêtes en cours gardent leur version
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._current = None
+        self._draining = []
+        self.loading = None
+        self.last_error = None
+        # Dernière version dont le chargement a échoué (non retentée par le suivi du registre)
+        self.failed_version = None
+
+    @property
+    def current(self):
+        return self._current
+
+    def acquire(self):
+        with self._lock:
+            served = self._current
+            if served is not None:
+                served._acquire()
+            return served
+
+    def activate(self, served):
+        with self._lock:
+            previous, self._current = self._current, served
+            if previous is not None:
+                self._draining.append(previous)
+        # Plus aucune nouvelle requête ne peut réserver l'ancienne version
+        if previous is not None:
+            previous.retire()
+        return previous
+
+    def load_in_background(self, version, load_fn, on_ready=None):
+        # load_fn(version) doit renvoyer un ServedModel déjà chauffé
+        with self._lock:
+            if self.loading is not None:
+                return False
+            self.loading = version
+            self.last_error = None
+
+        def run():
+            try:
+                served = load_fn(version)
+                self.activate(served)
+                self.failed_version = None
+                print(f"Trafic basculé sur le modèle {served.version}")
+                if on_ready is not None:
+                    on_ready(served)
+            except Exception as e:
+                print(f"Erreur lors du chargement du modèle {version}: {e}")
+                self.last_error = str(e)
+                self.failed_version = version
+            finally:
+                self.loading = None
+
+        threading.Thread(target=run, name=f"model-loader-{version}", daemon=True).start()
+        return True
+
+    def state(self):
+        with self._lock:
+            self._draining = [served for served in self._draining if not served.freed.is_set()]
+            current = self._current
+            return {
+                'active': current.version if current is not None else None,
+                'loading': self.loading,
+                'error': self.last_error,
+                'failed_version': self.failed_version,
+                'draining': [{'version': served.version, 'in_flight': served.in_flight}
+                             for served in self._draining]
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Registre des versions du modèle EuroSAT")
+    parser.add_argument('--registry', default=os.getenv("MODEL_REGISTRY_DIR", "models"))
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    register = sub.add_parser('register', help="Ajoute un artefact au registre")
+    register.add_argument('--model', required=True)
+    register.add_argument('--version', required=True)
+    register.add_argument('--backend', default='keras', choices=sorted(BACKEND_EXTENSIONS))
+    register.add_argument('--classes', help="Classes séparées par des virgules (défaut: EuroSAT)")
+    register.add_argument('--input-size', type=int, default=128)
+    register.add_argument('--embedding-version', help="À renseigner si le backbone a été ré-entraîné")
+    register.add_argument('--notes', default='')
+
+    activate = sub.add_parser('activate', help="Bascule les workers sur une version")
+    activate.add_argument('version')
+
+    sub.add_parser('list', help="Liste les versions enregistrées")
+    args = parser.parse_args()
+
+    registry = ModelRegistry(args.registry)
+    if args.command == 'register':
+        metadata = registry.register(
+            args.model, args.version, backend=args.backend,
+            class_names=args.classes.split(',') if args.classes else None,
+            input_size=(args.input_size, args.input_size),
+            embedding_version=args.embedding_version, notes=args.notes)
+        print(f"Version {metadata['version']} enregistrée ({metadata['backend']}, {len(metadata['class_names'])} classes)")
+    elif args.command == 'activate':
+        try:
+            registry.set_active(args.version)
+        except KeyError:
+            parser.error(f"Version inconnue: {args.version}")
+        print(f"Version active: {args.version}")
+    else:
+        active = registry.active_version()
+        for version in registry.versions():
+            metadata = registry.metadata(version)
+            marker = '*' if version == active else ' '
+            print(f"{marker} {version}  {metadata['backend']:6}  {metadata['created_at']}  {metadata.get('notes', '')}")
+
+
+if __name__ == '__main__':
+    main()
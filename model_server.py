@@ -0,0 +1,358 @@
+import argparse
+import io
+import json
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+import numpy as np
+
+from batching import BatchingEngine
+from inference_backends import load_backend, default_model_path
+from prediction_cache import model_version_from_path
+
+# Serveur d'inférence local : un seul processus possède TensorFlow et les poids, les
+# workers Flask / Streamlit lui envoient des tuiles uint8 par socket Unix (ou TCP host:port).
+#
+# Trame : magic 'ESAT' | op (u8) | dtype (u8) | ndim (u8) | dims (ndim x u32) | données brutes
+# Les réponses reprennent le même format ; OP_ERROR porte un message UTF-8.
+
+MAGIC = b'ESAT'
+HEADER = struct.Struct('<4sBBB')
+
+OP_RUN = 1
+OP_INFO = 2
+OP_STATS = 3
+OP_HEAD = 4
+OP_ERROR = 255
+
+DTYPES = {0: np.uint8, 1: np.float32, 2: np.float16, 3: np.int32}
+DTYPE_CODES = {np.dtype(v): k for k, v in DTYPES.items()}
+
+
+class ModelServerError(Exception):
+    pass
+
+
+def _recv_exact(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("Connexion fermée par le serveur d'inférence")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def send_frame(sock, op, array):
+    array = np.ascontiguousarray(array)
+    header = HEADER.pack(MAGIC, op, DTYPE_CODES[array.dtype], array.ndim)
+    dims = struct.pack(f'<{array.ndim}I', *array.shape)
+    sock.sendall(header + dims + array.tobytes())
+
+
+def recv_frame(sock):
+    magic, op, dtype_code, ndim = HEADER.unpack(_recv_exact(sock, HEADER.size))
+    if magic != MAGIC:
+        raise ModelServerError("Trame invalide")
+    if dtype_code not in DTYPES:
+        raise ModelServerError(f"Type de données inconnu: {dtype_code}")
+    shape = struct.unpack(f'<{ndim}I', _recv_exact(sock, 4 * ndim)) if ndim else ()
+    dtype = np.dtype(DTYPES[dtype_code])
+    size = int(np.prod(shape)) * dtype.itemsize if ndim else 0
+    return op, np.frombuffer(_recv_exact(sock, size), dtype=dtype).reshape(shape)
+
+
+def _bytes_array(data):
+    return np.frombuffer(data, dtype=np.uint8)
+
+
+def _parse_address(address):
+    # "host:port" -> TCP, sinon chemin de socket Unix
+    if ':' in address and not address.startswith('/'):
+        host, port = address.rsplit(':', 1)
+        return socket.AF_INET, (host, int(port))
+    return socket.AF_UNIX, address
+
+
+class LocalModel:
+    # Modèle chargé dans le processus courant derrière le moteur de micro-batching.
+    # Reçoit des tuiles uint8 (N, 128, 128, 3) ; en mode découpé renvoie les embeddings.
+
+    def __init__(self, backend_name, model_path, split=True, max_batch_size=16, max_wait_ms=8):
+        # Durées par phase (secondes), exposées dans le rapport de démarrage
+        self.timings = {}
+        started = time.perf_counter()
+        from tensorflow.keras.applications.resnet50 import preprocess_input
+        self.timings['imports'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        self.backend = load_backend(backend_name, model_path)
+        self.model_path = model_path
+        self.split_model = None
+        if split and backend_name == 'keras':
+            from embeddings import SplitModel
+            try:
+                self.split_model = SplitModel(self.backend.model)
+            except ValueError as e:
+                print(f"Service backbone/tête désactivé: {e}")
+
+        self.timings['weight_load'] = time.perf_counter() - started
+
+        run = self.split_model.embed if self.split_model is not None else self.backend.predict
+        self.engine = BatchingEngine(
+            lambda batch: run(preprocess_input(batch.astype(np.float32))),
+            max_batch_size=max_batch_size,
+            max_wait_ms=max_wait_ms
+        )
+
+    @property
+    def split(self):
+        return self.split_model is not None
+
+    @property
+    def head(self):
+        return self.split_model.head if self.split_model is not None else None
+
+    @property
+    def embedding_size(self):
+        return self.split_model.embedding_size if self.split_model is not None else None
+
+    def predict(self, img_array):
+        return self.engine.predict(img_array)
+
+    def run_batch(self, batch):
+        return self.engine.run_batch(batch)
+
+    def classify(self, batch):
+        outputs = self.run_batch(batch)
+        return self.head.predict(outputs) if self.split else outputs
+
+    def warm_up(self, batch_sizes, input_size=(128, 128)):
+        # Passages synthétiques pour tracer le graphe aux tailles de batch courantes
+        for i, size in enumerate(sorted(set(batch_sizes))):
+            started = time.perf_counter()
+            self.run_batch(np.zeros((size, input_size[0], input_size[1], 3), dtype=np.uint8))
+            elapsed = time.perf_counter() - started
+            self.timings['first_inference' if i == 0 else f'warm_up_batch_{size}'] = elapsed
+
+    def stats(self):
+        return self.engine.stats()
+
+    def close(self):
+        # Arrête le planificateur et lâche les poids (remplacement à chaud d'une version)
+        self.engine.close()
+        self.split_model = None
+        self.backend = None
+
+    def info(self):
+        return {
+            'split': self.split,
+            'embedding_size': self.embedding_size,
+            'backend': self.backend.name,
+            'model_path': self.model_path,
+            'model_version': model_version_from_path(self.model_path),
+            'pid': os.getpid()
+        }
+
+
+class RemoteModel:
+    # Client du serveur d'inférence, même interface que LocalModel.
+    # Une connexion persistante par thread appelant.
+
+    def __init__(self, address, timeout=60):
+        self.address = address
+        self.timeout = timeout
+        self._local = threading.local()
+        self.timings = {}
+        started = time.perf_counter()
+        self._info = self._call_json(OP_INFO)
+        self.timings['connect'] = time.perf_counter() - started
+        self._head = None
+        if self._info['split']:
+            from embeddings import NumpyHead
+            data = self._call(OP_HEAD, np.empty(0, dtype=np.uint8))
+            self._head = NumpyHead.load(io.BytesIO(data.tobytes()), name='default')
+
+    def _socket(self):
+        sock = getattr(self._local, 'sock', None)
+        if sock is None:
+            family, addr = _parse_address(self.address)
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(addr)
+            self._local.sock = sock
+        return sock
+
+    def _call(self, op, array):
+        try:
+            sock = self._socket()
+            send_frame(sock, op, array)
+            reply_op, reply = recv_frame(sock)
+        except (OSError, ConnectionError, ModelServerError):
+            # Connexion cassée (redémarrage du serveur) ou trame illisible : on la rouvre au prochain appel
+            sock = getattr(self._local, 'sock', None)
+            if sock is not None:
+                sock.close()
+            self._local.sock = None
+            raise
+        if reply_op == OP_ERROR:
+            raise ModelServerError(reply.tobytes().decode('utf-8'))
+        return reply
+
+    def _call_json(self, op):
+        return json.loads(self._call(op, np.empty(0, dtype=np.uint8)).tobytes().decode('utf-8'))
+
+    @property
+    def split(self):
+        return self._info['split']
+
+    @property
+    def head(self):
+        return self._head
+
+    @property
+    def embedding_size(self):
+        return self._info['embedding_size']
+
+    def predict(self, img_array):
+        return self.run_batch(np.expand_dims(img_array, axis=0))[0]
+
+    def run_batch(self, batch):
+        return self._call(OP_RUN, np.asarray(batch, dtype=np.uint8))
+
+    def classify(self, batch):
+        outputs = self.run_batch(batch)
+        return self._head.predict(outputs) if self.split else outputs
+
+    def warm_up(self, batch_sizes, input_size=(128, 128)):
+        # Le serveur est déjà chaud : on ne mesure que l'aller-retour
+        started = time.perf_counter()
+        self.run_batch(np.zeros((1, input_size[0], input_size[1], 3), dtype=np.uint8))
+        self.timings['first_inference'] = time.perf_counter() - started
+
+    def stats(self):
+        stats = self._call_json(OP_STATS)
+        stats['server'] = self.address
+        return stats
+
+    def info(self):
+        return dict(self._info)
+
+    def close(self):
+        sock = getattr(self._local, 'sock', None)
+        if sock is not None:
+            sock.close()
+            self._local.sock = None
+
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        model = self.server.model
+        while True:
+            try:
+                op, array = recv_frame(self.request)
+            except (ConnectionError, OSError):
+                return
+            except ModelServerError as e:
+                # Taille des données inconnue : le flux est désynchronisé, on répond puis on ferme
+                print(f"Erreur serveur d'inférence: {e}")
+                try:
+                    send_frame(self.request, OP_ERROR, _bytes_array(str(e).encode('utf-8')))
+                except OSError:
+                    pass
+                return
+            try:
+                if op == OP_RUN:
+                    # Une requête d'une seule tuile passe par le planificateur de batches
+                    if array.shape[0] == 1:
+                        reply = model.predict(array[0])[np.newaxis]
+                    else:
+                        reply = model.run_batch(array)
+                    send_frame(self.request, OP_RUN, np.asarray(reply, dtype=np.float32))
+                elif op == OP_INFO:
+                    send_frame(self.request, op, _bytes_array(json.dumps(model.info()).encode('utf-8')))
+                elif op == OP_STATS:
+                    send_frame(self.request, op, _bytes_array(json.dumps(model.stats()).encode('utf-8')))
+                elif op == OP_HEAD:
+                    buffer = io.BytesIO()
+                    model.head.save(buffer)
+                    send_frame(self.request, op, _bytes_array(buffer.getvalue()))
+                else:
+                    raise ModelServerError(f"Opération inconnue: {op}")
+            except Exception as e:
+                print(f"Erreur serveur d'inférence: {e}")
+                send_frame(self.request, OP_ERROR, _bytes_array(str(e).encode('utf-8')))
+
+
+class _ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(address, model):
+    family, addr = _parse_address(address)
+    if family == socket.AF_UNIX:
+        if os.path.exists(addr):
+            os.remove(addr)
+        server = _ThreadingUnixServer(addr, _RequestHandler)
+    else:
+        server = _ThreadingTCPServer(addr, _RequestHandler)
+    server.model = model
+    print(f"Serveur d'inférence prêt sur {address} (pid {os.getpid()})")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if family == socket.AF_UNIX and os.path.exists(addr):
+            os.remove(addr)
+
+
+def _parse_cpus(value):
+    cpus = set()
+    for part in value.split(','):
+        if '-' in part:
+            start, end = part.split('-')
+            cpus.update(range(int(start), int(end) + 1))
+        elif part:
+            cpus.add(int(part))
+    return cpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serveur d'inférence EuroSAT partagé par les front-ends")
+    parser.add_argument('--address', default=os.getenv("MODEL_SERVER_ADDRESS", "/tmp/eurosat-model.sock"),
+                        help="Chemin de socket Unix ou host:port")
+    parser.add_argument('--backend', default=os.getenv("INFERENCE_BACKEND", "keras"))
+    parser.add_argument('--model', default=os.getenv("INFERENCE_MODEL_PATH", ""))
+    parser.add_argument('--no-split', action='store_true', help="Renvoie les probabilités au lieu des embeddings")
+    parser.add_argument('--max-batch-size', type=int, default=int(os.getenv("BATCH_MAX_SIZE", "16")))
+    parser.add_argument('--max-wait-ms', type=float, default=float(os.getenv("BATCH_MAX_WAIT_MS", "8")))
+    parser.add_argument('--cpus', help="Cœurs réservés au serveur, ex. 0-3")
+    args = parser.parse_args()
+
+    if args.cpus and hasattr(os, 'sched_setaffinity'):
+        cpus = _parse_cpus(args.cpus)
+        os.sched_setaffinity(0, cpus)
+        os.environ.setdefault('TF_NUM_INTRAOP_THREADS', str(len(cpus)))
+        os.environ.setdefault('OMP_NUM_THREADS', str(len(cpus)))
+
+    model_path = args.model or default_model_path(args.backend, "resnet50_fast_model.h5")
+    model = LocalModel(args.backend, model_path, split=not args.no_split,
+                       max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms)
+    model.warm_up([1, args.max_batch_size])
+    print("Démarrage: " + ", ".join(f"{phase}={seconds:.2f}s" for phase, seconds in model.timings.items()))
+    serve(args.address, model)
+
+
+if __name__ == '__main__':
+    main()
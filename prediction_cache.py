@@ -0,0 +1,112 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def model_version_from_path(path):
+    # Version dérivée du fichier de poids : change à chaque nouveau checkpoint
+    try:
+        st = os.stat(path)
+        return f"{os.path.basename(path)}:{int(st.st_mtime)}:{st.st_size}"
+    except OSError:
+        return os.path.basename(path)
+
+
+def image_cache_key(img_array, model_version):
+    img_array = np.ascontiguousarray(img_array, dtype=np.uint8)
+    h = hashlib.sha256()
+    h.update(model_version.encode('utf-8'))
+    h.update(str(img_array.shape).encode('ascii'))
+    h.update(img_array.tobytes())
+    return h.hexdigest()
+
+
+class PredictionCache:
+    # Cache à deux niveaux : LRU en mémoire + table SQLite optionnelle qui survit aux redémarrages
+
+    def __init__(self, max_entries=10000, persistent_path=None):
+        self.max_entries = max(0, int(max_entries))
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._persistent_hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+        self._db = None
+        if persistent_path:
+            self._db = sqlite3.connect(persistent_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS prediction_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    class_index INTEGER NOT NULL,
+                    confidence REAL NOT NULL,
+                    probabilities BLOB NOT NULL
+                )
+            """)
+            self._db.commit()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return entry
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT class_index, confidence, probabilities FROM prediction_cache WHERE cache_key = ?",
+                    (key,)
+                ).fetchone()
+                if row is not None:
+                    entry = (row[0], row[1], np.frombuffer(row[2], dtype=np.float32).copy())
+                    self._store(key, entry)
+                    self._persistent_hits += 1
+                    return entry
+
+            self._misses += 1
+            return None
+
+    def put(self, key, pred_class, confidence, probabilities):
+        probabilities = np.asarray(probabilities, dtype=np.float32)
+        entry = (int(pred_class), float(confidence), probabilities)
+        with self._lock:
+            self._store(key, entry)
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO prediction_cache (cache_key, class_index, confidence, probabilities) VALUES (?, ?, ?, ?)",
+                        (key, entry[0], entry[1], probabilities.tobytes())
+                    )
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    print(f"Erreur écriture cache de prédictions: {e}")
+
+    def _store(self, key, entry):
+        if self.max_entries == 0:
+            return
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._persistent_hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'persistent': self._db is not None,
+                'hits': self._hits,
+                'persistent_hits': self._persistent_hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'hit_rate': round((self._hits + self._persistent_hits) / lookups, 4) if lookups else 0.0
+            }
@@ -0,0 +1,124 @@
+import numpy as np
+
+# Vecteur softmax complet stocké avec chaque prédiction (colonne predictions.probabilities) :
+# float16 petit-boutiste, 2 octets par classe, soit 20 octets pour les 10 classes EuroSAT.
+# La précision du float16 (~1e-3 autour de 1) suffit pour le top-k, la marge et l'entropie.
+#
+# Les mesures sont calculées sur la matrice (lignes, classes) obtenue en décodant tous les
+# blobs d'une page d'un coup, jamais ligne par ligne.
+
+PROBABILITY_DTYPE = np.dtype('<f2')
+TOP_K = 3
+
+
+def encode_probabilities(vector):
+    if vector is None:
+        return None
+    return np.asarray(vector, dtype=np.float32).ravel().astype(PROBABILITY_DTYPE).tobytes()
+
+
+def decode_probabilities(blobs, n_classes):
+    # Renvoie (matrice float32 (lignes valides, n_classes), masque des lignes décodées).
+    # Un blob absent (prédiction antérieure) ou d'une autre largeur (autre jeu de classes)
+    # est écarté par le masque.
+    width = n_classes * PROBABILITY_DTYPE.itemsize
+    mask = np.array([blob is not None and len(blob) == width for blob in blobs], dtype=bool)
+    data = b''.join(bytes(blob) for blob, ok in zip(blobs, mask) if ok)
+    matrix = np.frombuffer(data, dtype=PROBABILITY_DTYPE).reshape(-1, n_classes).astype(np.float32)
+    return matrix, mask
+
+
+def uncertainty(matrix):
+    # Classes triées par probabilité, marge top1 - top2 et entropie normalisée (0 = certain,
+    # 1 = uniforme) pour toutes les lignes
+    if len(matrix):
+        matrix = matrix / np.maximum(matrix.sum(axis=1, keepdims=True), 1e-12)
+    order = np.argsort(-matrix, axis=1, kind='stable')
+    ranked = np.take_along_axis(matrix, order, axis=1)
+    margin = ranked[:, 0] - ranked[:, 1]
+    entropy = -(matrix * np.log(np.clip(matrix, 1e-12, 1.0))).sum(axis=1) / np.log(matrix.shape[1])
+    return order, ranked, margin, entropy
+
+
+def probability_fields(order, ranked, margin, entropy, class_names, k=TOP_K):
+    # Champs API d'une ligne de la matrice
+    return {
+        'top_k': [
+            {'class': class_names[index], 'confidence': round(float(p) * 100, 2)}
+            for index, p in zip(order[:k], ranked[:k])
+        ],
+        'margin': round(float(margin) * 100, 2),
+        'entropy': round(float(entropy), 4)
+    }
+
+
+def describe_vector(vector, class_names, k=TOP_K):
+    order, ranked, margin, entropy = uncertainty(np.asarray(vector, dtype=np.float32).reshape(1, -1))
+    return probability_fields(order[0], ranked[0], margin[0], entropy[0], class_names, k)
+
+
+def annotate_rows(rows, class_names, k=TOP_K):
+    # Ajoute top_k / margin / entropy aux lignes d'historique et retire le blob brut
+    matrix, mask = decode_probabilities([row.get('probabilities') for row in rows], len(class_names))
+    order, ranked, margin, entropy = uncertainty(matrix)
+    decoded = iter(range(len(matrix)))
+    for row, ok in zip(rows, mask):
+        row.pop('probabilities', None)
+        if ok:
+            i = next(decoded)
+            row.update(probability_fields(order[i], ranked[i], margin[i], entropy[i], class_names, k))
+    return rows
+
+
+def filter_uncertain(rows, class_names, max_margin=None, min_entropy=None, max_confidence=None,
+                     second_class=None, k=TOP_K):
+    # Sélection vectorisée : un masque booléen par critère, combinés sur toute la matrice.
+    # Renvoie les lignes retenues (ordre d'entrée conservé), annotées.
+    matrix, mask = decode_probabilities([row.get('probabilities') for row in rows], len(class_names))
+    candidates = [row for row, ok in zip(rows, mask) if ok]
+    order, ranked, margin, entropy = uncertainty(matrix)
+
+    keep = np.ones(len(matrix), dtype=bool)
+    if max_margin is not None:
+        keep &= margin <= max_margin
+    if min_entropy is not None:
+        keep &= entropy >= min_entropy
+    if max_confidence is not None:
+        keep &= ranked[:, 0] <= max_confidence
+    if second_class is not None:
+        keep &= order[:, 1] == class_names.index(second_class)
+
+    selected = []
+    for i in np.flatnonzero(keep):
+        row = candidates[i]
+        row.pop('probabilities', None)
+        row.update(probability_fields(order[i], ranked[i], margin[i], entropy[i], class_names, k))
+        selected.append(row)
+    return selected
+
+
+def uncertainty_summary(rows, class_names, margin_threshold=0.2, bins=10, top_pairs=10):
+    # Vue d'ensemble : histogrammes marge (en %) / entropie et paires (1er choix, 2e choix)
+    # les plus fréquentes parmi les prédictions à faible marge
+    matrix, _ = decode_probabilities([row.get('probabilities') for row in rows], len(class_names))
+    order, _, margin, entropy = uncertainty(matrix)
+    edges = np.linspace(0.0, 1.0, bins + 1)
+
+    low = margin < margin_threshold
+    n = len(class_names)
+    codes, counts = np.unique(order[low, 0] * n + order[low, 1], return_counts=True)
+    ranking = np.argsort(-counts, kind='stable')[:top_pairs]
+
+    return {
+        'analysed': int(len(matrix)),
+        'low_margin': int(low.sum()),
+        'margin_threshold': round(margin_threshold * 100, 2),
+        'mean_margin': round(float(margin.mean()) * 100, 2) if len(matrix) else None,
+        'mean_entropy': round(float(entropy.mean()), 4) if len(matrix) else None,
+        'margin_histogram': {'edges': (edges * 100).round(1).tolist(), 'counts': np.histogram(margin, edges)[0].tolist()},
+        'entropy_histogram': {'edges': edges.round(2).tolist(), 'counts': np.histogram(entropy, edges)[0].tolist()},
+        'confusions': [
+            {'first': class_names[int(codes[i]) // n], 'second': class_names[int(codes[i]) % n], 'count': int(counts[i])}
+            for i in ranking
+        ]
+    }
@@ -0,0 +1,256 @@
+import json
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from datetime import date, datetime
+from decimal import Decimal
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Cache en lecture des pages d'historique et des statistiques par utilisateur.
+#
+# Invalidation par génération : chaque clé contient la génération courante de
+# l'utilisateur, une insertion incrémente cette génération (après le COMMIT) et les
+# anciennes entrées ne sont plus jamais lues ; elles sortent du LRU ou expirent.
+# Une lecture lancée avant l'insertion range son résultat sous l'ancienne génération :
+# pas de fenêtre où une page périmée serait servie comme fraîche.
+#
+# Niveaux : LRU en mémoire avec TTL, puis backend partagé optionnel (READ_CACHE_URL,
+# Redis) qui porte aussi les générations, pour que l'insertion faite par un worker
+# invalide les caches de tous. Sans backend partagé, un autre worker peut servir une
+# page périmée au plus READ_CACHE_TTL secondes ; celui qui a inséré la voit tout de suite.
+# READ_CACHE_URL=local remplace Redis par LocalBackend (même interface, en mémoire).
+# Générations lues dans le backend partagé gardées localement READ_CACHE_GENERATION_TTL
+# secondes (défaut 1) : un GET de moins par lecture, une insertion d'un autre worker est
+# vue au plus tard après ce délai.
+#
+# Valeurs sérialisées en JSON (listes, dicts, nombres, dates) : jamais de pickle sur des
+# octets lus dans un Redis partagé. Les tuples reviennent en listes.
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, date):
+        return {'__date__': value.isoformat()}
+    if isinstance(value, Decimal):
+        return float(value)
+    if hasattr(value, 'item'):
+        # Scalaires numpy
+        return value.item()
+    raise TypeError(f"Valeur non sérialisable en cache: {type(value).__name__}")
+
+
+def _decode(obj):
+    if '__datetime__' in obj:
+        return datetime.fromisoformat(obj['__datetime__'])
+    if '__date__' in obj:
+        return date.fromisoformat(obj['__date__'])
+    return obj
+
+
+def dumps(value):
+    return json.dumps(value, default=_encode, separators=(',', ':')).encode('utf-8')
+
+
+def loads(payload):
+    return json.loads(payload, object_hook=_decode)
+
+
+class LocalBackend:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                return None
+            if entry[0] is not None and entry[0] < time.monotonic():
+                del self._values[key]
+                return None
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._values[key] = (time.monotonic() + ttl if ttl else None, value)
+
+    def incr(self, key):
+        with self._lock:
+            value = int(self._values.get(key, (None, 0))[1]) + 1
+            self._values[key] = (None, value)
+            return value
+
+
+class RedisBackend:
+
+    def __init__(self, url, timeout=0.2):
+        if redis is None:
+            raise RuntimeError("Le paquet redis est requis pour READ_CACHE_URL=redis://...")
+        self._client = redis.Redis.from_url(url, socket_timeout=timeout, socket_connect_timeout=timeout)
+
+    def get(self, key):
+        return self._client.get(key)
+
+    def set(self, key, value, ttl=None):
+        if ttl:
+            self._client.setex(key, max(1, int(round(ttl))), value)
+        else:
+            self._client.set(key, value)
+
+    def incr(self, key):
+        return self._client.incr(key)
+
+
+class ReadCache:
+
+    def __init__(self, max_entries=2048, ttl=30.0, shared=None, prefix='eurosat_db', generation_ttl=1.0):
+        self.max_entries = max(0, int(max_entries))
+        self.ttl = ttl
+        self.shared = shared
+        self.prefix = prefix
+        self.generation_ttl = generation_ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._shared_generations = {}
+        self._stats = Counter()
+        self._shared_errors = 0
+
+    def _shared_call(self, method, *args):
+        # Backend partagé indisponible : on continue avec le cache local seul
+        try:
+            return getattr(self.shared, method)(*args)
+        except Exception as e:
+            with self._lock:
+                self._shared_errors += 1
+            print(f"Erreur cache partagé ({method}): {e}")
+            return None
+
+    def _remember_generation(self, user_id, value):
+        generation = int(value)
+        with self._lock:
+            self._shared_generations[user_id] = (time.monotonic() + self.generation_ttl, generation)
+        return generation
+
+    def _generation(self, user_id):
+        if self.shared is not None:
+            with self._lock:
+                cached = self._shared_generations.get(user_id)
+            if cached is not None and cached[0] > time.monotonic():
+                return cached[1]
+            value = self._shared_call('get', f"{self.prefix}:gen:{user_id}")
+            if value is not None:
+                return self._remember_generation(user_id, value)
+        with self._lock:
+            return self._generations.get(user_id, 0)
+
+    def key(self, namespace, user_id, *params):
+        parts = ':'.join(str(param) for param in params)
+        return namespace, f"{self.prefix}:{namespace}:{user_id}:{self._generation(user_id)}:{parts}"
+
+    def get(self, key):
+        # Renvoie une copie de la valeur, ou None
+        namespace, raw_key = key
+        with self._lock:
+            entry = self._entries.get(raw_key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self._entries[raw_key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(raw_key)
+                self._stats[f'{namespace}.hits'] += 1
+        if entry is not None:
+            return loads(entry[1])
+
+        if self.shared is not None:
+            payload = self._shared_call('get', raw_key)
+            if payload is not None:
+                with self._lock:
+                    self._store(raw_key, payload)
+                    self._stats[f'{namespace}.shared_hits'] += 1
+                return loads(payload)
+
+        with self._lock:
+            self._stats[f'{namespace}.misses'] += 1
+        return None
+
+    def put(self, key, value):
+        _, raw_key = key
+        try:
+            payload = dumps(value)
+        except (TypeError, ValueError) as e:
+            print(f"Erreur cache: valeur non mise en cache ({e})")
+            return
+        with self._lock:
+            self._store(raw_key, payload)
+        if self.shared is not None:
+            self._shared_call('set', raw_key, payload, self.ttl)
+
+    def _store(self, raw_key, payload):
+        if self.max_entries == 0:
+            return
+        self._entries[raw_key] = (time.monotonic() + self.ttl, payload)
+        self._entries.move_to_end(raw_key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats['evictions'] += 1
+
+    def invalidate(self, user_id):
+        # À appeler après le COMMIT de l'insertion
+        with self._lock:
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            self._stats['invalidations'] += 1
+        if self.shared is not None:
+            value = self._shared_call('incr', f"{self.prefix}:gen:{user_id}")
+            if value is not None:
+                # Ce worker voit sa propre insertion tout de suite
+                self._remember_generation(user_id, value)
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_s': self.ttl,
+                'shared': type(self.shared).__name__ if self.shared is not None else None,
+                'shared_errors': self._shared_errors,
+                'invalidations': self._stats['invalidations'],
+                'evictions': self._stats['evictions']
+            }
+            for namespace in sorted({name.split('.')[0] for name in self._stats if '.' in name}):
+                hits = self._stats[f'{namespace}.hits']
+                shared_hits = self._stats[f'{namespace}.shared_hits']
+                misses = self._stats[f'{namespace}.misses']
+                lookups = hits + shared_hits + misses
+                stats[namespace] = {
+                    'hits': hits,
+                    'shared_hits': shared_hits,
+                    'misses': misses,
+                    'hit_rate': round((hits + shared_hits) / lookups, 4) if lookups else 0.0
+                }
+            return stats
+
+
+def read_cache_from_env(prefix):
+    # prefix : nom de la base, les deux fronts (eurosat_db, dbtkinter_app) peuvent partager
+    # le même Redis sans mélanger leurs user_id
+    url = os.getenv("READ_CACHE_URL", "")
+    shared = None
+    if url == 'local':
+        shared = LocalBackend()
+    elif url:
+        shared = RedisBackend(url)
+    return ReadCache(
+        max_entries=int(os.getenv("READ_CACHE_SIZE", "2048")),
+        ttl=float(os.getenv("READ_CACHE_TTL", "30")),
+        shared=shared,
+        prefix=prefix,
+        generation_ttl=float(os.getenv("READ_CACHE_GENERATION_TTL", "1"))
+    )
@@ -0,0 +1,86 @@
+import argparse
+import os
+import sys
+from datetime import date
+
+from storage import month_start, parse_day
+from stores import StorageError, store_from_env
+
+# Rétention de la table predictions et agrégats journaliers, en ligne (les applications
+# continuent d'insérer pendant l'opération) :
+#
+#   python retention.py status                      lignes par mois (predictions / archives)
+#   python retention.py archive --keep-months 6     mois antérieurs -> predictions_archive_AAAAMM
+#   python retention.py archive --dry-run           affiche la coupure sans rien déplacer
+#   python retention.py rollup [--since 2025-01-01 --until 2025-01-31]
+#
+# Backend et base : STORAGE_BACKEND, DB_NAME / SQLITE_PATH comme app.py (défaut eurosat_db).
+# --keep-months : mois complets conservés avant le mois en cours (RETENTION_MONTHS, défaut 12).
+
+
+def print_status(status):
+    months = sorted(set(status['live']) | set(status['archived']))
+    for month in months:
+        print(f"{month}  predictions={status['live'].get(month, 0):>9}  archive={status['archived'].get(month, 0):>9}")
+    rollups = status['rollups']
+    print(f"Agrégats journaliers : {rollups['rows']} ligne(s), du {rollups['first_day']} au {rollups['last_day']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rétention des prédictions et agrégats journaliers")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    sub.add_parser('status', help="Répartition des lignes par mois")
+
+    archive = sub.add_parser('archive', help="Déplace les mois anciens vers les tables d'archive")
+    archive.add_argument('--keep-months', type=int, default=int(os.getenv("RETENTION_MONTHS", "12")))
+    archive.add_argument('--batch-size', type=int, default=500)
+    archive.add_argument('--pause-ms', type=float, default=50, help="Pause entre deux lots")
+    archive.add_argument('--dry-run', action='store_true')
+
+    rollup = sub.add_parser('rollup', help="Recalcule les agrégats journaliers depuis predictions")
+    rollup.add_argument('--since', help="Premier jour (AAAA-MM-JJ)")
+    rollup.add_argument('--until', help="Dernier jour (AAAA-MM-JJ, défaut aujourd'hui)")
+    args = parser.parse_args()
+
+    store = store_from_env("eurosat_db")
+    try:
+        if args.command == 'status':
+            print_status(store.retention_status())
+            return 0
+
+        if args.command == 'rollup':
+            days = None
+            if args.since:
+                since, until = parse_day(args.since), parse_day(args.until) or date.today()
+                days = [date.fromordinal(day) for day in range(since.toordinal(), until.toordinal() + 1)]
+            count = store.rebuild_daily_rollups(days)
+            print(f"Agrégats journaliers recalculés pour {count} jour(s)")
+            return 0
+
+        if args.keep_months < 1:
+            print("--keep-months doit être au moins 1")
+            return 2
+        cutoff = month_start(date.today(), args.keep_months)
+        print(f"Coupure : prédictions antérieures au {cutoff.isoformat()}")
+        if args.dry_run:
+            print_status(store.retention_status())
+            return 0
+
+        def progress(moved):
+            print(f"  {sum(moved.values())} ligne(s) archivée(s)", end='\r', flush=True)
+
+        moved = store.archive_before(cutoff, args.batch_size, args.pause_ms / 1000, progress)
+        for table, count in sorted(moved.items()):
+            print(f"{table}: {count} ligne(s)")
+        print(f"Archivage terminé, {sum(moved.values())} ligne(s) déplacée(s)")
+        return 0
+    except StorageError as e:
+        print(f"Erreur de maintenance: {e}")
+        return 1
+    finally:
+        store.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
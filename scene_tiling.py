@@ -0,0 +1,257 @@
+import colorsys
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+from PIL import Image
+
+try:
+    import rasterio
+    from rasterio.windows import Window
+except ImportError:
+    rasterio = None
+
+# Classification d'une scène satellite complète par tuiles EuroSAT.
+# La scène est lue par bandes horizontales (hauteur d'une tuile) pour borner la mémoire,
+# la carte des classes est écrite dans un .npy memory-mappé et la progression dans
+# progress.json : un job interrompu reprend à la première rangée non traitée.
+
+Image.MAX_IMAGE_PIXELS = None
+
+# Sans rasterio, Pillow décode toute la scène en mémoire : au-delà de cette taille
+# (3 octets par pixel), la lecture fenêtrée de rasterio est exigée
+PILLOW_MAX_PIXELS = int(os.getenv("SCENE_PILLOW_MAX_PIXELS", "150000000"))
+
+# Réflectance Sentinel-2 (L1C/L2A, 16 bits) ramenée sur 0-255 comme les tuiles EuroSAT RGB
+REFLECTANCE_MAX = 3000.0
+
+CLASS_COLORS = [
+    (34, 139, 34), (0, 100, 0), (144, 238, 144), (128, 128, 128), (255, 165, 0),
+    (255, 255, 0), (0, 128, 128), (128, 0, 128), (0, 0, 255), (173, 216, 230)
+]
+
+
+class RasterioScene:
+    # Lecture fenêtrée native (GeoTIFF, mais aussi PNG/JPEG via GDAL)
+
+    def __init__(self, path):
+        self._dataset = rasterio.open(path)
+        self.width = self._dataset.width
+        self.height = self._dataset.height
+        transform = self._dataset.transform
+        self.pixel_area_m2 = abs(transform.a * transform.e) if self._dataset.crs and self._dataset.crs.is_projected else None
+
+    def read(self, x, y, width, height):
+        bands = [1, 2, 3] if self._dataset.count >= 3 else [1, 1, 1]
+        data = self._dataset.read(bands, window=Window(x, y, width, height))
+        data = np.moveaxis(data, 0, -1)
+        if data.dtype != np.uint8:
+            data = np.clip(data / REFLECTANCE_MAX * 255.0, 0, 255)
+        return data.astype(np.uint8)
+
+    def close(self):
+        self._dataset.close()
+
+
+class PillowScene:
+    # Sans rasterio, PNG/JPEG ne se décodent pas par fenêtre : l'image est décodée une
+    # seule fois, convertie en RGB bande par bande vers un cache .npy memory-mappé,
+    # puis lue par bandes comme avec rasterio.
+
+    def __init__(self, path, cache_path, strip_height=1024):
+        if not os.path.exists(cache_path):
+            with Image.open(path) as img:
+                # La taille est lue dans l'en-tête, avant tout décodage
+                width, height = img.size
+                if width * height > PILLOW_MAX_PIXELS:
+                    raise ValueError(f"Scène de {width}x{height} pixels trop grande pour Pillow "
+                                     f"(limite {PILLOW_MAX_PIXELS}) : installer rasterio")
+                tmp_path = cache_path + '.tmp.npy'
+                pixels = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.uint8, shape=(height, width, 3))
+                # Pas de copie RGB de la scène entière : seule une bande convertie à la fois
+                for y in range(0, height, strip_height):
+                    strip = img.crop((0, y, width, min(y + strip_height, height)))
+                    pixels[y:y + strip.height] = np.asarray(strip.convert('RGB'))
+                pixels.flush()
+                del pixels
+                os.replace(tmp_path, cache_path)
+        self._pixels = np.load(cache_path, mmap_mode='r')
+        self.height, self.width = self._pixels.shape[:2]
+        self.pixel_area_m2 = None
+
+    def read(self, x, y, width, height):
+        return np.asarray(self._pixels[y:y + height, x:x + width])
+
+    def close(self):
+        self._pixels = None
+
+
+def open_scene(path, work_dir):
+    if rasterio is not None:
+        try:
+            return RasterioScene(path)
+        except Exception as e:
+            print(f"Lecture rasterio impossible, repli sur Pillow: {e}")
+    return PillowScene(path, os.path.join(work_dir, 'scene.npy'))
+
+
+def class_palette(count):
+    # Couleurs EuroSAT d'abord, puis des teintes réparties (angle d'or) pour les classes en plus
+    colors = list(CLASS_COLORS[:count])
+    for i in range(len(colors), count):
+        hue = (i * 0.618033988749895) % 1.0
+        colors.append(tuple(int(c * 255) for c in colorsys.hsv_to_rgb(hue, 0.65, 0.9)))
+    return np.array(colors, dtype=np.uint8)
+
+
+def file_digest(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def owned_job_dir(jobs_dir, job_id, owner):
+    # Répertoire du job s'il appartient à owner, None sinon (les autres voient un 404)
+    try:
+        with open(os.path.join(jobs_dir, job_id, 'owner.json')) as f:
+            recorded = json.load(f)['owner']
+    except (OSError, ValueError, KeyError):
+        return None
+    return os.path.join(jobs_dir, job_id) if recorded == owner else None
+
+
+def grid_positions(size, tile_size, stride):
+    positions = list(range(0, max(size - tile_size, 0) + 1, stride))
+    # Dernière tuile alignée sur le bord pour couvrir toute la scène
+    if positions and positions[-1] + tile_size < size:
+        positions.append(size - tile_size)
+    return positions
+
+
+class SceneJob:
+
+    def __init__(self, scene_path, jobs_dir, tile_size=64, stride=64, model_version='', owner=None, digest=None):
+        self.scene_path = scene_path
+        self.tile_size = int(tile_size)
+        self.stride = int(stride)
+        digest = digest or file_digest(scene_path)
+        # Un job par propriétaire : la même scène envoyée par deux utilisateurs donne deux jobs
+        key = f"{digest}:{self.tile_size}:{self.stride}:{model_version}:{owner}"
+        self.job_id = hashlib.sha256(key.encode('utf-8')).hexdigest()[:24]
+        self.work_dir = os.path.join(jobs_dir, self.job_id)
+        os.makedirs(self.work_dir, exist_ok=True)
+        owner_path = os.path.join(self.work_dir, 'owner.json')
+        if owner is not None and not os.path.exists(owner_path):
+            with open(owner_path, 'w') as f:
+                json.dump({'owner': owner}, f)
+        self.progress_path = os.path.join(self.work_dir, 'progress.json')
+        self.class_map_path = os.path.join(self.work_dir, 'class_map.npy')
+        self.confidence_map_path = os.path.join(self.work_dir, 'confidence_map.npy')
+        self.map_image_path = os.path.join(self.work_dir, 'class_map.png')
+
+    def load_progress(self):
+        if os.path.exists(self.progress_path):
+            with open(self.progress_path) as f:
+                return json.load(f)
+        return None
+
+    def _save_progress(self, progress):
+        tmp_path = self.progress_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(progress, f)
+        os.replace(tmp_path, self.progress_path)
+
+    def run(self, predict_fn, class_names, input_size=(128, 128), batch_size=64):
+        # Générateur : produit un dict de progression après chaque rangée de tuiles
+        scene = open_scene(self.scene_path, self.work_dir)
+        try:
+            xs = grid_positions(scene.width, self.tile_size, self.stride)
+            ys = grid_positions(scene.height, self.tile_size, self.stride)
+            if not xs or not ys:
+                raise ValueError(f"Scène plus petite qu'une tuile ({self.tile_size}px)")
+
+            progress = self.load_progress()
+            if progress is None or not os.path.exists(self.class_map_path):
+                progress = {
+                    'job_id': self.job_id,
+                    'width': scene.width,
+                    'height': scene.height,
+                    'tile_size': self.tile_size,
+                    'stride': self.stride,
+                    'rows': len(ys),
+                    'cols': len(xs),
+                    'rows_done': 0,
+                    'status': 'running'
+                }
+                np.lib.format.open_memmap(self.class_map_path, mode='w+', dtype=np.uint8, shape=(len(ys), len(xs)))
+                np.lib.format.open_memmap(self.confidence_map_path, mode='w+', dtype=np.float16, shape=(len(ys), len(xs)))
+                self._save_progress(progress)
+
+            class_map = np.load(self.class_map_path, mmap_mode='r+')
+            confidence_map = np.load(self.confidence_map_path, mmap_mode='r+')
+            started = time.perf_counter()
+            first_row = progress['rows_done']
+
+            for row in range(first_row, len(ys)):
+                strip = scene.read(0, ys[row], scene.width, self.tile_size)
+                tiles = np.empty((len(xs), input_size[0], input_size[1], 3), dtype=np.uint8)
+                for col, x in enumerate(xs):
+                    tile = Image.fromarray(strip[:, x:x + self.tile_size])
+                    tiles[col] = np.asarray(tile.resize(input_size, Image.NEAREST))
+
+                for start in range(0, len(xs), batch_size):
+                    probs = predict_fn(tiles[start:start + batch_size])
+                    class_map[row, start:start + len(probs)] = np.argmax(probs, axis=1)
+                    confidence_map[row, start:start + len(probs)] = np.max(probs, axis=1)
+
+                class_map.flush()
+                confidence_map.flush()
+                progress['rows_done'] = row + 1
+                self._save_progress(progress)
+
+                elapsed = time.perf_counter() - started
+                done = row + 1 - first_row
+                yield {
+                    'job_id': self.job_id,
+                    'rows_done': row + 1,
+                    'rows': len(ys),
+                    'percent': round((row + 1) / len(ys) * 100, 2),
+                    'eta_s': round(elapsed / done * (len(ys) - row - 1), 1)
+                }
+
+            summary = self.summarize(class_map, confidence_map, class_names, scene.pixel_area_m2)
+            self.render_map(class_map, class_names)
+            progress.update({'status': 'done', 'summary': summary})
+            self._save_progress(progress)
+            yield {'job_id': self.job_id, 'done': True, 'summary': summary}
+        finally:
+            scene.close()
+
+    def summarize(self, class_map, confidence_map, class_names, pixel_area_m2=None):
+        counts = np.bincount(np.asarray(class_map).ravel(), minlength=len(class_names))
+        mean_conf = np.bincount(np.asarray(class_map).ravel(),
+                                weights=np.asarray(confidence_map, dtype=np.float64).ravel(),
+                                minlength=len(class_names))
+        total = int(counts.sum())
+        # Chaque tuile représente une cellule stride x stride de la scène
+        cell_area_m2 = pixel_area_m2 * self.stride * self.stride if pixel_area_m2 else None
+        summary = {}
+        for i, class_name in enumerate(class_names):
+            entry = {
+                'tiles': int(counts[i]),
+                'fraction': round(counts[i] / total, 4) if total else 0.0,
+                'mean_confidence': round(mean_conf[i] / counts[i] * 100, 2) if counts[i] else 0.0
+            }
+            if cell_area_m2:
+                entry['area_km2'] = round(counts[i] * cell_area_m2 / 1e6, 3)
+            summary[class_name] = entry
+        return summary
+
+    def render_map(self, class_map, class_names):
+        class_map = np.asarray(class_map)
+        palette = class_palette(max(len(class_names), int(class_map.max()) + 1))
+        Image.fromarray(palette[class_map]).save(self.map_image_path)
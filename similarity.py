@@ -0,0 +1,311 @@
+import argparse
+import os
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Index vectoriel sur les embeddings du backbone, partagé entre workers via des fichiers
+# memory-mappés en ajout seul :
+#   vectors.f16  lignes float16 normalisées (N x dim)
+#   names.txt    image_name de chaque ligne
+#   ivf.npz      centroïdes (index partitionné, construit au-delà d'un seuil)
+#   assign.i32   liste IVF de chaque ligne
+#   committed    "<lignes> <octets de names.txt>" validés, remplacé atomiquement après
+#                chaque ajout : ce qui dépasse dans les autres fichiers (crash entre deux
+#                écritures) est ignoré à la lecture et tronqué au prochain ajout
+#
+# L'IVF (k-means) n'est jamais entraîné dans un ajout : un thread de fond (un seul worker
+# à la fois, verrou .train.lock) ou 'python similarity.py --train' le reconstruit ; les
+# recherches utilisent l'index précédent, ou le parcours complet, en attendant.
+
+VECTOR_DTYPE = np.float16
+SCAN_CHUNK_ROWS = 65536
+
+
+def _normalize(x):
+    x = np.asarray(x, dtype=np.float32)
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    return x / np.maximum(norms, 1e-12)
+
+
+def _kmeans(data, n_clusters, iterations=10, seed=42):
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(data @ centroids.T, axis=1)
+        for c in range(n_clusters):
+            members = data[assign == c]
+            if len(members):
+                centroids[c] = members.mean(axis=0)
+            else:
+                centroids[c] = data[rng.integers(len(data))]
+        centroids = _normalize(centroids)
+    return centroids
+
+
+def _assign(vectors, centroids):
+    if len(vectors) == 0:
+        return np.empty(0, dtype=np.int32)
+    return np.concatenate([
+        np.argmax(vectors[start:start + SCAN_CHUNK_ROWS].astype(np.float32) @ centroids.T, axis=1)
+        for start in range(0, len(vectors), SCAN_CHUNK_ROWS)
+    ]).astype(np.int32)
+
+
+def _write_at(path, offset, data):
+    with open(path, 'r+b') as f:
+        f.truncate(offset)
+        f.seek(offset)
+        f.write(data)
+
+
+class VectorIndex:
+
+    def __init__(self, directory, dim=2048, ivf_threshold=20000, n_probe=8, background_training=True):
+        self.directory = directory
+        self.dim = dim
+        self.ivf_threshold = ivf_threshold
+        self.n_probe = n_probe
+        self.background_training = background_training
+        self._trainer = None
+        os.makedirs(directory, exist_ok=True)
+
+        self._vectors_path = os.path.join(directory, 'vectors.f16')
+        self._names_path = os.path.join(directory, 'names.txt')
+        self._ivf_path = os.path.join(directory, 'ivf.npz')
+        self._assign_path = os.path.join(directory, 'assign.i32')
+        self._lock_path = os.path.join(directory, '.lock')
+        self._commit_path = os.path.join(directory, 'committed')
+        self._train_lock_path = os.path.join(directory, '.train.lock')
+        for path in (self._vectors_path, self._names_path, self._assign_path):
+            open(path, 'ab').close()
+
+        self._thread_lock = threading.RLock()
+        self._vectors = np.empty((0, dim), dtype=VECTOR_DTYPE)
+        self._names = []
+        self._names_offset = 0
+        self._centroids = None
+        self._trained_count = 0
+        self._ivf_mtime = None
+        self._assign = np.empty(0, dtype=np.int32)
+        if not os.path.exists(self._commit_path):
+            with self._locked():
+                if not os.path.exists(self._commit_path):
+                    self._write_commit(*self._recover_commit())
+
+    @contextmanager
+    def _locked(self):
+        # Verrou inter-processus pour les écritures (fichiers en ajout seul)
+        with self._thread_lock:
+            with open(self._lock_path, 'a') as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _recover_commit(self):
+        # Index antérieur au fichier committed : lignes complètes présentes des deux côtés
+        with open(self._names_path, 'rb') as f:
+            lines = f.read().split(b'\n')[:-1]
+        rows = min(len(lines), os.path.getsize(self._vectors_path) // (self.dim * 2))
+        return rows, sum(len(line) + 1 for line in lines[:rows])
+
+    def _read_commit(self):
+        with open(self._commit_path) as f:
+            rows, names_bytes = f.read().split()
+        return int(rows), int(names_bytes)
+
+    def _write_commit(self, rows, names_bytes):
+        tmp_path = self._commit_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(f"{rows} {names_bytes}")
+        os.replace(tmp_path, self._commit_path)
+
+    def _refresh(self):
+        # Relit uniquement ce que les autres workers ont validé depuis le dernier appel
+        rows, names_bytes = self._read_commit()
+        if names_bytes > self._names_offset:
+            with open(self._names_path, 'rb') as f:
+                f.seek(self._names_offset)
+                chunk = f.read(names_bytes - self._names_offset)
+            self._names.extend(chunk.decode('utf-8').splitlines())
+            self._names_offset = names_bytes
+
+        rows = min(rows, len(self._names))
+        if rows != len(self._vectors):
+            self._vectors = np.memmap(self._vectors_path, dtype=VECTOR_DTYPE, mode='r', shape=(rows, self.dim)) \
+                if rows else np.empty((0, self.dim), dtype=VECTOR_DTYPE)
+
+        if os.path.exists(self._ivf_path):
+            mtime = os.path.getmtime(self._ivf_path)
+            if mtime != self._ivf_mtime:
+                data = np.load(self._ivf_path)
+                self._centroids = data['centroids']
+                self._trained_count = int(data['trained_count'])
+                self._ivf_mtime = mtime
+        assigned = min(os.path.getsize(self._assign_path) // 4, rows)
+        if assigned != len(self._assign):
+            self._assign = np.memmap(self._assign_path, dtype=np.int32, mode='r', shape=(assigned,)) \
+                if assigned else np.empty(0, dtype=np.int32)
+
+    def __len__(self):
+        with self._thread_lock:
+            self._refresh()
+            return len(self._vectors)
+
+    def add(self, image_name, embedding):
+        self.add_many([image_name], np.asarray(embedding)[np.newaxis])
+
+    def add_many(self, image_names, embeddings):
+        vectors = _normalize(embeddings).astype(VECTOR_DTYPE)
+        names = ''.join(f"{name}\n" for name in image_names).encode('utf-8')
+        with self._locked():
+            self._refresh()
+            rows, names_bytes = self._read_commit()
+            # Écriture à la position validée : un reste d'ajout interrompu est écrasé
+            _write_at(self._vectors_path, rows * self.dim * 2, vectors.tobytes())
+            _write_at(self._names_path, names_bytes, names)
+            if self._centroids is not None:
+                assign = np.argmax(vectors.astype(np.float32) @ self._centroids.T, axis=1).astype(np.int32)
+                _write_at(self._assign_path, min(os.path.getsize(self._assign_path), rows * 4), assign.tobytes())
+            self._write_commit(rows + len(vectors), names_bytes + len(names))
+            self._refresh()
+            stale = self._needs_training()
+
+        if stale and self.background_training:
+            self._start_trainer()
+
+    def _needs_training(self):
+        # (Re)construction de l'IVF au passage du seuil puis à chaque doublement
+        count = len(self._vectors)
+        return count >= self.ivf_threshold and count >= 2 * self._trained_count
+
+    def _start_trainer(self):
+        with self._thread_lock:
+            if self._trainer is not None and self._trainer.is_alive():
+                return
+            self._trainer = threading.Thread(target=self.train, name="vector-index-train", daemon=True)
+            self._trainer.start()
+
+    def train(self, force=False):
+        # Renvoie True si l'IVF a été reconstruit ; False si un autre worker s'en charge
+        # ou s'il est à jour. Le k-means tourne hors de tout verrou d'écriture.
+        with open(self._train_lock_path, 'a') as train_lock:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(train_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return False
+            try:
+                with self._thread_lock:
+                    self._refresh()
+                    if not force and not self._needs_training():
+                        return False
+                    vectors = self._vectors
+                count = len(vectors)
+                if count == 0:
+                    return False
+                rng = np.random.default_rng(42)
+                sample_rows = np.sort(rng.choice(count, min(count, 50000), replace=False))
+                centroids = _kmeans(vectors[sample_rows].astype(np.float32), max(1, int(np.sqrt(count))))
+                assign = _assign(vectors, centroids)
+
+                with self._locked():
+                    # Lignes ajoutées pendant l'entraînement : affectées ici, sous verrou
+                    self._refresh()
+                    assign = np.concatenate([assign, _assign(self._vectors[count:], centroids)])
+                    tmp_assign = self._assign_path + '.tmp'
+                    assign.tofile(tmp_assign)
+                    tmp_ivf = self._ivf_path + '.tmp.npz'
+                    np.savez(tmp_ivf, centroids=centroids, trained_count=len(assign))
+                    os.replace(tmp_assign, self._assign_path)
+                    os.replace(tmp_ivf, self._ivf_path)
+                    self._refresh()
+                print(f"Index IVF reconstruit: {len(centroids)} listes pour {len(assign)} vecteurs")
+                return True
+            except Exception as e:
+                print(f"Erreur lors de la reconstruction de l'index IVF: {e}")
+                return False
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(train_lock, fcntl.LOCK_UN)
+
+    def search(self, embedding, k=10, exclude=None):
+        query = _normalize(embedding).reshape(-1)
+        with self._thread_lock:
+            self._refresh()
+            vectors, names = self._vectors, self._names
+            use_ivf = self._centroids is not None and len(self._assign) == len(vectors)
+            if use_ivf:
+                probes = np.argsort(-(self._centroids @ query))[:self.n_probe]
+                candidates = np.flatnonzero(np.isin(self._assign, probes))
+            else:
+                candidates = None
+
+        if len(vectors) == 0:
+            return []
+
+        if candidates is not None:
+            scores = vectors[candidates].astype(np.float32) @ query
+        else:
+            scores = np.concatenate([
+                vectors[start:start + SCAN_CHUNK_ROWS].astype(np.float32) @ query
+                for start in range(0, len(vectors), SCAN_CHUNK_ROWS)
+            ])
+            candidates = np.arange(len(vectors))
+
+        # Marge pour les doublons (même image ré-analysée)
+        top = min(len(scores), k * 3 + 1)
+        best = np.argpartition(-scores, top - 1)[:top]
+        best = best[np.argsort(-scores[best])]
+
+        results = []
+        seen = set()
+        for i in best:
+            name = names[candidates[i]]
+            if name in seen or name == exclude:
+                continue
+            seen.add(name)
+            results.append((name, float(scores[i])))
+            if len(results) == k:
+                break
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconstruit l'index de similarité depuis le magasin d'embeddings")
+    parser.add_argument('--store', default='embeddings.sqlite')
+    parser.add_argument('--index-dir', default='vector_index')
+    parser.add_argument('--ivf-threshold', type=int, default=20000)
+    parser.add_argument('--train', action='store_true', help="Réentraîne seulement l'IVF de l'index existant")
+    args = parser.parse_args()
+
+    index = VectorIndex(args.index_dir, ivf_threshold=args.ivf_threshold, background_training=False)
+    if args.train:
+        if not index.train(force=True):
+            print("IVF non reconstruit (index vide ou entraînement en cours dans un autre processus)")
+        return
+
+    from embeddings import EmbeddingStore
+
+    if len(index):
+        parser.error(f"L'index {args.index_dir} n'est pas vide")
+    store = EmbeddingStore(args.store)
+    for names, matrix in store.iter_images():
+        index.add_many(names, matrix)
+    print(f"{len(index)} vecteurs indexés dans {args.index_dir}")
+    if len(index) >= args.ivf_threshold:
+        index.train()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,529 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+from storage import (ARCHIVE_COLUMNS, ARCHIVE_PREFIX, HISTORY_INDEX, LOW_CONFIDENCE_THRESHOLD, TIME_INDEX,
+                     UNCERTAINTY_DEFAULT_SCAN, archive_table, class_rollup_increments, class_stat_increments,
+                     class_stats_mismatches, daily_rollup_increments, decode_cursor, history_page, stats_from_rows)
+from stores import RowRejected, StorageError
+
+# Backend SQLite embarqué (STORAGE_BACKEND=sqlite) : même interface que stores.MySQLStore,
+# même schéma logique et mêmes index, sans serveur ni aller-retour réseau.
+#
+# - WAL : les lectures (historique, stats) ne bloquent pas l'écriture en cours et
+#   inversement ; synchronous=NORMAL, le COMMIT n'attend pas de fsync (durable au
+#   checkpoint suivant, cohérent après crash).
+# - Connexions réutilisées (pile LIFO, au plus max_idle au repos) : le cache
+#   d'instructions préparées de chaque connexion (cached_statements) sert les requêtes
+#   constantes ci-dessous sans recompilation.
+# - Écritures groupées : executemany dans une seule transaction BEGIN IMMEDIATE
+#   (verrou d'écriture pris d'emblée, pas d'échec de promotion sous concurrence).
+# - Horodatages en texte 'AAAA-MM-JJ HH:MM:SS' heure locale, comme MySQL : l'ordre
+#   lexical est l'ordre chronologique, la pagination par clé reste une lecture d'index.
+# - Rétention : même rotation en tables mensuelles predictions_archive_AAAAMM que
+#   storage.py (SQLite n'a pas de partitionnement) ; chaque lot prend le verrou
+#   d'écriture quelques millisecondes, les insertions attendent au plus busy_timeout.
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        password TEXT NOT NULL,
+        email TEXT,
+        created_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime'))
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS predictions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        image_name TEXT NOT NULL,
+        predicted_class TEXT NOT NULL,
+        confidence REAL NOT NULL,
+        model_version TEXT,
+        probabilities BLOB,
+        timestamp TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime'))
+    )
+    """,
+    f"CREATE INDEX IF NOT EXISTS {HISTORY_INDEX} ON predictions (user_id, timestamp, id)",
+    """
+    CREATE TABLE IF NOT EXISTS user_class_stats (
+        user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        predicted_class TEXT NOT NULL,
+        prediction_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, predicted_class)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS prediction_daily_rollups (
+        user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        day TEXT NOT NULL,
+        predicted_class TEXT NOT NULL,
+        prediction_count INTEGER NOT NULL DEFAULT 0,
+        confidence_sum REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, day, predicted_class)
+    ) WITHOUT ROWID
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_rollups_day ON prediction_daily_rollups (day)",
+    # Un seul écrivain à la fois en SQLite : pas de répartition en shards, toujours 0
+    """
+    CREATE TABLE IF NOT EXISTS class_daily_rollups (
+        day TEXT NOT NULL,
+        predicted_class TEXT NOT NULL,
+        shard INTEGER NOT NULL DEFAULT 0,
+        prediction_count INTEGER NOT NULL DEFAULT 0,
+        confidence_sum REAL NOT NULL DEFAULT 0,
+        low_confidence_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, predicted_class, shard)
+    ) WITHOUT ROWID
+    """
+]
+
+ARCHIVE_DDL = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        image_name TEXT NOT NULL,
+        predicted_class TEXT NOT NULL,
+        confidence REAL NOT NULL,
+        model_version TEXT,
+        probabilities BLOB,
+        timestamp TEXT NOT NULL
+    )
+"""
+
+HISTORY_COLUMNS = "id, image_name, predicted_class, confidence, timestamp, probabilities"
+
+HISTORY_FIRST_PAGE_SQL = f"""
+    SELECT {HISTORY_COLUMNS}
+    FROM predictions
+    WHERE user_id = ?
+    ORDER BY timestamp DESC, id DESC
+    LIMIT ?
+"""
+
+HISTORY_NEXT_PAGE_SQL = f"""
+    SELECT {HISTORY_COLUMNS}
+    FROM predictions
+    WHERE user_id = ?
+      AND (timestamp < ? OR (timestamp = ? AND id < ?))
+    ORDER BY timestamp DESC, id DESC
+    LIMIT ?
+"""
+
+UNCERTAINTY_SCAN_SQL = f"""
+    SELECT {HISTORY_COLUMNS}
+    FROM predictions
+    WHERE user_id = ? AND probabilities IS NOT NULL
+    ORDER BY timestamp DESC, id DESC
+    LIMIT ?
+"""
+
+INSERT_PREDICTION_SQL = (
+    "INSERT INTO predictions (user_id, image_name, predicted_class, confidence, model_version, probabilities, timestamp) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+
+INCREMENT_CLASS_STATS_SQL = """
+    INSERT INTO user_class_stats (user_id, predicted_class, prediction_count)
+    VALUES (?, ?, ?)
+    ON CONFLICT (user_id, predicted_class) DO UPDATE SET prediction_count = prediction_count + excluded.prediction_count
+"""
+
+USER_STATS_SQL = """
+    SELECT predicted_class, prediction_count
+    FROM user_class_stats
+    WHERE user_id = ? AND prediction_count > 0
+    ORDER BY prediction_count DESC
+"""
+
+INCREMENT_DAILY_ROLLUP_SQL = """
+    INSERT INTO prediction_daily_rollups (user_id, day, predicted_class, prediction_count, confidence_sum)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (user_id, day, predicted_class) DO UPDATE SET
+        prediction_count = prediction_count + excluded.prediction_count,
+        confidence_sum = confidence_sum + excluded.confidence_sum
+"""
+
+USER_STATS_BETWEEN_SQL = """
+    SELECT predicted_class, SUM(prediction_count)
+    FROM prediction_daily_rollups
+    WHERE user_id = ? AND day BETWEEN ? AND ?
+    GROUP BY predicted_class
+    HAVING SUM(prediction_count) > 0
+    ORDER BY SUM(prediction_count) DESC
+"""
+
+REBUILD_DAILY_ROLLUPS_SQL = """
+    INSERT INTO prediction_daily_rollups (user_id, day, predicted_class, prediction_count, confidence_sum)
+    SELECT user_id, substr(timestamp, 1, 10), predicted_class, COUNT(*), SUM(confidence)
+    FROM predictions
+    WHERE timestamp >= ? AND timestamp < date(?, '+1 day')
+    GROUP BY user_id, predicted_class
+"""
+
+INCREMENT_CLASS_ROLLUP_SQL = """
+    INSERT INTO class_daily_rollups (day, predicted_class, shard, prediction_count, confidence_sum, low_confidence_count)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (day, predicted_class, shard) DO UPDATE SET
+        prediction_count = prediction_count + excluded.prediction_count,
+        confidence_sum = confidence_sum + excluded.confidence_sum,
+        low_confidence_count = low_confidence_count + excluded.low_confidence_count
+"""
+
+# {source} : predictions ou une table d'archive ; additif pour cumuler plusieurs sources
+REBUILD_CLASS_ROLLUPS_SQL = """
+    INSERT INTO class_daily_rollups (day, predicted_class, shard, prediction_count, confidence_sum, low_confidence_count)
+    SELECT substr(timestamp, 1, 10), predicted_class, 0, COUNT(*), SUM(confidence), SUM(confidence < ?)
+    FROM {source}
+    WHERE timestamp >= ? AND timestamp < ?
+    GROUP BY substr(timestamp, 1, 10), predicted_class
+    ON CONFLICT (day, predicted_class, shard) DO UPDATE SET
+        prediction_count = prediction_count + excluded.prediction_count,
+        confidence_sum = confidence_sum + excluded.confidence_sum,
+        low_confidence_count = low_confidence_count + excluded.low_confidence_count
+"""
+
+CLASS_ROLLUP_RANGE_SQL = """
+    SELECT day, predicted_class, prediction_count, confidence_sum, low_confidence_count
+    FROM class_daily_rollups
+    WHERE day BETWEEN ? AND ?
+"""
+
+
+def _timestamp_text(value):
+    return value.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _history_rows(rows):
+    # sqlite3.Row -> dict, horodatage texte -> datetime comme avec mysql.connector
+    rows = [dict(row) for row in rows]
+    for row in rows:
+        row['timestamp'] = datetime.fromisoformat(row['timestamp'])
+    return rows
+
+
+class SQLiteStore:
+    backend = 'sqlite'
+
+    def __init__(self, path, busy_timeout_ms=5000, cached_statements=256, max_idle=8):
+        self.path = path
+        self.name = os.path.splitext(os.path.basename(path))[0]
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cached_statements = cached_statements
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._idle = deque()
+        self._open = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+    def _connect(self):
+        try:
+            # isolation_level=None : transactions explicites (BEGIN IMMEDIATE / COMMIT)
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False,
+                                   timeout=self.busy_timeout_ms / 1000, cached_statements=self.cached_statements)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            return conn
+        except sqlite3.Error as e:
+            raise StorageError(f"Ouverture de {self.path} impossible: {e}") from e
+
+    @contextmanager
+    def _connection(self):
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                self._open += 1
+        if conn is None:
+            try:
+                conn = self._connect()
+            except StorageError:
+                with self._lock:
+                    self._open -= 1
+                raise
+        try:
+            yield conn
+        except (sqlite3.DataError, sqlite3.IntegrityError) as e:
+            raise RowRejected(str(e)) from e
+        except sqlite3.Error as e:
+            raise StorageError(str(e)) from e
+        finally:
+            with self._lock:
+                keep = len(self._idle) < self.max_idle and not conn.in_transaction
+                if keep:
+                    self._idle.append(conn)
+                else:
+                    self._open -= 1
+            if not keep:
+                conn.close()
+
+    def _query(self, sql, params=()):
+        with self._connection() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def _write(self, statements):
+        # statements : [(sql, [params, ...] ou None), ...] dans une seule transaction
+        with self._connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for sql, params in statements:
+                    if params is None:
+                        conn.execute(sql)
+                    else:
+                        conn.executemany(sql, params)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def init_schema(self):
+        self._write([(sql, None) for sql in SCHEMA])
+        # Base existante sans compteurs : remplissage initial
+        has_stats, has_predictions = self._query(
+            "SELECT EXISTS(SELECT 1 FROM user_class_stats), EXISTS(SELECT 1 FROM predictions)")[0]
+        if has_predictions and not has_stats:
+            self._write([(
+                "INSERT INTO user_class_stats (user_id, predicted_class, prediction_count) "
+                "SELECT user_id, predicted_class, COUNT(*) FROM predictions GROUP BY user_id, predicted_class",
+                None
+            )])
+        has_rollups, has_class_rollups = self._query(
+            "SELECT EXISTS(SELECT 1 FROM prediction_daily_rollups), EXISTS(SELECT 1 FROM class_daily_rollups)")[0]
+        if has_rollups and not has_class_rollups:
+            # Base antérieure aux agrégats globaux : jours archivés depuis les archives
+            self._write([(REBUILD_CLASS_ROLLUPS_SQL.format(source=table), [(LOW_CONFIDENCE_THRESHOLD, '0000-01-01', '9999-12-31')])
+                         for table in self._archive_tables()])
+        if has_predictions and (not has_rollups or not has_class_rollups):
+            self.rebuild_daily_rollups()
+
+    def get_user(self, username):
+        rows = self._query("SELECT id, username, password, email FROM users WHERE username = ?", (username,))
+        return dict(rows[0]) if rows else None
+
+    def email_exists(self, email):
+        return bool(self._query("SELECT 1 FROM users WHERE email = ?", (email,)))
+
+    def create_user(self, username, email, password_hash):
+        self._write([("INSERT INTO users (username, email, password) VALUES (?, ?, ?)",
+                      [(username, email, password_hash)])])
+
+    def update_password(self, user_id, password_hash):
+        self._write([("UPDATE users SET password = ? WHERE id = ?", [(password_hash, user_id)])])
+
+    def insert_predictions(self, rows):
+        if not rows:
+            return
+        # Horodatage explicite, fixé à la requête (écriture différée) ou maintenant
+        now = datetime.now()
+        rows = [tuple(row[:6]) + (row[6] if len(row) == 7 else now,) for row in rows]
+        self._write([
+            (INSERT_PREDICTION_SQL, [row[:6] + (_timestamp_text(row[6]),) for row in rows]),
+            (INCREMENT_CLASS_STATS_SQL, class_stat_increments(rows)),
+            (INCREMENT_DAILY_ROLLUP_SQL, [(user_id, day.isoformat(), class_name, count, confidence_sum)
+                                          for user_id, day, class_name, count, confidence_sum
+                                          in daily_rollup_increments(rows)]),
+            (INCREMENT_CLASS_ROLLUP_SQL, [(day.isoformat(), *rest) for day, *rest in class_rollup_increments(rows, 0)])
+        ])
+
+    def fetch_history(self, user_id, limit, cursor=None):
+        if cursor:
+            timestamp, row_id = decode_cursor(cursor)
+            timestamp = _timestamp_text(timestamp)
+            rows = self._query(HISTORY_NEXT_PAGE_SQL, (user_id, timestamp, timestamp, row_id, limit + 1))
+        else:
+            rows = self._query(HISTORY_FIRST_PAGE_SQL, (user_id, limit + 1))
+        return history_page(_history_rows(rows), limit)
+
+    def fetch_recent(self, user_id, n=5):
+        rows = _history_rows(self._query(HISTORY_FIRST_PAGE_SQL, (user_id, n)))
+        for row in rows:
+            row.pop('id', None)
+        return rows
+
+    def fetch_uncertainty_scan(self, user_id, scan=UNCERTAINTY_DEFAULT_SCAN):
+        rows = _history_rows(self._query(UNCERTAINTY_SCAN_SQL, (user_id, scan)))
+        for row in rows:
+            row.pop('id', None)
+        return rows
+
+    def fetch_user_stats(self, user_id):
+        return stats_from_rows([tuple(row) for row in self._query(USER_STATS_SQL, (user_id,))])
+
+    def fetch_user_stats_between(self, user_id, start, end):
+        rows = self._query(USER_STATS_BETWEEN_SQL, (user_id, start.isoformat(), end.isoformat()))
+        return stats_from_rows([tuple(row) for row in rows])
+
+    def rebuild_daily_rollups(self, days=None):
+        # Jours encore présents dans predictions, un jour par transaction
+        if days is None:
+            days = [row[0] for row in self._query("SELECT DISTINCT substr(timestamp, 1, 10) FROM predictions ORDER BY 1")]
+        else:
+            days = [day.isoformat() for day in days]
+        for day in days:
+            self._write([
+                # Jour archivé (plus de lignes brutes) : agrégats conservés
+                ("DELETE FROM prediction_daily_rollups WHERE day = ? AND EXISTS ("
+                 "SELECT 1 FROM predictions WHERE timestamp >= ? AND timestamp < date(?, '+1 day'))",
+                 [(day, day, day)]),
+                ("DELETE FROM class_daily_rollups WHERE day = ? AND EXISTS ("
+                 "SELECT 1 FROM predictions WHERE timestamp >= ? AND timestamp < date(?, '+1 day'))",
+                 [(day, day, day)]),
+                (REBUILD_DAILY_ROLLUPS_SQL, [(day, day)]),
+                (REBUILD_CLASS_ROLLUPS_SQL.format(source='predictions'),
+                 [(LOW_CONFIDENCE_THRESHOLD, day, (date.fromisoformat(day) + timedelta(days=1)).isoformat())])
+            ])
+        return len(days)
+
+    def fetch_class_rollups(self, start, end):
+        return [tuple(row) for row in self._query(CLASS_ROLLUP_RANGE_SQL, (start.isoformat(), end.isoformat()))]
+
+    def _archive_tables(self, conn=None):
+        sql = "SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB ?"
+        params = (f"{ARCHIVE_PREFIX}[0-9][0-9][0-9][0-9][0-9][0-9]",)
+        rows = conn.execute(sql, params).fetchall() if conn is not None else self._query(sql, params)
+        return sorted(row[0] for row in rows)
+
+    def _archive_batch(self, cutoff, batch_size):
+        with self._connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = conn.execute(
+                    f"SELECT {ARCHIVE_COLUMNS} FROM predictions WHERE timestamp < ? ORDER BY timestamp, id LIMIT ?",
+                    (cutoff, batch_size)
+                ).fetchall()
+                by_table = defaultdict(list)
+                for row in rows:
+                    by_table[archive_table(datetime.fromisoformat(row['timestamp']))].append(tuple(row))
+                for table, table_rows in sorted(by_table.items()):
+                    conn.execute(ARCHIVE_DDL.format(table=table))
+                    conn.executemany(f"INSERT INTO {table} ({ARCHIVE_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                     table_rows)
+                conn.executemany("DELETE FROM predictions WHERE id = ?", [(row['id'],) for row in rows])
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return {table: len(table_rows) for table, table_rows in by_table.items()}
+
+    def archive_before(self, cutoff, batch_size=500, pause=0.05, progress=None):
+        self._write([(f"CREATE INDEX IF NOT EXISTS {TIME_INDEX} ON predictions (timestamp, id)", None)])
+        cutoff = cutoff.isoformat()
+        moved = Counter()
+        while True:
+            batch = self._archive_batch(cutoff, batch_size)
+            if not batch:
+                return dict(moved)
+            moved.update(batch)
+            if progress is not None:
+                progress(dict(moved))
+            if pause:
+                time.sleep(pause)
+
+    def retention_status(self):
+        live = {row[0]: row[1] for row in self._query(
+            "SELECT substr(timestamp, 1, 7), COUNT(*) FROM predictions GROUP BY 1 ORDER BY 1")}
+        archived = {}
+        for table in self._archive_tables():
+            suffix = table[len(ARCHIVE_PREFIX):]
+            archived[f"{suffix[:4]}-{suffix[4:]}"] = self._query(f"SELECT COUNT(*) FROM {table}")[0][0]
+        first_day, last_day, rollup_rows = self._query(
+            "SELECT MIN(day), MAX(day), COUNT(*) FROM prediction_daily_rollups")[0]
+        return {
+            'live': live,
+            'archived': archived,
+            'rollups': {'first_day': first_day, 'last_day': last_day, 'rows': rollup_rows}
+        }
+
+    def _class_counts(self, conn, user_id=None):
+        # Compteurs (user_id, classe) de predictions et de ses archives
+        where, params = ("WHERE user_id = ?", (user_id,)) if user_id is not None else ("", ())
+        counts = Counter()
+        for table in ['predictions'] + self._archive_tables(conn):
+            counts.update({(row[0], row[1]): row[2] for row in conn.execute(
+                f"SELECT user_id, predicted_class, COUNT(*) FROM {table} {where} GROUP BY user_id, predicted_class",
+                params)})
+        return counts
+
+    def rebuild_user_class_stats(self, user_ids=None):
+        # Un utilisateur par transaction ; BEGIN IMMEDIATE fait attendre les insertions concurrentes
+        if user_ids is None:
+            user_ids = [row[0] for row in self._query("SELECT id FROM users")]
+        for user_id in user_ids:
+            with self._connection() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    counts = self._class_counts(conn, user_id)
+                    conn.execute("DELETE FROM user_class_stats WHERE user_id = ?", (user_id,))
+                    conn.executemany(
+                        "INSERT INTO user_class_stats (user_id, predicted_class, prediction_count) VALUES (?, ?, ?)",
+                        [(owner, class_name, count) for (owner, class_name), count in sorted(counts.items())]
+                    )
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+        return len(user_ids)
+
+    def verify_user_class_stats(self):
+        # Lectures dans une même transaction : un seul instantané WAL
+        with self._connection() as conn:
+            conn.execute("BEGIN")
+            try:
+                expected = self._class_counts(conn)
+                actual = {(row[0], row[1]): row[2] for row in conn.execute(
+                    "SELECT user_id, predicted_class, prediction_count FROM user_class_stats WHERE prediction_count <> 0")}
+            finally:
+                conn.execute("COMMIT")
+        return class_stats_mismatches(expected, actual)
+
+    def image_reference_counts(self):
+        counts = Counter()
+        for table in ['predictions'] + self._archive_tables():
+            counts.update({row[0]: row[1] for row in self._query(
+                f"SELECT image_name, COUNT(*) FROM {table} GROUP BY image_name")})
+        return counts
+
+    def prediction_details(self, image_names):
+        if not image_names:
+            return {}
+        placeholders = ', '.join(['?'] * len(image_names))
+        rows = self._query(
+            f"SELECT image_name, predicted_class, confidence FROM predictions WHERE image_name IN ({placeholders})",
+            list(image_names)
+        )
+        return {row['image_name']: dict(row) for row in rows}
+
+    def stats(self):
+        journal_mode = self._query("PRAGMA journal_mode")[0][0]
+        page_count = self._query("PRAGMA page_count")[0][0]
+        page_size = self._query("PRAGMA page_size")[0][0]
+        wal_path = f"{self.path}-wal"
+        with self._lock:
+            connections, idle = self._open, len(self._idle)
+        return {
+            'backend': self.backend,
+            'path': self.path,
+            'journal_mode': journal_mode,
+            'size_bytes': page_count * page_size,
+            'wal_bytes': os.path.getsize(wal_path) if os.path.exists(wal_path) else 0,
+            'connections': connections,
+            'idle': idle
+        }
+
+    def close(self):
+        with self._lock:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._open -= len(idle)
+        for conn in idle:
+            conn.close()
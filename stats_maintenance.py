@@ -0,0 +1,57 @@
+import argparse
+import sys
+
+from stores import StorageError, store_from_env
+
+# Maintenance de user_class_stats (compteurs par utilisateur et par classe) :
+#
+#   python stats_maintenance.py verify             écarts avec predictions, code 1 si écart
+#   python stats_maintenance.py verify --repair    puis reconstruit les utilisateurs fautifs
+#   python stats_maintenance.py rebuild [--user 3 --user 7]
+#
+# Backend et base : STORAGE_BACKEND, DB_NAME / SQLITE_PATH comme app.py (défaut eurosat_db,
+# DB_NAME=dbtkinter_app pour le front Streamlit).
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vérification et réparation des statistiques par utilisateur")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    verify = sub.add_parser('verify', help="Compare user_class_stats au contenu de predictions")
+    verify.add_argument('--repair', action='store_true', help="Reconstruit les utilisateurs en écart")
+
+    rebuild = sub.add_parser('rebuild', help="Recalcule les compteurs depuis predictions et ses archives")
+    rebuild.add_argument('--user', type=int, action='append', help="Limite la reconstruction à cet utilisateur")
+    args = parser.parse_args()
+
+    store = store_from_env("eurosat_db")
+    try:
+        store.init_schema()
+        if args.command == 'rebuild':
+            count = store.rebuild_user_class_stats(args.user)
+            print(f"Statistiques reconstruites pour {count} utilisateur(s)")
+            return 0
+
+        mismatches = store.verify_user_class_stats()
+        for user_id, class_name, expected, actual in mismatches:
+            print(f"utilisateur {user_id} • {class_name}: predictions={expected} user_class_stats={actual}")
+        if not mismatches:
+            print("user_class_stats cohérente avec predictions")
+            return 0
+
+        users = sorted({user_id for user_id, _, _, _ in mismatches})
+        print(f"{len(mismatches)} écart(s) sur {len(users)} utilisateur(s)")
+        if args.repair:
+            store.rebuild_user_class_stats(users)
+            remaining = store.verify_user_class_stats()
+            print(f"Réparation terminée, {len(remaining)} écart(s) restant(s)")
+            return 1 if remaining else 0
+        return 1
+    except StorageError as e:
+        print(f"Erreur de maintenance: {e}")
+        return 2
+    finally:
+        store.close()
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,693 @@
+import base64
+import random
+import re
+import time
+from collections import Counter, defaultdict
+from datetime import date, datetime
+
+# Requêtes SQL MySQL partagées par stores.MySQLStore, asgi_app.py, stats_maintenance.py et retention.py
+# (équivalents SQLite dans sqlite_store.py).
+#
+# Historique : pagination par clé (keyset) sur (user_id, timestamp, id), servie par
+# l'index idx_predictions_user_time. Chaque page est une lecture d'index bornée, quelle
+# que soit la profondeur, contrairement à OFFSET qui relit toutes les lignes sautées.
+
+USERS_DDL = """
+    CREATE TABLE IF NOT EXISTS users (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        username VARCHAR(50) UNIQUE NOT NULL,
+        password VARCHAR(255) NOT NULL,
+        email VARCHAR(100),
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+PREDICTIONS_DDL = """
+    CREATE TABLE IF NOT EXISTS predictions (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        user_id INT NOT NULL,
+        image_name VARCHAR(255) NOT NULL,
+        predicted_class VARCHAR(50) NOT NULL,
+        confidence FLOAT NOT NULL,
+        model_version VARCHAR(128),
+        probabilities VARBINARY(255),
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+    )
+"""
+
+HISTORY_INDEX = 'idx_predictions_user_time'
+HISTORY_DEFAULT_LIMIT = 50
+HISTORY_MAX_LIMIT = 500
+
+HISTORY_COLUMNS = "id, image_name, predicted_class, confidence, timestamp, probabilities"
+
+HISTORY_FIRST_PAGE_SQL = f"""
+    SELECT {HISTORY_COLUMNS}
+    FROM predictions
+    WHERE user_id = %s
+    ORDER BY timestamp DESC, id DESC
+    LIMIT %s
+"""
+
+# Forme développée plutôt que (timestamp, id) < (%s, %s) : MySQL l'utilise toujours
+# comme intervalle sur l'index composite
+HISTORY_NEXT_PAGE_SQL = f"""
+    SELECT {HISTORY_COLUMNS}
+    FROM predictions
+    WHERE user_id = %s
+      AND (timestamp < %s OR (timestamp = %s AND id < %s))
+    ORDER BY timestamp DESC, id DESC
+    LIMIT %s
+"""
+
+
+# Recherche par incertitude : les N dernières prédictions de l'utilisateur ayant un vecteur,
+# lues par l'index d'historique puis filtrées en numpy (probabilities.py)
+UNCERTAINTY_DEFAULT_SCAN = 5000
+UNCERTAINTY_MAX_SCAN = 50000
+
+UNCERTAINTY_SCAN_SQL = f"""
+    SELECT {HISTORY_COLUMNS}
+    FROM predictions
+    WHERE user_id = %s AND probabilities IS NOT NULL
+    ORDER BY timestamp DESC, id DESC
+    LIMIT %s
+"""
+
+
+def ensure_history_index(cursor):
+    cursor.execute(f"SHOW INDEX FROM predictions WHERE Key_name = '{HISTORY_INDEX}'")
+    if not cursor.fetchall():
+        cursor.execute(f"CREATE INDEX {HISTORY_INDEX} ON predictions (user_id, timestamp, id)")
+
+
+def ensure_probabilities_column(cursor):
+    # Bases créées avant le stockage du vecteur softmax (float16, 2 octets par classe)
+    cursor.execute("SHOW COLUMNS FROM predictions LIKE 'probabilities'")
+    if cursor.fetchone() is None:
+        cursor.execute("ALTER TABLE predictions ADD COLUMN probabilities VARBINARY(255) AFTER model_version")
+
+
+def parse_limit(value, default=HISTORY_DEFAULT_LIMIT, maximum=HISTORY_MAX_LIMIT):
+    limit = int(value) if value not in (None, '') else default
+    if limit < 1:
+        raise ValueError("limit doit être positif")
+    return min(limit, maximum)
+
+
+def encode_cursor(row):
+    raw = f"{row['timestamp'].isoformat()}|{row['id']}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        timestamp, row_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except Exception:
+        raise ValueError("Curseur invalide")
+
+
+def history_query(user_id, limit, cursor=None):
+    # Une ligne de plus que demandé pour savoir s'il reste une page
+    if cursor:
+        timestamp, row_id = decode_cursor(cursor)
+        return HISTORY_NEXT_PAGE_SQL, (user_id, timestamp, timestamp, row_id, limit + 1)
+    return HISTORY_FIRST_PAGE_SQL, (user_id, limit + 1)
+
+
+def history_page(rows, limit):
+    # Renvoie (lignes sans id, curseur de la page suivante ou None)
+    rows = list(rows)
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    rows = rows[:limit]
+    for row in rows:
+        row.pop('id', None)
+    return rows, next_cursor
+
+
+def fetch_history(conn, user_id, limit=HISTORY_DEFAULT_LIMIT, cursor=None):
+    sql, params = history_query(user_id, limit, cursor)
+    db_cursor = conn.cursor(dictionary=True)
+    try:
+        db_cursor.execute(sql, params)
+        return history_page(db_cursor.fetchall(), limit)
+    finally:
+        db_cursor.close()
+
+
+def fetch_uncertainty_scan(conn, user_id, scan=UNCERTAINTY_DEFAULT_SCAN):
+    db_cursor = conn.cursor(dictionary=True)
+    try:
+        db_cursor.execute(UNCERTAINTY_SCAN_SQL, (user_id, scan))
+        rows = db_cursor.fetchall()
+    finally:
+        db_cursor.close()
+    for row in rows:
+        row.pop('id', None)
+    return rows
+
+
+def fetch_recent(conn, user_id, n=5):
+    # Tableau de bord : les n dernières analyses, sans curseur ni ligne de contrôle
+    db_cursor = conn.cursor(dictionary=True)
+    try:
+        db_cursor.execute(HISTORY_FIRST_PAGE_SQL, (user_id, n))
+        rows = db_cursor.fetchall()
+    finally:
+        db_cursor.close()
+    for row in rows:
+        row.pop('id', None)
+    return rows
+
+
+# Statistiques par utilisateur : user_class_stats est mise à jour dans la même transaction
+# que chaque insertion dans predictions, /api/stats devient une lecture par clé primaire
+# (au plus une ligne par classe) quelle que soit la taille de l'historique.
+
+USER_CLASS_STATS_DDL = """
+    CREATE TABLE IF NOT EXISTS user_class_stats (
+        user_id INT NOT NULL,
+        predicted_class VARCHAR(50) NOT NULL,
+        prediction_count INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, predicted_class),
+        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+    )
+"""
+
+INSERT_PREDICTION_SQL = (
+    "INSERT INTO predictions (user_id, image_name, predicted_class, confidence, model_version, probabilities) "
+    "VALUES (%s, %s, %s, %s, %s, %s)"
+)
+
+# Écriture différée : l'horodatage est celui de la requête, pas celui du COMMIT
+INSERT_PREDICTION_AT_SQL = (
+    "INSERT INTO predictions (user_id, image_name, predicted_class, confidence, model_version, probabilities, timestamp) "
+    "VALUES (%s, %s, %s, %s, %s, %s, %s)"
+)
+
+INCREMENT_CLASS_STATS_SQL = """
+    INSERT INTO user_class_stats (user_id, predicted_class, prediction_count)
+    VALUES (%s, %s, %s)
+    ON DUPLICATE KEY UPDATE prediction_count = prediction_count + VALUES(prediction_count)
+"""
+
+USER_STATS_SQL = """
+    SELECT predicted_class, prediction_count
+    FROM user_class_stats
+    WHERE user_id = %s AND prediction_count > 0
+    ORDER BY prediction_count DESC
+"""
+
+
+def class_stat_increments(rows):
+    # rows : (user_id, image_name, predicted_class, confidence, model_version, probabilities[, timestamp])
+    # Ordre fixe des clés pour que deux transactions concurrentes verrouillent dans le même ordre
+    counts = Counter((row[0], row[2]) for row in rows)
+    return [(user_id, class_name, count) for (user_id, class_name), count in sorted(counts.items())]
+
+
+def insert_predictions(conn, rows):
+    if not rows:
+        return
+    cursor = conn.cursor()
+    try:
+        conn.start_transaction()
+        cursor.executemany(INSERT_PREDICTION_AT_SQL if len(rows[0]) == 7 else INSERT_PREDICTION_SQL, rows)
+        cursor.executemany(INCREMENT_CLASS_STATS_SQL, class_stat_increments(rows))
+        cursor.executemany(INCREMENT_DAILY_ROLLUP_SQL, daily_rollup_increments(rows))
+        cursor.executemany(INCREMENT_CLASS_ROLLUP_SQL, class_rollup_increments(rows))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def stats_from_rows(rows):
+    class_distribution = {class_name: int(count) for class_name, count in rows}
+    return {
+        'total_predictions': sum(class_distribution.values()),
+        'class_distribution': class_distribution
+    }
+
+
+def fetch_user_stats(conn, user_id):
+    cursor = conn.cursor()
+    try:
+        cursor.execute(USER_STATS_SQL, (user_id,))
+        return stats_from_rows(cursor.fetchall())
+    finally:
+        cursor.close()
+
+
+def ensure_user_class_stats(conn, cursor):
+    cursor.execute(USER_CLASS_STATS_DDL)
+    # Premier déploiement sur une base existante : remplissage initial
+    cursor.execute("SELECT EXISTS(SELECT 1 FROM user_class_stats), EXISTS(SELECT 1 FROM predictions)")
+    has_stats, has_predictions = cursor.fetchone()
+    if has_predictions and not has_stats:
+        print(f"Statistiques par utilisateur reconstruites pour {rebuild_user_class_stats(conn)} utilisateur(s)")
+
+
+def rebuild_user_class_stats(conn, user_ids=None):
+    # Recalcule les compteurs depuis predictions et ses archives, un utilisateur par
+    # transaction. Les lignes de l'utilisateur sont verrouillées avant le comptage : une
+    # insertion concurrente attend la fin de la réparation et s'ajoute au compteur recalculé.
+    cursor = conn.cursor()
+    try:
+        if user_ids is None:
+            cursor.execute("SELECT id FROM users")
+            user_ids = [row[0] for row in cursor.fetchall()]
+        # Les archives ne changent qu'avec retention.py, exclu pendant la réparation (verrou nommé)
+        archived = archived_class_counts(cursor)
+        for user_id in user_ids:
+            conn.start_transaction()
+            try:
+                cursor.execute("SELECT predicted_class FROM user_class_stats WHERE user_id = %s FOR UPDATE", (user_id,))
+                cursor.fetchall()
+                cursor.execute(
+                    "SELECT predicted_class, COUNT(*) FROM predictions WHERE user_id = %s GROUP BY predicted_class",
+                    (user_id,)
+                )
+                counts = Counter(dict(cursor.fetchall()))
+                counts.update({class_name: count for (owner, class_name), count in archived.items() if owner == user_id})
+                cursor.execute("DELETE FROM user_class_stats WHERE user_id = %s", (user_id,))
+                if counts:
+                    cursor.executemany(
+                        "INSERT INTO user_class_stats (user_id, predicted_class, prediction_count) VALUES (%s, %s, %s)",
+                        [(user_id, class_name, count) for class_name, count in sorted(counts.items())]
+                    )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        return len(user_ids)
+    finally:
+        cursor.close()
+
+
+def verify_user_class_stats(conn):
+    # Compare les compteurs au contenu brut de predictions dans un même instantané.
+    # Renvoie [(user_id, classe, attendu, enregistré)] pour chaque écart.
+    cursor = conn.cursor()
+    try:
+        conn.start_transaction(consistent_snapshot=True, readonly=True)
+        cursor.execute("SELECT user_id, predicted_class, COUNT(*) FROM predictions GROUP BY user_id, predicted_class")
+        expected = Counter({(user_id, class_name): count for user_id, class_name, count in cursor.fetchall()})
+        expected.update(archived_class_counts(cursor))
+        cursor.execute("SELECT user_id, predicted_class, prediction_count FROM user_class_stats WHERE prediction_count <> 0")
+        actual = {(user_id, class_name): count for user_id, class_name, count in cursor.fetchall()}
+        conn.commit()
+    finally:
+        cursor.close()
+    return class_stats_mismatches(expected, actual)
+
+
+def class_stats_mismatches(expected, actual):
+    # expected / actual : {(user_id, classe): compteur}, classes absentes comptées à 0
+    return [
+        (user_id, class_name, expected.get((user_id, class_name), 0), actual.get((user_id, class_name), 0))
+        for user_id, class_name in sorted(set(expected) | set(actual))
+        if expected.get((user_id, class_name), 0) != actual.get((user_id, class_name), 0)
+    ]
+
+
+# Agrégats journaliers par utilisateur et par classe, mis à jour dans la même transaction
+# que chaque insertion. Ils couvrent tout l'historique, archives comprises : les
+# statistiques sur une période (/api/stats?from=...&to=...) se lisent sur au plus
+# (jours x classes) lignes, sans relire les prédictions brutes.
+
+DAILY_ROLLUP_DDL = """
+    CREATE TABLE IF NOT EXISTS prediction_daily_rollups (
+        user_id INT NOT NULL,
+        day DATE NOT NULL,
+        predicted_class VARCHAR(50) NOT NULL,
+        prediction_count INT NOT NULL DEFAULT 0,
+        confidence_sum DOUBLE NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, day, predicted_class),
+        KEY idx_rollups_day (day),
+        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+    )
+"""
+
+# Jour NULL : ligne sans horodatage explicite, datée par MySQL comme predictions.timestamp
+INCREMENT_DAILY_ROLLUP_SQL = """
+    INSERT INTO prediction_daily_rollups (user_id, day, predicted_class, prediction_count, confidence_sum)
+    VALUES (%s, COALESCE(%s, CURDATE()), %s, %s, %s)
+    ON DUPLICATE KEY UPDATE prediction_count = prediction_count + VALUES(prediction_count),
+                            confidence_sum = confidence_sum + VALUES(confidence_sum)
+"""
+
+USER_STATS_BETWEEN_SQL = """
+    SELECT predicted_class, SUM(prediction_count)
+    FROM prediction_daily_rollups
+    WHERE user_id = %s AND day BETWEEN %s AND %s
+    GROUP BY predicted_class
+    HAVING SUM(prediction_count) > 0
+    ORDER BY SUM(prediction_count) DESC
+"""
+
+
+def daily_rollup_increments(rows):
+    # (user_id, jour ou None, classe, nombre, somme des confiances), ordre fixe des clés
+    totals = defaultdict(lambda: [0, 0.0])
+    for row in rows:
+        day = row[6].date() if len(row) == 7 else None
+        total = totals[(row[0], day, row[2])]
+        total[0] += 1
+        total[1] += float(row[3])
+    return [
+        (user_id, day, class_name, count, confidence_sum)
+        for (user_id, day, class_name), (count, confidence_sum)
+        in sorted(totals.items(), key=lambda item: (item[0][0], item[0][1] or date.max, item[0][2]))
+    ]
+
+
+def parse_day(value):
+    return date.fromisoformat(value) if value not in (None, '') else None
+
+
+def fetch_user_stats_between(conn, user_id, start, end):
+    cursor = conn.cursor()
+    try:
+        cursor.execute(USER_STATS_BETWEEN_SQL, (user_id, start, end))
+        return stats_from_rows(cursor.fetchall())
+    finally:
+        cursor.close()
+
+
+def rebuild_daily_rollups(conn, days=None):
+    # Recalcule les agrégats (par utilisateur et globaux) des jours encore présents dans
+    # predictions, un jour par transaction (même verrouillage que rebuild_user_class_stats).
+    # Les jours archivés n'ont plus de lignes brutes : leurs agrégats sont conservés tels quels.
+    cursor = conn.cursor()
+    try:
+        if days is None:
+            cursor.execute("SELECT DISTINCT DATE(timestamp) FROM predictions")
+            days = sorted(row[0] for row in cursor.fetchall())
+        for day in days:
+            conn.start_transaction()
+            try:
+                cursor.execute("SELECT user_id FROM prediction_daily_rollups WHERE day = %s FOR UPDATE", (day,))
+                cursor.fetchall()
+                cursor.execute("SELECT shard FROM class_daily_rollups WHERE day = %s FOR UPDATE", (day,))
+                cursor.fetchall()
+                cursor.execute(
+                    "SELECT user_id, predicted_class, COUNT(*), SUM(confidence), SUM(confidence < %s) FROM predictions "
+                    "WHERE timestamp >= %s AND timestamp < %s + INTERVAL 1 DAY "
+                    "GROUP BY user_id, predicted_class",
+                    (LOW_CONFIDENCE_THRESHOLD, day, day)
+                )
+                totals = cursor.fetchall()
+                if not totals:
+                    conn.rollback()
+                    continue
+                cursor.execute("DELETE FROM prediction_daily_rollups WHERE day = %s", (day,))
+                cursor.executemany(
+                    "INSERT INTO prediction_daily_rollups (user_id, day, predicted_class, prediction_count, confidence_sum) "
+                    "VALUES (%s, %s, %s, %s, %s)",
+                    [(user_id, day, class_name, count, float(confidence_sum))
+                     for user_id, class_name, count, confidence_sum, _ in sorted(totals)]
+                )
+                by_class = defaultdict(lambda: [0, 0.0, 0])
+                for _, class_name, count, confidence_sum, low_count in totals:
+                    total = by_class[class_name]
+                    total[0] += count
+                    total[1] += float(confidence_sum)
+                    total[2] += int(low_count)
+                cursor.execute("DELETE FROM class_daily_rollups WHERE day = %s", (day,))
+                cursor.executemany(
+                    "INSERT INTO class_daily_rollups (day, predicted_class, shard, prediction_count, confidence_sum, "
+                    "low_confidence_count) VALUES (%s, %s, 0, %s, %s, %s)",
+                    [(day, class_name, *total) for class_name, total in sorted(by_class.items())]
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        return len(days)
+    finally:
+        cursor.close()
+
+
+# Agrégats globaux par jour et par classe (/api/analytics) : nombre, somme des
+# confiances et nombre de prédictions sous LOW_CONFIDENCE_THRESHOLD. Toutes les
+# insertions du jour touchent les mêmes (jour, classe) : chaque transaction écrit dans
+# une sous-ligne (shard) tirée au hasard parmi ANALYTICS_SHARDS pour ne pas se
+# sérialiser sur un verrou unique ; les sous-lignes sont additionnées à la lecture
+# (analytics.py). Le seuil est figé dans les compteurs, le changer demande un
+# 'retention.py rollup' sur les jours concernés.
+
+LOW_CONFIDENCE_THRESHOLD = 0.6
+ANALYTICS_SHARDS = 8
+ANALYTICS_MAX_DAYS = 3660
+
+CLASS_ROLLUP_DDL = """
+    CREATE TABLE IF NOT EXISTS class_daily_rollups (
+        day DATE NOT NULL,
+        predicted_class VARCHAR(50) NOT NULL,
+        shard TINYINT NOT NULL,
+        prediction_count INT NOT NULL DEFAULT 0,
+        confidence_sum DOUBLE NOT NULL DEFAULT 0,
+        low_confidence_count INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, predicted_class, shard)
+    )
+"""
+
+INCREMENT_CLASS_ROLLUP_SQL = """
+    INSERT INTO class_daily_rollups (day, predicted_class, shard, prediction_count, confidence_sum, low_confidence_count)
+    VALUES (COALESCE(%s, CURDATE()), %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE prediction_count = prediction_count + VALUES(prediction_count),
+                            confidence_sum = confidence_sum + VALUES(confidence_sum),
+                            low_confidence_count = low_confidence_count + VALUES(low_confidence_count)
+"""
+
+CLASS_ROLLUP_RANGE_SQL = """
+    SELECT day, predicted_class, prediction_count, confidence_sum, low_confidence_count
+    FROM class_daily_rollups
+    WHERE day BETWEEN %s AND %s
+"""
+
+
+def class_rollup_increments(rows, shard=None):
+    # (jour ou None, classe, shard, nombre, somme des confiances, nombre sous le seuil)
+    shard = random.randrange(ANALYTICS_SHARDS) if shard is None else shard
+    totals = defaultdict(lambda: [0, 0.0, 0])
+    for row in rows:
+        total = totals[(row[6].date() if len(row) == 7 else None, row[2])]
+        total[0] += 1
+        total[1] += float(row[3])
+        total[2] += int(float(row[3]) < LOW_CONFIDENCE_THRESHOLD)
+    return [
+        (day, class_name, shard, *total)
+        for (day, class_name), total in sorted(totals.items(), key=lambda item: (item[0][0] or date.max, item[0][1]))
+    ]
+
+
+def fetch_class_rollups(conn, start, end):
+    cursor = conn.cursor()
+    try:
+        cursor.execute(CLASS_ROLLUP_RANGE_SQL, (start, end))
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+def ensure_rollups(conn, cursor):
+    # Les deux tables d'abord : la reconstruction des agrégats journaliers écrit dans les deux
+    cursor.execute(DAILY_ROLLUP_DDL)
+    cursor.execute(CLASS_ROLLUP_DDL)
+    cursor.execute(
+        "SELECT EXISTS(SELECT 1 FROM prediction_daily_rollups), EXISTS(SELECT 1 FROM class_daily_rollups), "
+        "EXISTS(SELECT 1 FROM predictions)"
+    )
+    has_rollups, has_class_rollups, has_predictions = cursor.fetchone()
+    if has_rollups and not has_class_rollups:
+        # Base antérieure aux agrégats globaux : jours archivés depuis les archives
+        for table in archive_tables(cursor):
+            cursor.execute(
+                f"INSERT INTO class_daily_rollups (day, predicted_class, shard, prediction_count, confidence_sum, "
+                f"low_confidence_count) "
+                f"SELECT DATE(timestamp), predicted_class, 0, COUNT(*), SUM(confidence), SUM(confidence < %s) "
+                f"FROM {table} GROUP BY DATE(timestamp), predicted_class "
+                f"ON DUPLICATE KEY UPDATE prediction_count = prediction_count + VALUES(prediction_count), "
+                f"confidence_sum = confidence_sum + VALUES(confidence_sum), "
+                f"low_confidence_count = low_confidence_count + VALUES(low_confidence_count)",
+                (LOW_CONFIDENCE_THRESHOLD,)
+            )
+    # Jours présents dans predictions, agrégats par utilisateur et globaux ensemble
+    if has_predictions and (not has_rollups or not has_class_rollups):
+        print(f"Agrégats journaliers reconstruits pour {rebuild_daily_rollups(conn)} jour(s)")
+
+
+# Rétention : les mois plus anciens que la fenêtre conservée quittent predictions pour
+# une table d'archive par mois (predictions_archive_AAAAMM), rotation de tables à la
+# place du partitionnement natif (MySQL refuse PARTITION BY sur une table à clé
+# étrangère, et le ALTER réécrirait toute la table sous verrou). Les archives sont
+# compressées, sans index secondaire ni clé étrangère ; un mois entier se supprime
+# ou s'exporte d'un bloc comme une partition.
+#
+# Déplacement par lots de quelques centaines de lignes, une courte transaction chacun :
+# seules les lignes anciennes sont verrouillées, les insertions (toujours en fin
+# d'index) ne les attendent pas. predictions garde une taille bornée, les index
+# d'historique et de statistiques aussi.
+
+ARCHIVE_PREFIX = 'predictions_archive_'
+TIME_INDEX = 'idx_predictions_time'
+MAINTENANCE_LOCK = 'eurosat_retention'
+
+ARCHIVE_DDL = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        id INT NOT NULL PRIMARY KEY,
+        user_id INT NOT NULL,
+        image_name VARCHAR(255) NOT NULL,
+        predicted_class VARCHAR(50) NOT NULL,
+        confidence FLOAT NOT NULL,
+        model_version VARCHAR(128),
+        probabilities VARBINARY(255),
+        timestamp TIMESTAMP NOT NULL
+    ) ROW_FORMAT=COMPRESSED
+"""
+
+ARCHIVE_COLUMNS = "id, user_id, image_name, predicted_class, confidence, model_version, probabilities, timestamp"
+
+
+def archive_table(month):
+    return f"{ARCHIVE_PREFIX}{month.year:04d}{month.month:02d}"
+
+
+def month_start(day, months_back=0):
+    index = day.year * 12 + day.month - 1 - months_back
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def archive_tables(cursor):
+    cursor.execute(f"SHOW TABLES LIKE '{ARCHIVE_PREFIX}%'")
+    return sorted(name for (name,) in cursor.fetchall() if re.fullmatch(rf"{ARCHIVE_PREFIX}\d{{6}}", name))
+
+
+def archived_class_counts(cursor):
+    counts = Counter()
+    for table in archive_tables(cursor):
+        cursor.execute(f"SELECT user_id, predicted_class, COUNT(*) FROM {table} GROUP BY user_id, predicted_class")
+        counts.update({(user_id, class_name): count for user_id, class_name, count in cursor.fetchall()})
+    return counts
+
+
+def image_reference_counts(cursor):
+    # Prédictions par image_name, archives comprises (ramasse-miettes de upload_store.py)
+    counts = Counter()
+    for table in ['predictions'] + archive_tables(cursor):
+        cursor.execute(f"SELECT image_name, COUNT(*) FROM {table} GROUP BY image_name")
+        counts.update(dict(cursor.fetchall()))
+    return counts
+
+
+def ensure_time_index(cursor):
+    # Index du déplacement par date ; créé sans bloquer les écritures (DDL en ligne)
+    cursor.execute(f"SHOW INDEX FROM predictions WHERE Key_name = '{TIME_INDEX}'")
+    if not cursor.fetchall():
+        cursor.execute(f"CREATE INDEX {TIME_INDEX} ON predictions (timestamp, id) ALGORITHM=INPLACE LOCK=NONE")
+
+
+def acquire_maintenance_lock(cursor):
+    # Un seul processus de maintenance à la fois (retention.py, stats_maintenance.py)
+    cursor.execute("SELECT GET_LOCK(%s, 0)", (MAINTENANCE_LOCK,))
+    return cursor.fetchone()[0] == 1
+
+
+def release_maintenance_lock(cursor):
+    # Connexion du pool : le verrou survivrait à sa remise dans le pool
+    cursor.execute("SELECT RELEASE_LOCK(%s)", (MAINTENANCE_LOCK,))
+    cursor.fetchone()
+
+
+def archive_batch(conn, cutoff, batch_size, existing=None):
+    # Déplace jusqu'à batch_size lignes antérieures à cutoff ; renvoie {table: lignes}.
+    # existing : tables d'archive déjà créées, complété au besoin (partagé entre les lots)
+    cursor = conn.cursor()
+    try:
+        if existing is None:
+            existing = set(archive_tables(cursor))
+        while True:
+            conn.start_transaction()
+            try:
+                cursor.execute(
+                    f"SELECT {ARCHIVE_COLUMNS} FROM predictions WHERE timestamp < %s "
+                    f"ORDER BY timestamp, id LIMIT %s FOR UPDATE",
+                    (cutoff, batch_size)
+                )
+                rows = cursor.fetchall()
+                by_table = defaultdict(list)
+                for row in rows:
+                    by_table[archive_table(row[7])].append(row)
+                missing = sorted(set(by_table) - existing)
+                if missing:
+                    # CREATE TABLE valide implicitement la transaction en cours : tables
+                    # créées hors transaction, puis le lot est relu et verrouillé à nouveau
+                    conn.rollback()
+                    for table in missing:
+                        cursor.execute(ARCHIVE_DDL.format(table=table))
+                        existing.add(table)
+                    continue
+                for table, table_rows in sorted(by_table.items()):
+                    cursor.executemany(
+                        f"INSERT INTO {table} ({ARCHIVE_COLUMNS}) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)", table_rows
+                    )
+                if rows:
+                    placeholders = ', '.join(['%s'] * len(rows))
+                    cursor.execute(f"DELETE FROM predictions WHERE id IN ({placeholders})", [row[0] for row in rows])
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            return {table: len(table_rows) for table, table_rows in by_table.items()}
+    finally:
+        cursor.close()
+
+
+def archive_before(conn, cutoff, batch_size=500, pause=0.05, progress=None):
+    # Lots successifs jusqu'à épuisement ; la pause laisse passer les insertions et la réplication
+    moved = Counter()
+    cursor = conn.cursor()
+    try:
+        existing = set(archive_tables(cursor))
+    finally:
+        cursor.close()
+    while True:
+        batch = archive_batch(conn, cutoff, batch_size, existing)
+        if not batch:
+            return dict(moved)
+        moved.update(batch)
+        if progress is not None:
+            progress(dict(moved))
+        if pause:
+            time.sleep(pause)
+
+
+def retention_status(conn):
+    # Lignes par mois dans predictions (timestamp) et dans chaque archive
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT DATE_FORMAT(timestamp, '%Y-%m'), COUNT(*) FROM predictions GROUP BY 1 ORDER BY 1"
+        )
+        live = {month: count for month, count in cursor.fetchall()}
+        archived = {}
+        for table in archive_tables(cursor):
+            cursor.execute(f"SELECT COUNT(*) FROM {table}")
+            suffix = table[len(ARCHIVE_PREFIX):]
+            archived[f"{suffix[:4]}-{suffix[4:]}"] = cursor.fetchone()[0]
+        cursor.execute("SELECT MIN(day), MAX(day), COUNT(*) FROM prediction_daily_rollups")
+        first_day, last_day, rollup_rows = cursor.fetchone()
+        return {
+            'live': live,
+            'archived': archived,
+            'rollups': {'first_day': first_day, 'last_day': last_day, 'rows': rollup_rows}
+        }
+    finally:
+        cursor.close()
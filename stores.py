@@ -0,0 +1,213 @@
+import os
+from contextlib import contextmanager
+
+try:
+    from mysql.connector import DataError as MySQLDataError, Error as MySQLError, IntegrityError as MySQLIntegrityError
+except ImportError:
+    MySQLError = MySQLDataError = MySQLIntegrityError = None
+
+from storage import (USERS_DDL, PREDICTIONS_DDL, acquire_maintenance_lock, archive_before, ensure_history_index,
+                     ensure_probabilities_column, ensure_rollups, ensure_time_index, ensure_user_class_stats,
+                     fetch_class_rollups, fetch_history, fetch_recent, fetch_uncertainty_scan, fetch_user_stats,
+                     fetch_user_stats_between, image_reference_counts, insert_predictions, rebuild_daily_rollups,
+                     rebuild_user_class_stats, release_maintenance_lock, retention_status, verify_user_class_stats)
+
+# Accès aux données de app.py et appST.py : schéma, utilisateurs, insertions de prédictions,
+# historique et statistiques. Deux implémentations de la même interface :
+#
+#   STORAGE_BACKEND=mysql   MySQLStore, pool db_pool.py + requêtes de storage.py (défaut)
+#   STORAGE_BACKEND=sqlite  SQLiteStore (sqlite_store.py), fichier SQLITE_PATH en mode WAL,
+#                           sans serveur : machine isolée, banc de test
+#
+# Les erreurs de la base sont levées en StorageError ; ValueError (curseur invalide)
+# remonte telle quelle. Les données refusées (contrainte, type, longueur) sont levées en
+# RowRejected : les réessayer ne sert à rien.
+
+
+class StorageError(Exception):
+    pass
+
+
+class RowRejected(StorageError):
+    pass
+
+
+class MySQLStore:
+    backend = 'mysql'
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.name = pool.config['database']
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self.pool.connection()
+        except MySQLError as e:
+            raise StorageError(f"Connexion impossible: {e}") from e
+        try:
+            yield conn
+        except (MySQLDataError, MySQLIntegrityError) as e:
+            raise RowRejected(str(e)) from e
+        except MySQLError as e:
+            raise StorageError(str(e)) from e
+        finally:
+            conn.close()
+
+    def init_schema(self):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(USERS_DDL)
+                cursor.execute(PREDICTIONS_DDL)
+                # Bases créées avant le registre de modèles
+                cursor.execute("SHOW COLUMNS FROM predictions LIKE 'model_version'")
+                if cursor.fetchone() is None:
+                    cursor.execute("ALTER TABLE predictions ADD COLUMN model_version VARCHAR(128) AFTER confidence")
+                ensure_probabilities_column(cursor)
+                ensure_history_index(cursor)
+                ensure_user_class_stats(conn, cursor)
+                ensure_rollups(conn, cursor)
+            finally:
+                cursor.close()
+
+    def _fetchone(self, sql, params):
+        with self.connection() as conn:
+            cursor = conn.cursor(dictionary=True)
+            try:
+                cursor.execute(sql, params)
+                return cursor.fetchone()
+            finally:
+                cursor.close()
+
+    def _execute(self, sql, params):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(sql, params)
+            finally:
+                cursor.close()
+
+    def get_user(self, username):
+        return self._fetchone("SELECT id, username, password, email FROM users WHERE username = %s", (username,))
+
+    def email_exists(self, email):
+        return self._fetchone("SELECT id FROM users WHERE email = %s", (email,)) is not None
+
+    def create_user(self, username, email, password_hash):
+        self._execute("INSERT INTO users (username, email, password) VALUES (%s, %s, %s)",
+                      (username, email, password_hash))
+
+    def update_password(self, user_id, password_hash):
+        self._execute("UPDATE users SET password = %s WHERE id = %s", (password_hash, user_id))
+
+    def insert_predictions(self, rows):
+        with self.connection() as conn:
+            insert_predictions(conn, rows)
+
+    def fetch_history(self, user_id, limit, cursor=None):
+        with self.connection() as conn:
+            return fetch_history(conn, user_id, limit, cursor)
+
+    def fetch_recent(self, user_id, n=5):
+        with self.connection() as conn:
+            return fetch_recent(conn, user_id, n)
+
+    def fetch_uncertainty_scan(self, user_id, scan):
+        with self.connection() as conn:
+            return fetch_uncertainty_scan(conn, user_id, scan)
+
+    def fetch_user_stats(self, user_id):
+        with self.connection() as conn:
+            return fetch_user_stats(conn, user_id)
+
+    def fetch_user_stats_between(self, user_id, start, end):
+        with self.connection() as conn:
+            return fetch_user_stats_between(conn, user_id, start, end)
+
+    def fetch_class_rollups(self, start, end):
+        with self.connection() as conn:
+            return fetch_class_rollups(conn, start, end)
+
+    @contextmanager
+    def maintenance(self):
+        # Connexion dédiée, verrou nommé tenu pendant toute l'opération
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                if not acquire_maintenance_lock(cursor):
+                    raise StorageError("Une autre maintenance est en cours")
+                try:
+                    yield conn
+                finally:
+                    release_maintenance_lock(cursor)
+            finally:
+                cursor.close()
+
+    def archive_before(self, cutoff, batch_size=500, pause=0.05, progress=None):
+        with self.maintenance() as conn:
+            cursor = conn.cursor()
+            try:
+                ensure_time_index(cursor)
+            finally:
+                cursor.close()
+            return archive_before(conn, cutoff, batch_size, pause, progress)
+
+    def rebuild_daily_rollups(self, days=None):
+        with self.maintenance() as conn:
+            return rebuild_daily_rollups(conn, days)
+
+    def retention_status(self):
+        with self.connection() as conn:
+            return retention_status(conn)
+
+    # Les compteurs incluent les archives : pas de rétention en parallèle (même verrou)
+    def rebuild_user_class_stats(self, user_ids=None):
+        with self.maintenance() as conn:
+            return rebuild_user_class_stats(conn, user_ids)
+
+    def verify_user_class_stats(self):
+        with self.maintenance() as conn:
+            return verify_user_class_stats(conn)
+
+    def image_reference_counts(self):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                return image_reference_counts(cursor)
+            finally:
+                cursor.close()
+
+    def prediction_details(self, image_names):
+        if not image_names:
+            return {}
+        placeholders = ', '.join(['%s'] * len(image_names))
+        with self.connection() as conn:
+            cursor = conn.cursor(dictionary=True)
+            try:
+                cursor.execute(
+                    f"SELECT image_name, predicted_class, confidence FROM predictions WHERE image_name IN ({placeholders})",
+                    list(image_names)
+                )
+                return {row['image_name']: row for row in cursor.fetchall()}
+            finally:
+                cursor.close()
+
+    def stats(self):
+        stats = self.pool.stats()
+        stats['backend'] = self.backend
+        return stats
+
+    def close(self):
+        self.pool.close_all()
+
+
+def store_from_env(default_database):
+    backend = os.getenv("STORAGE_BACKEND", "mysql").lower()
+    if backend == 'sqlite':
+        from sqlite_store import SQLiteStore
+        return SQLiteStore(os.getenv("SQLITE_PATH", f"{default_database}.sqlite"))
+    if backend != 'mysql':
+        raise ValueError(f"STORAGE_BACKEND inconnu: {backend} (mysql, sqlite)")
+    from db_pool import pool_from_env
+    return MySQLStore(pool_from_env(default_database))
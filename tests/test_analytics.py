@@ -0,0 +1,49 @@
+from datetime import date
+
+import pytest
+
+pytest.importorskip('pandas')
+
+from analytics import parse_range, summarize
+
+
+def test_parse_range_defaults_and_limits():
+    start, end = parse_range(None, '2024-03-31', 'day')
+    assert (start, end) == (date(2024, 3, 2), date(2024, 3, 31))
+    with pytest.raises(ValueError):
+        parse_range('2024-04-01', '2024-03-01', 'day')
+    with pytest.raises(ValueError):
+        parse_range(None, None, 'month')
+
+
+def test_summarize_merges_shards_and_fills_empty_days():
+    rows = [
+        # (jour, classe, nombre, somme des confiances, nombre sous le seuil), deux shards le 1er
+        (date(2024, 3, 1), 'Forest', 2, 1.8, 0),
+        (date(2024, 3, 1), 'Forest', 1, 0.5, 1),
+        (date(2024, 3, 1), 'River', 1, 0.9, 0),
+        (date(2024, 3, 3), 'River', 4, 2.0, 4),
+    ]
+    summary = summarize(rows, date(2024, 3, 1), date(2024, 3, 3))
+
+    assert summary['total_predictions'] == 8
+    assert summary['classes']['River']['count'] == 5
+    assert summary['classes']['Forest']['share'] == 37.5
+    assert summary['low_confidence_rate'] == 62.5
+    assert [point['total'] for point in summary['series']] == [4, 0, 4]
+    assert summary['series'][0]['classes']['Forest'] == {'count': 3, 'share': 75.0, 'mean_confidence': 76.67}
+    assert summary['series'][1]['classes'] == {}
+
+
+def test_summarize_groups_by_week():
+    rows = [(date(2024, 3, 4), 'Forest', 1, 0.9, 0), (date(2024, 3, 10), 'Forest', 2, 1.6, 0),
+            (date(2024, 3, 11), 'Forest', 3, 2.7, 0)]
+    summary = summarize(rows, date(2024, 3, 4), date(2024, 3, 17), 'week')
+    assert [(point['start'], point['total']) for point in summary['series']] == [('2024-03-04', 3), ('2024-03-11', 3)]
+
+
+def test_summarize_without_rows():
+    summary = summarize([], date(2024, 3, 1), date(2024, 3, 2))
+    assert summary['total_predictions'] == 0
+    assert summary['classes'] == {}
+    assert [point['total'] for point in summary['series']] == [0, 0]
@@ -0,0 +1,112 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from batching import BatchingEngine
+
+
+class StubModel:
+    # Renvoie la somme de chaque tuile ; note le nombre maximal d'appels simultanés
+
+    def __init__(self, delay=0.01, fail=False):
+        self.delay = delay
+        self.fail = fail
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+        self.batch_sizes = []
+
+    def __call__(self, batch):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            self.batch_sizes.append(len(batch))
+        try:
+            time.sleep(self.delay)
+            if self.fail:
+                raise RuntimeError("échec du modèle")
+            return batch.reshape(len(batch), -1).sum(axis=1, keepdims=True)
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+def run_concurrently(fn, count):
+    results = [None] * count
+    errors = []
+
+    def worker(i):
+        try:
+            results[i] = fn(i)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    return results, errors
+
+
+def test_single_request_runs_immediately():
+    model = StubModel(delay=0)
+    engine = BatchingEngine(model, max_batch_size=8, max_wait_ms=50)
+    try:
+        assert engine.predict(np.full((2, 2), 3.0))[0] == 12.0
+        assert engine.stats()['immediate_runs'] == 1
+    finally:
+        engine.close()
+
+
+def test_concurrent_requests_are_batched_and_answered_in_order():
+    model = StubModel()
+    engine = BatchingEngine(model, max_batch_size=8, max_wait_ms=20)
+    try:
+        results, errors = run_concurrently(lambda i: engine.predict(np.full((2, 2), float(i))), 32)
+        assert not errors
+        assert [float(result[0]) for result in results] == [4.0 * i for i in range(32)]
+        stats = engine.stats()
+        assert stats['total_requests'] == 32
+        assert stats['total_batches'] < 32
+        assert max(model.batch_sizes) <= 8
+    finally:
+        engine.close()
+
+
+def test_run_batch_never_overlaps_scheduled_batches():
+    model = StubModel(delay=0.005)
+    engine = BatchingEngine(model, max_batch_size=4, max_wait_ms=2)
+    try:
+        def call(i):
+            if i % 4 == 0:
+                return engine.run_batch(np.ones((3, 2, 2)))
+            return engine.predict(np.ones((2, 2)))
+
+        _, errors = run_concurrently(call, 40)
+        assert not errors
+        assert model.max_active == 1
+    finally:
+        engine.close()
+
+
+def test_model_error_reaches_every_waiting_request():
+    model = StubModel(fail=True)
+    engine = BatchingEngine(model, max_batch_size=8, max_wait_ms=20)
+    try:
+        _, errors = run_concurrently(lambda i: engine.predict(np.ones((2, 2))), 6)
+        assert len(errors) == 6
+        assert all(isinstance(e, RuntimeError) for e in errors)
+    finally:
+        engine.close()
+
+
+def test_closed_engine_rejects_requests():
+    engine = BatchingEngine(StubModel(delay=0))
+    engine.close()
+    with pytest.raises(RuntimeError):
+        engine.predict(np.ones((2, 2)))
+    with pytest.raises(RuntimeError):
+        engine.run_batch(np.ones((1, 2, 2)))
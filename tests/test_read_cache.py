@@ -0,0 +1,73 @@
+from datetime import date, datetime
+from decimal import Decimal
+
+import numpy as np
+
+from read_cache import LocalBackend, ReadCache, dumps, loads
+
+
+def test_json_round_trip_keeps_dates():
+    value = {'rows': [{'timestamp': datetime(2024, 5, 1, 8, 30), 'day': date(2024, 5, 1),
+                       'confidence': Decimal('0.75'), 'count': np.int64(3)}]}
+    decoded = loads(dumps(value))
+    assert decoded['rows'][0] == {'timestamp': datetime(2024, 5, 1, 8, 30), 'day': date(2024, 5, 1),
+                                  'confidence': 0.75, 'count': 3}
+
+
+def test_invalidate_hides_previous_entries():
+    cache = ReadCache(max_entries=10, ttl=60)
+    key = cache.key('history', 1, 50)
+    cache.put(key, {'rows': [1]})
+    assert cache.get(key) == {'rows': [1]}
+
+    cache.invalidate(1)
+    assert cache.get(cache.key('history', 1, 50)) is None
+    # Les autres utilisateurs gardent leurs entrées
+    other = cache.key('history', 2, 50)
+    cache.put(other, [2])
+    cache.invalidate(1)
+    assert cache.get(cache.key('history', 2, 50)) == [2]
+
+
+def test_lru_evicts_oldest_entry():
+    cache = ReadCache(max_entries=2, ttl=60)
+    keys = [cache.key('stats', user_id) for user_id in range(3)]
+    for i, key in enumerate(keys):
+        cache.put(key, i)
+    assert cache.get(keys[0]) is None
+    assert cache.get(keys[2]) == 2
+    assert cache.stats()['evictions'] == 1
+
+
+def test_unencodable_value_is_skipped():
+    cache = ReadCache()
+    key = cache.key('stats', 1)
+    cache.put(key, {'value': object()})
+    assert cache.get(key) is None
+
+
+def test_shared_backend_spreads_invalidation_between_workers():
+    shared = LocalBackend()
+    writer = ReadCache(shared=shared, generation_ttl=0)
+    reader = ReadCache(shared=shared, generation_ttl=0)
+
+    key = reader.key('stats', 1)
+    reader.put(key, {'total': 1})
+    assert writer.get(writer.key('stats', 1)) == {'total': 1}
+
+    writer.invalidate(1)
+    assert reader.get(reader.key('stats', 1)) is None
+
+
+def test_generation_ttl_bounds_staleness():
+    shared = LocalBackend()
+    writer = ReadCache(shared=shared)
+    reader = ReadCache(shared=shared, generation_ttl=60)
+
+    writer.invalidate(1)
+    before = reader.key('stats', 1)
+    writer.invalidate(1)
+    # Génération gardée localement par le lecteur pendant generation_ttl
+    assert reader.key('stats', 1) == before
+    # Celui qui a inséré voit sa propre insertion tout de suite
+    assert writer.key('stats', 1) != before
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+import scene_tiling
+from scene_tiling import PillowScene, SceneJob, class_palette, owned_job_dir
+
+
+def write_scene(path, width, height, seed=0):
+    pixels = np.random.default_rng(seed).integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+    Image.fromarray(pixels).save(path)
+    return pixels
+
+
+def test_pillow_scene_converts_in_strips(tmp_path):
+    pixels = write_scene(str(tmp_path / 'scene.png'), 40, 70)
+    scene = PillowScene(str(tmp_path / 'scene.png'), str(tmp_path / 'scene.npy'), strip_height=16)
+    assert (scene.width, scene.height) == (40, 70)
+    assert np.array_equal(scene.read(5, 30, 20, 33), pixels[30:63, 5:25])
+    scene.close()
+
+    # Le cache est réutilisé sans redécoder la scène
+    (tmp_path / 'scene.png').unlink()
+    scene = PillowScene(str(tmp_path / 'scene.png'), str(tmp_path / 'scene.npy'))
+    assert np.array_equal(scene.read(0, 0, 40, 70), pixels)
+
+
+def test_pillow_scene_refuses_scenes_above_limit(tmp_path, monkeypatch):
+    write_scene(str(tmp_path / 'scene.png'), 40, 70)
+    monkeypatch.setattr(scene_tiling, 'PILLOW_MAX_PIXELS', 1000)
+    with pytest.raises(ValueError, match='rasterio'):
+        PillowScene(str(tmp_path / 'scene.png'), str(tmp_path / 'scene.npy'))
+    assert not (tmp_path / 'scene.npy').exists()
+
+
+def test_palette_covers_every_class():
+    palette = class_palette(14)
+    assert len(palette) == 14
+    assert tuple(palette[0]) == scene_tiling.CLASS_COLORS[0]
+    assert len({tuple(color) for color in palette}) == 14
+
+
+def test_job_renders_map_for_more_than_ten_classes(tmp_path, monkeypatch):
+    monkeypatch.setattr(scene_tiling, 'rasterio', None)
+    write_scene(str(tmp_path / 'scene.png'), 64, 48)
+    class_names = [f'classe{i}' for i in range(12)]
+
+    def predict(tiles):
+        probs = np.zeros((len(tiles), len(class_names)), dtype=np.float32)
+        probs[:, 11] = 1.0
+        return probs
+
+    job = SceneJob(str(tmp_path / 'scene.png'), str(tmp_path / 'jobs'), tile_size=16, stride=16)
+    events = list(job.run(predict, class_names, input_size=(8, 8)))
+    assert events[-1]['done']
+    assert events[-1]['summary']['classe11']['tiles'] == 12
+    rendered = np.asarray(Image.open(job.map_image_path))
+    assert rendered.shape == (3, 4, 3)
+    assert tuple(rendered[0, 0]) == tuple(class_palette(12)[11])
+
+
+def test_jobs_are_owned_per_user(tmp_path):
+    write_scene(str(tmp_path / 'scene.png'), 32, 32)
+    jobs_dir = str(tmp_path / 'jobs')
+    alice = SceneJob(str(tmp_path / 'scene.png'), jobs_dir, tile_size=16, owner=1)
+    bob = SceneJob(str(tmp_path / 'scene.png'), jobs_dir, tile_size=16, owner=2)
+    assert alice.job_id != bob.job_id
+    assert owned_job_dir(jobs_dir, alice.job_id, 1) == alice.work_dir
+    assert owned_job_dir(jobs_dir, alice.job_id, 2) is None
+    assert owned_job_dir(jobs_dir, 'inconnu', 1) is None
@@ -0,0 +1,61 @@
+import os
+
+import numpy as np
+
+from similarity import VectorIndex
+
+
+def random_vectors(count, dim=16, seed=0):
+    return np.random.default_rng(seed).normal(size=(count, dim)).astype(np.float32)
+
+
+def test_search_returns_nearest_neighbours(tmp_path):
+    index = VectorIndex(str(tmp_path), dim=16, background_training=False)
+    vectors = random_vectors(50)
+    index.add_many([f'{i}.png' for i in range(50)], vectors)
+
+    results = index.search(vectors[7], k=3)
+    assert results[0][0] == '7.png'
+    assert results[0][1] > 0.99
+    assert len(results) == 3
+    assert index.search(vectors[7], k=3, exclude='7.png')[0][0] != '7.png'
+
+
+def test_other_instances_see_appended_rows(tmp_path):
+    writer = VectorIndex(str(tmp_path), dim=16, background_training=False)
+    reader = VectorIndex(str(tmp_path), dim=16, background_training=False)
+    vectors = random_vectors(5)
+    writer.add_many([f'{i}.png' for i in range(4)], vectors[:4])
+    assert len(reader) == 4
+    writer.add('4.png', vectors[4])
+    assert reader.search(vectors[4], k=1)[0][0] == '4.png'
+
+
+def test_uncommitted_tail_is_ignored_and_overwritten(tmp_path):
+    index = VectorIndex(str(tmp_path), dim=16, background_training=False)
+    vectors = random_vectors(3)
+    index.add_many(['0.png', '1.png'], vectors[:2])
+    # Ajout interrompu après l'écriture des vecteurs, avant celle des noms et du commit
+    with open(os.path.join(str(tmp_path), 'vectors.f16'), 'ab') as f:
+        f.write(np.ones(16, dtype=np.float16).tobytes())
+
+    reopened = VectorIndex(str(tmp_path), dim=16, background_training=False)
+    assert len(reopened) == 2
+    reopened.add('2.png', vectors[2])
+    assert len(reopened) == 3
+    assert reopened.search(vectors[2], k=1)[0][0] == '2.png'
+    assert os.path.getsize(os.path.join(str(tmp_path), 'vectors.f16')) == 3 * 16 * 2
+
+
+def test_ivf_is_trained_past_threshold_and_used_for_search(tmp_path):
+    index = VectorIndex(str(tmp_path), dim=16, ivf_threshold=100, n_probe=64, background_training=False)
+    vectors = random_vectors(200)
+    index.add_many([f'{i}.png' for i in range(200)], vectors)
+    assert index.train()
+    assert not index.train()
+    assert os.path.exists(os.path.join(str(tmp_path), 'ivf.npz'))
+
+    # Les ajouts après l'entraînement sont affectés à une liste
+    extra = random_vectors(1, seed=1)
+    index.add('extra.png', extra[0])
+    assert index.search(extra[0], k=1)[0][0] == 'extra.png'
@@ -0,0 +1,107 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from sqlite_store import SQLiteStore
+from stores import RowRejected
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SQLiteStore(str(tmp_path / 'eurosat.sqlite'))
+    store.init_schema()
+    yield store
+    store.close()
+
+
+def add_user(store, username='alice'):
+    store.create_user(username, f'{username}@example.com', 'hash')
+    return store.get_user(username)['id']
+
+
+def row(user_id, name, class_name='Forest', confidence=0.9, timestamp=None):
+    values = (user_id, name, class_name, confidence, 'v1', None)
+    return values + (timestamp,) if timestamp is not None else values
+
+
+def test_init_schema_is_idempotent(store):
+    store.init_schema()
+    assert store.retention_status()['live'] == {}
+
+
+def test_insert_updates_counters_and_rollups(store):
+    user_id = add_user(store)
+    store.insert_predictions([row(user_id, 'a.png'), row(user_id, 'b.png', 'River', 0.4), row(user_id, 'c.png')])
+
+    stats = store.fetch_user_stats(user_id)
+    assert stats == {'total_predictions': 3, 'class_distribution': {'Forest': 2, 'River': 1}}
+    assert store.fetch_user_stats_between(user_id, date.today(), date.today()) == stats
+
+    rollups = {r[1]: r for r in store.fetch_class_rollups(date.today(), date.today())}
+    assert rollups['Forest'][2] == 2
+    assert rollups['River'][4] == 1
+
+
+def test_history_pages_follow_the_cursor(store):
+    user_id = add_user(store)
+    other_id = add_user(store, 'bob')
+    start = datetime(2024, 1, 1, 12, 0, 0)
+    # Plusieurs lignes par seconde : l'id départage les égalités d'horodatage
+    rows = [row(user_id, f'{i}.png', timestamp=start + timedelta(seconds=i // 3)) for i in range(10)]
+    store.insert_predictions(rows + [row(other_id, 'other.png', timestamp=start)])
+
+    names, cursor = [], None
+    while True:
+        page, cursor = store.fetch_history(user_id, 4, cursor)
+        assert len(page) <= 4
+        names.extend(item['image_name'] for item in page)
+        if cursor is None:
+            break
+    assert names == [f'{i}.png' for i in reversed(range(10))]
+    assert 'id' not in page[0]
+
+
+def test_invalid_cursor_raises_value_error(store):
+    with pytest.raises(ValueError):
+        store.fetch_history(1, 10, 'pas-un-curseur')
+
+
+def test_archive_moves_old_rows_and_keeps_rollups(store):
+    user_id = add_user(store)
+    old = datetime(2023, 3, 15, 10, 0, 0)
+    store.insert_predictions([row(user_id, 'old.png', timestamp=old), row(user_id, 'new.png')])
+
+    moved = store.archive_before(datetime(2024, 1, 1), pause=0)
+    assert moved == {'predictions_archive_202303': 1}
+    status = store.retention_status()
+    assert status['archived'] == {'2023-03': 1}
+    assert sum(status['live'].values()) == 1
+    # Les agrégats des jours archivés restent disponibles
+    assert store.fetch_user_stats_between(user_id, old.date(), old.date())['total_predictions'] == 1
+    assert store.image_reference_counts() == {'old.png': 1, 'new.png': 1}
+
+
+def test_verify_and_rebuild_user_class_stats(store):
+    user_id = add_user(store)
+    other_id = add_user(store, 'bob')
+    store.insert_predictions([row(user_id, 'old.png', timestamp=datetime(2023, 3, 15)), row(user_id, 'a.png'),
+                              row(user_id, 'b.png', 'River'), row(other_id, 'c.png')])
+    store.archive_before(datetime(2024, 1, 1), pause=0)
+    assert store.verify_user_class_stats() == []
+
+    # Compteurs désynchronisés : l'écart est signalé, la reconstruction compte aussi les archives
+    store._write([("UPDATE user_class_stats SET prediction_count = 7 WHERE user_id = ? AND predicted_class = 'Forest'",
+                   [(user_id,)])])
+    assert store.verify_user_class_stats() == [(user_id, 'Forest', 2, 7)]
+    assert store.rebuild_user_class_stats([user_id]) == 1
+    assert store.verify_user_class_stats() == []
+    assert store.fetch_user_stats(user_id)['class_distribution'] == {'Forest': 2, 'River': 1}
+    assert store.rebuild_user_class_stats() == 2
+    assert store.fetch_user_stats(other_id)['total_predictions'] == 1
+
+
+def test_rejected_rows_raise_row_rejected(store):
+    user_id = add_user(store)
+    with pytest.raises(RowRejected):
+        store.insert_predictions([(user_id, 'a.png', None, 0.9, 'v1', None)])
+    assert store.fetch_user_stats(user_id)['total_predictions'] == 0
@@ -0,0 +1,45 @@
+from datetime import date, datetime
+
+import pytest
+
+from storage import (class_rollup_increments, class_stat_increments, daily_rollup_increments, decode_cursor,
+                     encode_cursor, history_page, parse_limit)
+
+
+def test_cursor_round_trip():
+    cursor = encode_cursor({'timestamp': datetime(2024, 5, 1, 8, 30, 15), 'id': 42})
+    assert '=' not in cursor
+    assert decode_cursor(cursor) == (datetime(2024, 5, 1, 8, 30, 15), 42)
+
+
+@pytest.mark.parametrize('cursor', ['', 'pas-un-curseur', 'MjAyNHwx'])
+def test_invalid_cursor(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+def test_history_page_uses_last_returned_row_for_cursor():
+    rows = [{'id': i, 'timestamp': datetime(2024, 5, 1, 8, 0, 10 - i)} for i in range(4)]
+    page, cursor = history_page(rows, 3)
+    assert len(page) == 3 and 'id' not in page[0]
+    assert decode_cursor(cursor) == (datetime(2024, 5, 1, 8, 0, 8), 2)
+    assert history_page(rows[:2], 3)[1] is None
+
+
+def test_parse_limit():
+    assert parse_limit(None) == 50
+    assert parse_limit('10') == 10
+    assert parse_limit('100000') == 500
+    with pytest.raises(ValueError):
+        parse_limit('0')
+
+
+def test_increments_are_grouped_in_key_order():
+    day = datetime(2024, 5, 1, 9, 0)
+    rows = [(2, 'a', 'River', 0.5, 'v1', None, day), (1, 'b', 'Forest', 0.9, 'v1', None, day),
+            (2, 'c', 'River', 0.7, 'v1', None, day)]
+    assert class_stat_increments(rows) == [(1, 'Forest', 1), (2, 'River', 2)]
+    assert daily_rollup_increments(rows) == [(1, date(2024, 5, 1), 'Forest', 1, 0.9),
+                                             (2, date(2024, 5, 1), 'River', 2, 1.2)]
+    assert class_rollup_increments(rows, 3) == [(date(2024, 5, 1), 'Forest', 3, 1, 0.9, 0),
+                                                (date(2024, 5, 1), 'River', 3, 2, 1.2, 1)]
@@ -0,0 +1,88 @@
+import os
+import time
+from io import BytesIO
+
+import pytest
+
+pytest.importorskip('werkzeug')
+Image = pytest.importorskip('PIL.Image')
+
+from upload_store import UploadStore, VARIANTS
+
+
+def png_bytes(color, size=(300, 200)):
+    out = BytesIO()
+    Image.new('RGB', size, color).save(out, 'PNG')
+    return out.getvalue()
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = UploadStore(str(tmp_path / 'uploads'), str(tmp_path / 'uploads.sqlite'))
+    yield store
+    store.close()
+
+
+def test_same_content_is_stored_once(store):
+    data = png_bytes('red')
+    first, digest = store.name_for(data, 'tile.png')
+    assert store.put(first, digest, data)
+    second, _ = store.name_for(data, 'copy.png')
+    assert not store.put(second, digest, data)
+
+    assert store.read(first) == store.read(second) == data
+    stats = store.stats()
+    assert (stats['blobs'], stats['names'], stats['references']) == (1, 2, 2)
+    assert stats['dedup_saved_bytes'] == len(data)
+
+
+def test_same_name_different_content_do_not_collide(store):
+    red, blue = png_bytes('red'), png_bytes('blue')
+    red_name, red_digest = store.name_for(red, 'scene.png')
+    blue_name, blue_digest = store.name_for(blue, 'scene.png')
+    assert red_name != blue_name
+    store.put(red_name, red_digest, red)
+    store.put(blue_name, blue_digest, blue)
+    assert store.read(red_name) == red
+    assert store.read(blue_name) == blue
+
+
+def test_variants_have_expected_size_and_strong_etag(store):
+    data = png_bytes('green')
+    name, digest = store.name_for(data, 'tile.png')
+    store.put(name, digest, data)
+
+    path, etag = store.variant(name, 'thumb')
+    assert etag == f'{digest}-thumb'
+    assert max(Image.open(path).size) <= max(VARIANTS['thumb'][0])
+    path, etag = store.variant(name, '128')
+    assert Image.open(path).size == (128, 128)
+    assert store.variant(name) == (store.resolve(name), digest)
+    with pytest.raises(ValueError):
+        store.variant(name, 'huge')
+
+
+def test_legacy_flat_files_are_served_then_migrated(store):
+    data = png_bytes('white')
+    with open(os.path.join(store.root, 'old.png'), 'wb') as f:
+        f.write(data)
+    assert store.locate('old.png')[0] is None
+    assert store.migrate() == 1
+    assert not os.path.exists(os.path.join(store.root, 'old.png'))
+    assert store.read('old.png') == data
+    assert store.locate('old.png')[0] is not None
+
+
+def test_collect_removes_only_unreferenced_blobs_past_grace(store):
+    kept, dropped = png_bytes('red'), png_bytes('blue')
+    kept_name, kept_digest = store.name_for(kept, 'kept.png')
+    dropped_name, dropped_digest = store.name_for(dropped, 'dropped.png')
+    store.put(kept_name, kept_digest, kept)
+    store.put(dropped_name, dropped_digest, dropped)
+
+    assert store.collect({kept_name: 1}, grace_seconds=3600) == (0, 0)
+    assert store.collect({kept_name: 1}, grace_seconds=0, dry_run=True) == (1, len(dropped))
+    time.sleep(0.01)
+    assert store.collect({kept_name: 1}, grace_seconds=0) == (1, len(dropped))
+    assert store.resolve(dropped_name) is None
+    assert store.read(kept_name) == kept
@@ -0,0 +1,117 @@
+import json
+import os
+import threading
+import time
+
+from write_behind import DEAD_LETTER_NAME, WriteBehindBuffer
+
+
+class Rejected(Exception):
+    pass
+
+
+def make_row(name, user_id=1):
+    return (user_id, name, 'Forest', 0.9, 'v1', None)
+
+
+class Recorder:
+
+    def __init__(self, reject=(), fail_times=0):
+        self.rows = []
+        self.calls = 0
+        self.reject = set(reject)
+        self.fail_times = fail_times
+        self.written = threading.Event()
+
+    def __call__(self, rows):
+        self.calls += 1
+        if self.calls <= self.fail_times:
+            raise ConnectionError("base indisponible")
+        if any(row[1] in self.reject for row in rows):
+            raise Rejected("Data too long for column 'image_name'")
+        self.rows.extend(rows)
+        self.written.set()
+
+
+def test_single_row_is_written_after_flush_interval(tmp_path):
+    recorder = Recorder()
+    buffer = WriteBehindBuffer(recorder, str(tmp_path), batch_size=10, flush_interval=0.05)
+    try:
+        started = time.monotonic()
+        buffer.submit(make_row('a.png'))
+        assert recorder.written.wait(2.0)
+        assert time.monotonic() - started < 0.5
+        assert [row[1] for row in recorder.rows] == ['a.png']
+    finally:
+        buffer.close()
+
+
+def test_full_batch_is_written_without_waiting(tmp_path):
+    recorder = Recorder()
+    buffer = WriteBehindBuffer(recorder, str(tmp_path), batch_size=3, flush_interval=60)
+    try:
+        for i in range(3):
+            buffer.submit(make_row(f'{i}.png'))
+        assert recorder.written.wait(2.0)
+        assert len(recorder.rows) == 3
+    finally:
+        buffer.close()
+
+
+def test_rejected_row_goes_to_dead_letter_and_does_not_block(tmp_path):
+    recorder = Recorder(reject={'bad.png'})
+    buffer = WriteBehindBuffer(recorder, str(tmp_path), batch_size=10, flush_interval=0.05,
+                               permanent_errors=(Rejected,))
+    try:
+        for name in ('a.png', 'bad.png', 'b.png'):
+            buffer.submit(make_row(name))
+        assert buffer.flush(timeout=5)
+        assert [row[1] for row in recorder.rows] == ['a.png', 'b.png']
+        with open(os.path.join(str(tmp_path), DEAD_LETTER_NAME)) as f:
+            entries = [json.loads(line) for line in f]
+        assert [entry['row'][1] for entry in entries] == ['bad.png']
+        assert 'too long' in entries[0]['error']
+        assert buffer.stats()['dead_lettered'] == 1
+    finally:
+        buffer.close()
+
+
+def test_transient_error_keeps_rows_queued(tmp_path):
+    recorder = Recorder(fail_times=1)
+    buffer = WriteBehindBuffer(recorder, str(tmp_path), batch_size=10, flush_interval=0.01)
+    try:
+        buffer.submit(make_row('a.png'))
+        assert buffer.flush(timeout=5)
+        assert [row[1] for row in recorder.rows] == ['a.png']
+        assert buffer.stats()['failed_batches'] == 1
+        assert not os.path.exists(os.path.join(str(tmp_path), DEAD_LETTER_NAME))
+    finally:
+        buffer.close()
+
+
+def test_unflushed_rows_are_replayed_by_next_process(tmp_path):
+    failing = Recorder(fail_times=1000)
+    buffer = WriteBehindBuffer(failing, str(tmp_path), batch_size=10, flush_interval=0.01)
+    buffer.submit(make_row('a.png'))
+    buffer.submit(make_row('b.png', user_id=2))
+    assert not buffer.close(timeout=0.2)
+
+    recorder = Recorder()
+    replay = WriteBehindBuffer(recorder, str(tmp_path), batch_size=10, flush_interval=0.01)
+    try:
+        assert replay.stats()['replayed'] == 2
+        assert replay.flush(timeout=5)
+        assert [(row[0], row[1]) for row in recorder.rows] == [(1, 'a.png'), (2, 'b.png')]
+    finally:
+        replay.close()
+
+
+def test_pending_rows_are_visible_per_user(tmp_path):
+    buffer = WriteBehindBuffer(Recorder(fail_times=1000), str(tmp_path), flush_interval=60)
+    try:
+        buffer.submit(make_row('a.png'))
+        buffer.submit(make_row('b.png', user_id=2))
+        buffer.submit(make_row('c.png'))
+        assert [row['image_name'] for row in buffer.pending_for_user(1)] == ['c.png', 'a.png']
+    finally:
+        buffer.close(timeout=0.1)
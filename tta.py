@@ -0,0 +1,26 @@
+import numpy as np
+
+# Test-time augmentation : les 8 transformations du groupe diédral (4 rotations x miroir)
+# sont empilées en un seul batch, donc un seul appel au modèle.
+
+TTA_VARIANTS = 8
+
+
+def dihedral_batch(img_array):
+    flipped = img_array[:, ::-1]
+    variants = [np.rot90(img_array, k) for k in range(4)] + [np.rot90(flipped, k) for k in range(4)]
+    return np.ascontiguousarray(np.stack(variants))
+
+
+def average_predictions(probs):
+    # probs : (8, n_classes) ou (N * 8, n_classes) pour N images consécutives
+    probs = np.asarray(probs, dtype=np.float32)
+    return probs.reshape(-1, TTA_VARIANTS, probs.shape[-1]).mean(axis=1)
+
+
+def should_use_tta(mode, confidence, threshold):
+    if mode == 'on':
+        return True
+    if mode == 'auto':
+        return confidence < threshold
+    return False
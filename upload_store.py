@@ -0,0 +1,340 @@
+import argparse
+import hashlib
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from io import BytesIO
+
+from PIL import Image
+from werkzeug.utils import secure_filename
+
+# Stockage des images envoyées, adressé par contenu :
+#
+#   <root>/blobs/3f/a2/3fa2...c9.png     un fichier par contenu distinct (sha256)
+#   index (SQLite, hors de static/)       image_name -> hash, hash -> extension, taille,
+#                                         nombre de références, dernière utilisation
+#
+# Un même fichier envoyé plusieurs fois n'est écrit qu'une fois ; deux fichiers de même
+# nom mais de contenus différents ne s'écrasent plus (image_name = <hash16>_<nom>).
+# Deux niveaux de répertoires (65 536 au plus) : aucun répertoire ne grossit sans borne.
+#
+# Les image_name existants (fichiers à plat dans <root>) restent servis tels quels ;
+# 'migrate' les déplace dans les blobs en conservant leur nom, donc les lignes de
+# predictions et les URL /uploads/<image_name> déjà distribuées.
+#
+#   python upload_store.py stats
+#   python upload_store.py migrate
+#   python upload_store.py gc --grace-hours 24 [--dry-run]
+#
+# Le ramasse-miettes compte les références dans predictions et ses archives (backend
+# STORAGE_BACKEND comme app.py), recale les compteurs et supprime les blobs sans
+# référence inutilisés depuis le délai de grâce (écritures différées encore en file).
+#
+# Variantes réduites (/uploads/<image_name>?size=thumb|128), rangées comme les blobs sous
+# <root>/variants/<taille>/ : produites à l'enregistrement (eager_variants), sinon à la
+# première demande. Un contenu ne change jamais sous son hash : ETag fort <hash>-<taille>.
+
+BLOB_DIR = 'blobs'
+VARIANT_DIR = 'variants'
+NAME_HASH_LENGTH = 16
+# taille -> (dimensions, redimensionnement exact, format, extension)
+VARIANTS = {
+    # Miniature de l'historique, proportions conservées
+    'thumb': ((256, 256), False, 'JPEG', '.jpg'),
+    # Entrée du modèle (INPUT_SIZE de app.py, même rééchantillonnage que decode_image_bytes)
+    '128': ((128, 128), True, 'PNG', '.png')
+}
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class UploadStore:
+
+    def __init__(self, root, index_path, fsync=False, eager_variants=True):
+        self.root = root
+        self.index_path = index_path
+        self.fsync = fsync
+        self.eager_variants = eager_variants
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(root, BLOB_DIR), exist_ok=True)
+        # Transactions explicites : l'écriture d'un nouveau blob et le ramasse-miettes
+        # se sérialisent sur le verrou d'écriture de l'index, y compris entre processus
+        self._db = sqlite3.connect(index_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS blobs (
+                hash TEXT PRIMARY KEY,
+                extension TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                ref_count INTEGER NOT NULL DEFAULT 0,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS upload_names (
+                image_name TEXT PRIMARY KEY,
+                hash TEXT NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_upload_names_hash ON upload_names (hash)")
+
+    def name_for(self, data, original_name=None, extension='.png'):
+        # Renvoie (image_name, hash) ; même contenu et même nom -> même image_name
+        digest = content_hash(data)
+        name = secure_filename(original_name or '') or f"upload{extension}"
+        return f"{digest[:NAME_HASH_LENGTH]}_{name}", digest
+
+    def blob_path(self, digest, extension):
+        return os.path.join(self.root, BLOB_DIR, digest[:2], digest[2:4], f"{digest}{extension}")
+
+    def put(self, image_name, digest, data):
+        # Enregistre une référence ; renvoie True si le contenu était nouveau (blob écrit)
+        extension = os.path.splitext(image_name)[1].lower() or '.png'
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                created = self._db.execute(
+                    "INSERT OR IGNORE INTO blobs (hash, extension, size, ref_count, last_used) VALUES (?, ?, ?, 1, ?)",
+                    (digest, extension, len(data), time.time())
+                ).rowcount == 1
+                if not created:
+                    extension = self._db.execute("SELECT extension FROM blobs WHERE hash = ?", (digest,)).fetchone()[0]
+                    self._db.execute("UPDATE blobs SET ref_count = ref_count + 1, last_used = ? WHERE hash = ?",
+                                     (time.time(), digest))
+                # Blob nouveau, ou fichier perdu : (ré)écrit avant la validation
+                path = self.blob_path(digest, extension)
+                if created or not os.path.exists(path):
+                    self._write_blob(path, data)
+                self._db.execute("INSERT OR REPLACE INTO upload_names (image_name, hash) VALUES (?, ?)",
+                                 (image_name, digest))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        if created and self.eager_variants:
+            for size in VARIANTS:
+                self._make_variant(digest, size, data)
+        return created
+
+    def _write_blob(self, path, data):
+        # Fichier temporaire puis renommage : jamais de blob tronqué visible
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def locate(self, image_name):
+        # (hash, chemin) du fichier servi pour image_name, ou None ; hash None pour un ancien
+        # fichier à plat pas encore migré
+        image_name = secure_filename(image_name)
+        if not image_name:
+            return None
+        with self._lock:
+            row = self._db.execute(
+                "SELECT b.hash, b.extension FROM upload_names n JOIN blobs b ON b.hash = n.hash WHERE n.image_name = ?",
+                (image_name,)
+            ).fetchone()
+        if row is not None:
+            path = self.blob_path(*row)
+            if os.path.exists(path):
+                return row[0], path
+        legacy = os.path.join(self.root, image_name)
+        return (None, legacy) if os.path.isfile(legacy) else None
+
+    def resolve(self, image_name):
+        located = self.locate(image_name)
+        return located[1] if located is not None else None
+
+    def variant_path(self, digest, size):
+        extension = VARIANTS[size][3]
+        return os.path.join(self.root, VARIANT_DIR, size, digest[:2], digest[2:4], f"{digest}{extension}")
+
+    def _make_variant(self, digest, size, data):
+        dimensions, exact, image_format, _ = VARIANTS[size]
+        try:
+            img = Image.open(BytesIO(data)).convert('RGB')
+            if exact:
+                img = img.resize(dimensions, Image.NEAREST)
+            else:
+                img.thumbnail(dimensions)
+            out = BytesIO()
+            img.save(out, image_format, **({'quality': 80, 'optimize': True} if image_format == 'JPEG' else {}))
+        except Exception as e:
+            print(f"Erreur lors de la création de la variante {size} de {digest}: {e}")
+            return None
+        path = self.variant_path(digest, size)
+        self._write_blob(path, out.getvalue())
+        return path
+
+    def variant(self, image_name, size='full'):
+        # Renvoie (chemin, etag) de l'image ou de sa variante, ou None ; ValueError si taille inconnue
+        if size != 'full' and size not in VARIANTS:
+            raise ValueError(f"size inconnue: {size} (full, {', '.join(VARIANTS)})")
+        located = self.locate(image_name)
+        if located is None:
+            return None
+        digest, path = located
+        if digest is None:
+            # Ancien fichier à plat : hash recalculé à chaque accès, jusqu'à 'migrate'
+            with open(path, 'rb') as f:
+                digest = content_hash(f.read())
+        if size == 'full':
+            return path, digest
+        variant_path = self.variant_path(digest, size)
+        if not os.path.exists(variant_path):
+            # Première demande : la variante est produite ici, puis servie telle quelle
+            with open(path, 'rb') as f:
+                variant_path = self._make_variant(digest, size, f.read())
+            if variant_path is None:
+                # Image illisible par PIL : servie telle quelle
+                return path, digest
+        return variant_path, f"{digest}-{size}"
+
+    def read(self, image_name):
+        path = self.resolve(image_name)
+        if path is None:
+            raise FileNotFoundError(image_name)
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def stats(self):
+        with self._lock:
+            blobs, size, refs = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(ref_count), 0) FROM blobs").fetchone()
+            names = self._db.execute("SELECT COUNT(*) FROM upload_names").fetchone()[0]
+            # Octets qu'aurait occupés en plus un stockage sans déduplication
+            saved = self._db.execute(
+                "SELECT COALESCE(SUM(size * (ref_count - 1)), 0) FROM blobs WHERE ref_count > 1").fetchone()[0]
+        return {'blobs': blobs, 'bytes': size, 'names': names, 'references': refs, 'dedup_saved_bytes': saved}
+
+    def migrate(self, progress=None):
+        # Anciens fichiers à plat -> blobs, sous leur nom actuel
+        moved = 0
+        for name in sorted(os.listdir(self.root)):
+            path = os.path.join(self.root, name)
+            if not os.path.isfile(path) or name != secure_filename(name):
+                continue
+            with open(path, 'rb') as f:
+                data = f.read()
+            self.put(name, content_hash(data), data)
+            os.remove(path)
+            moved += 1
+            if progress is not None:
+                progress(moved)
+        return moved
+
+    def collect(self, reference_counts, grace_seconds=86400, dry_run=False):
+        # reference_counts : {image_name: nombre de prédictions}. Renvoie (blobs supprimés, octets libérés)
+        with self._lock:
+            names = self._db.execute("SELECT image_name, hash FROM upload_names").fetchall()
+        counts = {}
+        for image_name, digest in names:
+            counts[digest] = counts.get(digest, 0) + reference_counts.get(image_name, 0)
+
+        cutoff = time.time() - grace_seconds
+        removed, freed = 0, 0
+        with self._lock:
+            blobs = self._db.execute("SELECT hash, extension, size FROM blobs").fetchall()
+        for digest, extension, size in blobs:
+            if counts.get(digest, 0):
+                if not dry_run:
+                    with self._lock:
+                        self._db.execute("UPDATE blobs SET ref_count = ? WHERE hash = ?", (counts[digest], digest))
+                continue
+            if dry_run:
+                with self._lock:
+                    old = self._db.execute("SELECT last_used < ? FROM blobs WHERE hash = ?", (cutoff, digest)).fetchone()
+                if old and old[0]:
+                    removed, freed = removed + 1, freed + size
+                continue
+            # Même verrou que put() : un envoi concurrent du même contenu voit soit le
+            # blob encore présent, soit l'absence de ligne et le réécrit
+            with self._lock:
+                self._db.execute("BEGIN IMMEDIATE")
+                try:
+                    deleted = self._db.execute("DELETE FROM blobs WHERE hash = ? AND last_used < ?",
+                                               (digest, cutoff)).rowcount == 1
+                    if deleted:
+                        self._db.execute("DELETE FROM upload_names WHERE hash = ?", (digest,))
+                        for path in [self.blob_path(digest, extension)] + [
+                                self.variant_path(digest, size) for size in VARIANTS]:
+                            if os.path.exists(path):
+                                os.remove(path)
+                    self._db.execute("COMMIT")
+                except Exception:
+                    self._db.execute("ROLLBACK")
+                    raise
+            if deleted:
+                removed, freed = removed + 1, freed + size
+        return removed, freed
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def upload_store_from_env(root):
+    return UploadStore(
+        os.getenv("UPLOAD_STORE_DIR", root),
+        os.getenv("UPLOAD_INDEX_PATH", "uploads.sqlite"),
+        fsync=os.getenv("UPLOAD_FSYNC", "false").lower() == "true",
+        eager_variants=os.getenv("UPLOAD_EAGER_VARIANTS", "true").lower() == "true"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stockage des images envoyées (adressé par contenu)")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('stats', help="Blobs, octets et références")
+    sub.add_parser('migrate', help="Déplace les anciens fichiers à plat dans les blobs")
+    gc = sub.add_parser('gc', help="Supprime les blobs qu'aucune prédiction ne référence")
+    gc.add_argument('--grace-hours', type=float, default=24)
+    gc.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    uploads = upload_store_from_env('static/uploads')
+    try:
+        if args.command == 'stats':
+            for key, value in uploads.stats().items():
+                print(f"{key}: {value}")
+            return 0
+
+        if args.command == 'migrate':
+            moved = uploads.migrate(lambda count: print(f"  {count} fichier(s) migré(s)", end='\r', flush=True))
+            print(f"Migration terminée, {moved} fichier(s) déplacé(s)")
+            return 0
+
+        from stores import StorageError, store_from_env
+        store = store_from_env("eurosat_db")
+        try:
+            references = store.image_reference_counts()
+        except StorageError as e:
+            print(f"Erreur de lecture des références: {e}")
+            return 1
+        finally:
+            store.close()
+        removed, freed = uploads.collect(references, args.grace_hours * 3600, args.dry_run)
+        action = "à supprimer" if args.dry_run else "supprimé(s)"
+        print(f"{removed} blob(s) {action}, {freed / 1e6:.1f} Mo")
+        return 0
+    finally:
+        uploads.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,348 @@
+import base64
+import json
+import os
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Écriture différée des prédictions : /api/predict répond dès que la ligne est dans le
+# journal local et la file mémoire, un thread l'insère ensuite en base par lots
+# (executemany), au plus tard après flush_interval secondes.
+#
+# Journal : un fichier JSON lignes par démarrage de processus
+# (predictions-<pid>-<démarrage>-<aléa>.jsonl) dans spill_dir ; un PID réutilisé après
+# un crash (PID 1 en conteneur) ne rouvre jamais le journal de son prédécesseur.
+#   {"seq": 12, "row": [...]}     ligne à insérer
+#   {"flushed": 12}               tout jusqu'à seq 12 est en base
+# Le journal est compacté (lignes en file seulement) dès que les marqueurs et lignes
+# écrites dépassent le double de la file, même si celle-ci ne se vide jamais.
+# Au démarrage, les journaux des processus arrêtés (verrou libre) sont repris dans la
+# file du nouveau processus : rien n'est perdu après un crash ou une panne MySQL. Livraison « au moins une fois » : un
+# crash entre le COMMIT et l'écriture du marqueur peut dupliquer le dernier lot.
+#
+# Erreurs de write_fn : les erreurs passagères (connexion, base indisponible) laissent le
+# lot en tête de file avec un délai croissant. Une erreur de permanent_errors (données
+# refusées par la base) fait réessayer le lot ligne par ligne : les lignes refusées
+# partent dans spill_dir/rejected.jsonl au lieu de bloquer toutes les suivantes.
+
+
+JOURNAL_COMPACT_MIN_LINES = 1000
+DEAD_LETTER_NAME = 'rejected.jsonl'
+
+
+class BufferFull(Exception):
+    pass
+
+
+def _encode_row(row):
+    row = list(row)
+    row[5] = base64.b64encode(row[5]).decode('ascii') if row[5] is not None else None
+    row[6] = row[6].isoformat()
+    return row
+
+
+def _decode_row(row):
+    row = list(row)
+    if len(row) == 6:
+        # Journal écrit avant la colonne probabilities
+        row.insert(5, None)
+    row[5] = base64.b64decode(row[5]) if row[5] is not None else None
+    row[6] = datetime.fromisoformat(row[6])
+    return tuple(row)
+
+
+class WriteBehindBuffer:
+    # write_fn(rows) insère une liste de tuples
+    # (user_id, image_name, predicted_class, confidence, model_version, probabilities, timestamp)
+
+    def __init__(self, write_fn, spill_dir, max_pending=10000, batch_size=200, flush_interval=0.5,
+                 put_timeout=2.0, fsync=False, permanent_errors=()):
+        self.write_fn = write_fn
+        self.permanent_errors = tuple(permanent_errors)
+        self.spill_dir = spill_dir
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.fsync = fsync
+        os.makedirs(spill_dir, exist_ok=True)
+
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._seq = 0
+        self._flushed_seq = 0
+        self._closed = False
+        self._flush_requested = False
+        self._failures = 0
+        self._stats = Counter()
+
+        self._journal_lines = 0
+        self._journal_path = os.path.join(
+            spill_dir, f"predictions-{os.getpid()}-{int(time.time())}-{os.urandom(4).hex()}.jsonl")
+        self._journal = self._open_journal(self._journal_path)
+        self._dead_letter_path = os.path.join(spill_dir, DEAD_LETTER_NAME)
+        self._adopt_orphans()
+
+        self._worker = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._worker.start()
+
+    def _adopt_orphans(self):
+        # Les lignes non écrites des processus arrêtés passent dans notre journal et notre
+        # file : le flusher les réessaie même si la base est encore indisponible
+        for name in sorted(os.listdir(self.spill_dir)):
+            path = os.path.join(self.spill_dir, name)
+            if not (name.startswith('predictions-') and name.endswith('.jsonl')) or path == self._journal_path:
+                continue
+            with open(path, 'r+', encoding='utf-8') as f:
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        # Journal d'un worker encore vivant
+                        continue
+                rows = {}
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Dernière ligne tronquée par le crash
+                        continue
+                    if 'flushed' in entry:
+                        for seq in [seq for seq in rows if seq <= entry['flushed']]:
+                            del rows[seq]
+                    else:
+                        rows[entry['seq']] = _decode_row(entry['row'])
+                for seq in sorted(rows):
+                    self._enqueue(rows[seq])
+                if rows:
+                    self._stats['replayed'] += len(rows)
+                    print(f"Écriture différée: {len(rows)} prédiction(s) reprise(s) depuis {name}")
+                os.remove(path)
+
+    def _open_journal(self, path):
+        journal = open(path, 'a', encoding='utf-8')
+        if fcntl is not None:
+            fcntl.flock(journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return journal
+
+    def _append_journal(self, entry):
+        self._journal.write(json.dumps(entry) + '\n')
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+        self._journal_lines += 1
+
+    def _compact_journal(self):
+        # Réécrit le journal avec les seules lignes en file (appelé sous self._cond).
+        # Fichier temporaire verrouillé puis renommé : un processus qui reprend les
+        # journaux orphelins voit l'ancien ou le nouveau, toujours verrouillé
+        tmp_path = os.path.join(self.spill_dir, f".compact-{os.path.basename(self._journal_path)}")
+        journal = self._open_journal(tmp_path)
+        try:
+            for seq, row, _ in self._queue:
+                journal.write(json.dumps({'seq': seq, 'row': _encode_row(row)}) + '\n')
+            journal.flush()
+            if self.fsync:
+                os.fsync(journal.fileno())
+            os.replace(tmp_path, self._journal_path)
+        except Exception:
+            journal.close()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._journal.close()
+        self._journal = journal
+        self._journal_lines = len(self._queue)
+        self._stats['compactions'] += 1
+
+    def submit(self, row):
+        # row sans horodatage : il est fixé ici pour que l'ordre de l'historique soit
+        # celui des requêtes et non celui des écritures en base
+        row = tuple(row) + (datetime.now().replace(microsecond=0),)
+        deadline = time.monotonic() + self.put_timeout
+        with self._cond:
+            while len(self._queue) >= self.max_pending and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['rejected'] += 1
+                    raise BufferFull(f"File d'écriture pleine ({len(self._queue)} lignes en attente)")
+                self._cond.wait(remaining)
+            if self._closed:
+                raise BufferFull("File d'écriture fermée")
+            self._enqueue(row)
+            self._stats['submitted'] += 1
+            # Première ligne en file : le flusher attend sans délai et doit armer flush_interval
+            if len(self._queue) == 1 or len(self._queue) >= self.batch_size:
+                self._cond.notify_all()
+        return row
+
+    def _enqueue(self, row):
+        # Journal d'abord : la ligne n'est acquittée qu'une fois sur disque
+        self._seq += 1
+        self._append_journal({'seq': self._seq, 'row': _encode_row(row)})
+        self._queue.append((self._seq, row, time.monotonic()))
+
+    def pending_for_user(self, user_id):
+        # Lignes de l'utilisateur pas encore en base, les plus récentes d'abord
+        with self._cond:
+            rows = [row for _, row, _ in self._queue if row[0] == user_id]
+        return [{
+            'image_name': row[1],
+            'predicted_class': row[2],
+            'confidence': row[3],
+            'probabilities': row[5],
+            'timestamp': row[6]
+        } for row in reversed(rows)]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                # Lot complet, ou plus ancienne ligne en attente depuis flush_interval
+                while not self._closed and len(self._queue) < self.batch_size and not self._flush_requested:
+                    if not self._queue:
+                        self._cond.wait()
+                        continue
+                    remaining = self._queue[0][2] + self.flush_interval - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if not self._queue:
+                    if self._closed:
+                        return
+                    self._flush_requested = False
+                    continue
+                batch = [self._queue[i] for i in range(min(self.batch_size, len(self._queue)))]
+
+            try:
+                self.write_fn([row for _, row, _ in batch])
+                done, error = batch, None
+                with self._cond:
+                    self._stats['written'] += len(batch)
+                    self._stats['batches'] += 1
+            except self.permanent_errors as e:
+                print(f"Écriture différée: lot de {len(batch)} ligne(s) refusé, reprise ligne par ligne: {e}")
+                done, error = self._write_one_by_one(batch)
+            except Exception as e:
+                done, error = [], e
+
+            if done:
+                self._mark_written(done)
+            if error is not None:
+                # Base indisponible : les lignes restantes restent en file et dans le journal
+                with self._cond:
+                    self._failures += 1
+                    self._stats['failed_batches'] += 1
+                    delay = min(30.0, 0.5 * 2 ** min(self._failures, 6))
+                    print(f"Écriture différée: échec d'un lot de {len(batch) - len(done)} ligne(s), "
+                          f"nouvel essai dans {delay:.1f}s: {error}")
+                    if self._closed:
+                        return
+                    self._cond.wait(delay)
+
+    def _write_one_by_one(self, batch):
+        # Renvoie (lignes traitées, écrites ou mises de côté, dans l'ordre de la file ;
+        # erreur passagère qui a interrompu la reprise ou None)
+        done = []
+        for entry in batch:
+            _, row, _ = entry
+            try:
+                self.write_fn([row])
+                with self._cond:
+                    self._stats['written'] += 1
+            except self.permanent_errors as e:
+                self._dead_letter(row, e)
+            except Exception as e:
+                return done, e
+            done.append(entry)
+        return done, None
+
+    def _dead_letter(self, row, error):
+        with open(self._dead_letter_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'row': _encode_row(row), 'error': str(error),
+                                'rejected_at': datetime.now().isoformat()}) + '\n')
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        with self._cond:
+            self._stats['dead_lettered'] += 1
+        print(f"Écriture différée: prédiction {row[1]} (utilisateur {row[0]}) refusée par la base, "
+              f"mise de côté dans {self._dead_letter_path}: {error}")
+
+    def _mark_written(self, done):
+        # Retire de la file les lignes traitées (toujours en tête) et le note au journal
+        with self._cond:
+            self._failures = 0
+            for _ in done:
+                self._queue.popleft()
+            self._flushed_seq = done[-1][0]
+            if self._queue:
+                self._append_journal({'flushed': self._flushed_seq})
+                if self._journal_lines >= 2 * len(self._queue) + JOURNAL_COMPACT_MIN_LINES:
+                    try:
+                        self._compact_journal()
+                    except OSError as e:
+                        # Le journal actuel reste valable, compactage retenté au lot suivant
+                        print(f"Écriture différée: échec du compactage du journal: {e}")
+            else:
+                # Tout est en base : le journal repart de zéro
+                self._journal.seek(0)
+                self._journal.truncate()
+                self._journal.flush()
+                self._journal_lines = 0
+                self._flush_requested = False
+            self._cond.notify_all()
+
+    def flush(self, timeout=10.0):
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._flush_requested = bool(self._queue)
+            self._cond.notify_all()
+            while self._queue and time.monotonic() < deadline:
+                self._cond.wait(min(0.1, max(0.0, deadline - time.monotonic())))
+            return not self._queue
+
+    def close(self, timeout=10.0):
+        # Vidage à l'arrêt ; ce qui n'a pas pu être écrit reste dans le journal
+        if self._closed:
+            return not self._queue
+        flushed = self.flush(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._worker.join(timeout=1)
+        self._journal.close()
+        if flushed:
+            os.remove(self._journal_path)
+        else:
+            print(f"Écriture différée: {len(self._queue)} ligne(s) conservée(s) dans {self._journal_path}")
+        return flushed
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                'pending': len(self._queue),
+                'max_pending': self.max_pending,
+                'batch_size': self.batch_size,
+                'flush_interval_s': self.flush_interval,
+                'consecutive_failures': self._failures,
+                'journal': self._journal_path,
+                'dead_letter': self._dead_letter_path
+            })
+            return stats
+
+
+def merge_pending(rows, pending):
+    # Ajoute en tête de la première page les lignes encore en file, sans doublon si le
+    # flusher les a écrites entre-temps (même image, classe et horodatage)
+    if not pending:
+        return rows
+    seen = {(row['image_name'], row['predicted_class'], row['timestamp']) for row in rows}
+    fresh = [row for row in pending if (row['image_name'], row['predicted_class'], row['timestamp']) not in seen]
+    return fresh + list(rows)